@@ -103,6 +103,9 @@ class ConfigReference:
         "cpu": {
             "normal": (np.float16, torch.float16),
             "high": (np.float32, torch.float32),
+            # bf16 and int8 generators take and return float32 tensors
+            "bf16": (np.float32, torch.float32),
+            "int8": (np.float32, torch.float32),
         },
     }
     # palette based images are not naitvely intended by most image formats, only bmp with rle compression
@@ -157,6 +160,72 @@ class ConfigReference:
         "3": ("large", 4096*4096),
         "4": ("extra large", 8192*8192)
     }
+    # number of patches sent through the generator at once; "auto" derives it
+    # from the free device memory
+    tile_batch_sizes: List[str] = ["auto", "1", "2", "4", "8", "16"]
+    max_tile_batch_size: int = 16
+    # a 512x512 (262144 pixel) output requires roughly 0.1835 GiB of video memory
+    vram_per_output_pixel: float = 0.1835 * 1024**3 / 262144
+    # peak memory (bytes) the generator needs per upscaled pixel on the cpu, measured
+    # for 2x and 4x upscales with a small margin
+    ram_per_output_pixel: Dict[str, float] = {"high": 300, "bf16": 150, "int8": 300}
+    # memory (GiB) the model registry may hold to keep generators loaded between exports
+    model_cache_sizes: List[str] = ["0", "0.5", "1", "2", "4"]
+    # memory (GiB) of upscaled tiles kept for identical tiles to reuse
+    tile_cache_sizes: List[str] = ["0", "0.25", "0.5", "1", "2"]
+    # upscaled tiles held while the tiles before them wait for a generator batch to fill
+    max_waiting_tiles: int = 256
+    # images read ahead of the batch being upscaled and queued to be written by the
+    # export pipeline, 0 processes one image at a time
+    pipeline_depths: List[str] = ["0", "1", "2", "4", "8"]
+    pipeline_read_workers: int = 2
+    pipeline_write_workers: int = 2
+    # export worker processes (cpu): images each worker holds, seconds between checks
+    # that the workers are alive and seconds they are given to exit
+    worker_start_method: str = "spawn"
+    worker_queue_depth: int = 2
+    worker_poll_interval: float = 0.1
+    worker_join_timeout: float = 10.0
+    max_worker_restarts: int = 4
+    # seconds tile workers are given to upscale their tiles of a batch before they
+    # are considered stuck, terminated and their tiles upscaled by the export thread
+    tile_batch_timeout: float = 600.0
+    # input pixels split into patches (and rows converted to the export datatype)
+    # at a time by out-of-core upscaling
+    out_of_core_band_pixels: int = 1 << 22
+    # memory (GiB) cpu upscaling may use
+    max_memory_sizes: List[str] = ["1", "2", "4", "8", "16", "32", "64"]
+    # bake: unstructured pruning baked into the weights, structured: narrower convs
+    pruning_modes: List[str] = ["bake", "structured", "none"]
+    inference_backends: List[str] = ["eager", "torchscript", "compile", "onnxruntime"]
+    # tile triage: size and overlap (input pixels) of the triaged tiles and the variance
+    # (of channel values between 0 and 1) below which a tile is Lanczos upscaled
+    triage_tile_size: int = 128
+    triage_pad_size: int = 8
+    triage_variance_thresholds: List[str] = ["0", "1e-05", "0.0001", "0.001"]
+    # margin (input pixels) around visible pixels in which transparent color is still
+    # upscaled with the generator
+    transparent_dilation: int = 4
+    # fraction of an image's triage tiles that must be fully transparent for its
+    # transparent tiles to be skipped (splitting a mostly opaque image into triage
+    # tiles costs more than it saves)
+    transparent_tiles_threshold: float = 0.1
+    # fraction of an alpha channel's pixels that may lie between its two levels for it
+    # to be treated as binary
+    binary_alpha_tolerance: float = 0.01
+    # pixels per chunk of the single pass that gathers an image's statistics
+    statistics_chunk_pixels: int = 1 << 22
+    # largest difference (of channel values between 0 and 1) between the R, G and B of
+    # a pixel for an RGB image to be processed as greyscale
+    greyscale_rgb_tolerance: float = 1 / 255
+    # off: no normal maps, auto: detected by name or statistics, all: every RGB(A) image
+    normal_map_modes: List[str] = ["off", "auto", "all"]
+    # name endings of normal maps, i.e. brick_nrm.png
+    normal_map_name_filters: List[str] = ["n", "nrm", "nor", "norm", "normal", "normals", "normalmap"]
+    # share of sampled pixels that must decode to unit vectors (within the tolerance)
+    # for an image to be detected as a normal map
+    normal_map_length_tolerance: float = 0.1
+    normal_map_min_coverage: float = 0.9
 
 
 class SearchConfig:
@@ -216,6 +285,38 @@ class ExportConfig:
     # TODO: implement
     split_large_image: bool = True
     patch_size: str = "3"
+    tile_batch_size: str = ConfigReference.tile_batch_sizes[0]
+    blend_patch_overlap: bool = False
+    # upscale greyscale and alpha planes three per forward pass instead of one
+    pack_single_channels: bool = False
+    # fill constant tiles, Lanczos upscale low detail tiles, generator for the rest
+    tile_triage: bool = False
+    triage_variance_threshold: float = 0.0001
+    # upscale color tiles under fully transparent alpha bilinearly
+    skip_transparent_tiles: bool = False
+    # upscale binary (cutout) alpha channels with an edge-aware threshold
+    binary_alpha_upscale: bool = False
+    normal_map_mode: str = ConfigReference.normal_map_modes[0]
+    renormalize_normals: bool = False
+    model_cache_memory_gb: float = 1.0
+    tile_cache_memory_gb: float = 0.5
+    pipeline_depth: int = 2
+    # cpu worker processes, threads_per_worker 0 splits the cores between the workers
+    workers: int = 1
+    threads_per_worker: int = 0
+    # cpu worker processes that split the tiles of each image between them
+    tile_workers: int = 1
+    # stitch split images into a memory-mapped file and split them band by band
+    out_of_core: bool = False
+    pruning_mode: str = ConfigReference.pruning_modes[0]
+    # memory (GiB) cpu upscaling may use, images are split to fit it
+    max_memory_gb: float = 4.0
+    backend: str = ConfigReference.inference_backends[0]
+    # onnxruntime threads, 0 lets onnxruntime decide
+    intra_op_threads: int = 0
+    inter_op_threads: int = 0
+    # textures used to calibrate int8 quantization, the exported textures if empty
+    calibration_dir: str = ""
 
 
 class GUIConfig:
@@ -0,0 +1,95 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Tuple, Union
+
+import torch
+from torch import nn
+
+from utils.logger import write_log_to_file
+
+# (scale, device, precision, backend, pruning mode, (intra-op threads, inter-op threads))
+ModelKey = Tuple[Union[int, float], str, str, str, str, Tuple[int, int]]
+
+
+class ModelRegistry:
+    """
+    Process-wide registry of loaded generators.
+
+    Generators are kept warm between exports so that repeated exports with the
+    same scale, device, precision, backend, pruning mode and ONNX Runtime thread
+    counts skip loading and preparing the weights. Once the memory held by the registered generators exceeds the
+    memory cap, the least recently used generators are evicted.
+    """
+
+    def __init__(self):
+        self._models: "OrderedDict[ModelKey, Tuple[nn.Module, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def model_size(model: nn.Module) -> int:
+        """Bytes held by the parameters and buffers (i.e. pruning masks) of a model."""
+        if hasattr(model, "memory_size"):  # models that hold their weights outside of torch
+            return model.memory_size
+        return sum(
+            tensor.numel() * tensor.element_size()
+            for tensor in list(model.parameters()) + list(model.buffers())
+        )
+
+    @property
+    def memory_used(self) -> int:
+        return sum(size for _, size in self._models.values())
+
+    def get(
+        self,
+        key: ModelKey,
+        loader: Callable[[], nn.Module],
+        memory_cap_gb: float,
+    ) -> nn.Module:
+        """
+        Returns the generator registered under key, loading it with loader if it
+        isn't registered. A memory cap of 0 disables the registry and releases
+        the generators it holds.
+        """
+        memory_cap = memory_cap_gb * 1024**3
+        with self._lock:
+            start_time = time.perf_counter()
+            # the cap may have been lowered since the last lookup
+            self.evict(memory_cap)
+            if key in self._models:
+                self._models.move_to_end(key)
+                write_log_to_file(
+                    "INFO",
+                    f"Reusing loaded generator {key} (lookup took {round((time.perf_counter()-start_time)*1000, 3)} ms).",
+                )
+                return self._models[key][0]
+
+            model = loader()
+            size = self.model_size(model)
+            write_log_to_file(
+                "INFO",
+                f"Loaded generator {key} ({round(size/1024**2, 1)} MiB) in {round(time.perf_counter()-start_time, 2)} seconds.",
+            )
+            self._models[key] = (model, size)
+            self.evict(memory_cap)
+            return model
+
+    def evict(self, memory_cap: float) -> None:
+        """Evicts the least recently used generators until the registry fits in memory_cap bytes."""
+        evicted_cuda = False
+        while self._models and self.memory_used > memory_cap:
+            key, _ = self._models.popitem(last=False)
+            evicted_cuda = evicted_cuda or key[1] == "cuda"
+            write_log_to_file(
+                "INFO",
+                f"Evicted generator {key} from the model registry.",
+            )
+        if evicted_cuda:
+            torch.cuda.empty_cache()
+
+    def clear(self) -> None:
+        with self._lock:
+            self.evict(0)
+
+
+model_registry = ModelRegistry()
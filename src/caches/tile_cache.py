@@ -0,0 +1,80 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+import numpy as np
+import torch
+
+# (content hash of the padded input tile, shape, dtype, generator context and batch size)
+TileKey = Hashable
+
+
+class TileCache:
+    """
+    Process-wide cache of upscaled tiles keyed by the content of their input.
+
+    Trim sheets, brick atlases and UDIM fills repeat identical tiles within an
+    image and across the images of an export. Since the key covers the whole
+    input tile, including its padding, and the size of the generator batches it
+    is upscaled in, a cached tile is identical to the tile the generator would
+    output and the stitched image stays seamless. Once the memory held by the
+    cached tiles exceeds the memory cap, the least recently used tiles are
+    evicted.
+    """
+
+    def __init__(self):
+        self._tiles: "OrderedDict[TileKey, torch.Tensor]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_used: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+
+    @staticmethod
+    def key(tile: np.ndarray, context: tuple) -> TileKey:
+        """Key of an input tile (h, w, c) upscaled with the generator described by context."""
+        digest = hashlib.blake2b(np.ascontiguousarray(tile).data, digest_size=16).digest()
+        return (digest, tile.shape, str(tile.dtype), context)
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get(self, key: TileKey) -> Optional[torch.Tensor]:
+        with self._lock:
+            if key not in self._tiles:
+                return None
+            self._tiles.move_to_end(key)
+            return self._tiles[key]
+
+    def put(self, key: TileKey, tile: torch.Tensor, memory_cap_gb: float) -> None:
+        """Caches an upscaled tile and evicts the least recently used tiles over memory_cap_gb."""
+        # a tile sliced from a batch would keep the whole batch alive
+        tile = tile.clone()
+        with self._lock:
+            if key in self._tiles:
+                return
+            self._tiles[key] = tile
+            self.memory_used += tile.numel() * tile.element_size()
+            self.evict(memory_cap_gb * 1024**3)
+
+    def count(self, hits: int, misses: int) -> None:
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def evict(self, memory_cap: float) -> None:
+        """Evicts the least recently used tiles until the cache fits in memory_cap bytes."""
+        while self._tiles and self.memory_used > memory_cap:
+            _, tile = self._tiles.popitem(last=False)
+            self.memory_used -= tile.numel() * tile.element_size()
+
+    def clear(self) -> None:
+        """Releases the cached tiles and resets the hit and miss counters."""
+        with self._lock:
+            self.evict(0)
+            self.hits, self.misses = 0, 0
+
+
+tile_cache = TileCache()
@@ -19,11 +19,15 @@ class ExportSettingsManager:
     def set_device(self, parent, value):
         ExportConfig.device = value
         if ExportConfig.device == "cpu":
+            # cpu upscaling runs in full precision, bfloat16 or quantized to int8
+            parent.upscale_precision_subframe.menu.configure(values=["high", "bf16", "int8"])
             parent.on_upscale_precision_change("high")
-            disable_UI_elements(parent.upscale_precision_subframe.menu)
         else:
+            parent.upscale_precision_subframe.menu.configure(
+                values=list(confref.upscale_precision_levels["cuda"].keys())
+            )
             parent.on_upscale_precision_change("normal")
-            enable_UI_elements(parent.upscale_precision_subframe.menu)
+        enable_UI_elements(parent.upscale_precision_subframe.menu)
 
     def set_color_mode(self, value):
         value = {
@@ -57,7 +61,8 @@ class ExportSettingsManager:
 
     def set_upscale_precision(self, parent, value):
         ExportConfig.upscale_precision = value
-        if ExportConfig.upscale_precision == "high":
+        # images upscaled on the cpu are split to fit the memory budget at any precision
+        if ExportConfig.upscale_precision == "high" and ExportConfig.device == "cuda":
             # self.set_patch_size(1)
             try:
                 parent.upscale_precision_subframe.menu.set("high")
@@ -67,6 +72,8 @@ class ExportSettingsManager:
                 parent.split_large_images_subframe.label.pack_forget(side=LEFT)
                 parent.patch_size_subframe.label.pack_forget(side=LEFT)
                 parent.patch_size_subframe.slider.pack_forget(side=RIGHT)
+                parent.tile_batch_size_subframe.grid_forget()
+                parent.blend_overlap_subframe.grid_forget()
                 parent.split_large_images_subframe.checkbox.deselect()
                 parent.on_splitlargeimages_change(value=False)
             except:
@@ -84,7 +91,13 @@ class ExportSettingsManager:
                 parent.split_large_images_subframe.label.pack(side=LEFT)
                 parent.patch_size_subframe.label.pack(side=LEFT)
                 parent.patch_size_subframe.slider.pack(side=RIGHT)
-                parent.upscale_precision_subframe.menu.set("normal")
+                parent.tile_batch_size_subframe.grid(
+                    row=11, column=0, padx=35, pady=5, sticky="new"
+                )
+                parent.blend_overlap_subframe.grid(
+                    row=12, column=0, padx=35, pady=5, sticky="new"
+                )
+                parent.upscale_precision_subframe.menu.set(value)
                 parent.split_large_images_subframe.checkbox.select()
                 parent.on_splitlargeimages_change(value=True)
                 parent.on_patch_size_change(ExportConfig.patch_size)
@@ -113,12 +126,16 @@ class ExportSettingsManager:
             )
             try:
                 disable_UI_elements(parent.patch_size_subframe.slider)
+                disable_UI_elements(parent.tile_batch_size_subframe.menu)
+                disable_UI_elements(parent.blend_overlap_subframe.checkbox)
             except:
                 pass
         else:
             parent.on_patch_size_change(ExportConfig.patch_size)
             try:
                 enable_UI_elements(parent.patch_size_subframe.slider)
+                enable_UI_elements(parent.tile_batch_size_subframe.menu)
+                enable_UI_elements(parent.blend_overlap_subframe.checkbox)
                 print_to_frame(
                     parent.patch_size_subframe.label,
                     grid=False,
@@ -160,6 +177,87 @@ class ExportSettingsManager:
         except:
             pass
 
+    def set_tile_batch_size(self, value):
+        ExportConfig.tile_batch_size = value
+
+    def set_model_cache_size(self, value):
+        ExportConfig.model_cache_memory_gb = float(value)
+
+    def set_tile_cache_size(self, value):
+        ExportConfig.tile_cache_memory_gb = float(value)
+
+    def set_pipeline_depth(self, value):
+        ExportConfig.pipeline_depth = int(value)
+
+    def set_max_memory(self, value):
+        ExportConfig.max_memory_gb = float(value)
+
+    def set_pruning_mode(self, value):
+        ExportConfig.pruning_mode = value
+
+    def set_backend(self, value):
+        ExportConfig.backend = value
+
+    def set_blend_overlap(self, value):
+        try:
+            value = (
+                value.get()
+            )  # the value is a customtkinter object: customtkinter.BooleanVar
+        except:
+            pass  # the value is a python native datatype: bool
+        ExportConfig.blend_patch_overlap = value
+
+    def set_pack_single_channels(self, value):
+        try:
+            value = (
+                value.get()
+            )  # the value is a customtkinter object: customtkinter.BooleanVar
+        except:
+            pass  # the value is a python native datatype: bool
+        ExportConfig.pack_single_channels = value
+
+    def set_tile_triage(self, value):
+        try:
+            value = (
+                value.get()
+            )  # the value is a customtkinter object: customtkinter.BooleanVar
+        except:
+            pass  # the value is a python native datatype: bool
+        ExportConfig.tile_triage = value
+
+    def set_triage_threshold(self, value):
+        ExportConfig.triage_variance_threshold = float(value)
+
+    def set_skip_transparent(self, value):
+        try:
+            value = (
+                value.get()
+            )  # the value is a customtkinter object: customtkinter.BooleanVar
+        except:
+            pass  # the value is a python native datatype: bool
+        ExportConfig.skip_transparent_tiles = value
+
+    def set_binary_alpha(self, value):
+        try:
+            value = (
+                value.get()
+            )  # the value is a customtkinter object: customtkinter.BooleanVar
+        except:
+            pass  # the value is a python native datatype: bool
+        ExportConfig.binary_alpha_upscale = value
+
+    def set_normal_map_mode(self, value):
+        ExportConfig.normal_map_mode = value
+
+    def set_renormalize_normals(self, value):
+        try:
+            value = (
+                value.get()
+            )  # the value is a customtkinter object: customtkinter.BooleanVar
+        except:
+            pass  # the value is a python native datatype: bool
+        ExportConfig.renormalize_normals = value
+
     def set_color_depth(self, value):
         ExportConfig.export_color_depth = value
 
@@ -182,6 +280,29 @@ class AdditionalOptionsFrame(ctk.CTkFrame):
         self.export_color_depth = ctk.DoubleVar(value=ExportConfig.export_color_depth)
         self.split_large_image = ctk.BooleanVar(value=ExportConfig.split_large_image)
         self.patch_size = ctk.IntVar(value=ExportConfig.patch_size)
+        self.tile_batch_size = ctk.StringVar(value=ExportConfig.tile_batch_size)
+        self.blend_overlap = ctk.BooleanVar(value=ExportConfig.blend_patch_overlap)
+        self.pack_single_channels = ctk.BooleanVar(
+            value=ExportConfig.pack_single_channels
+        )
+        self.tile_triage = ctk.BooleanVar(value=ExportConfig.tile_triage)
+        self.skip_transparent = ctk.BooleanVar(value=ExportConfig.skip_transparent_tiles)
+        self.binary_alpha = ctk.BooleanVar(value=ExportConfig.binary_alpha_upscale)
+        self.normal_map_mode = ctk.StringVar(value=ExportConfig.normal_map_mode)
+        self.renormalize_normals = ctk.BooleanVar(value=ExportConfig.renormalize_normals)
+        self.triage_threshold = ctk.StringVar(
+            value=f"{ExportConfig.triage_variance_threshold:g}"
+        )
+        self.model_cache_size = ctk.StringVar(
+            value=f"{ExportConfig.model_cache_memory_gb:g}"
+        )
+        self.tile_cache_size = ctk.StringVar(
+            value=f"{ExportConfig.tile_cache_memory_gb:g}"
+        )
+        self.pipeline_depth = ctk.StringVar(value=str(ExportConfig.pipeline_depth))
+        self.max_memory = ctk.StringVar(value=f"{ExportConfig.max_memory_gb:g}")
+        self.pruning_mode = ctk.StringVar(value=ExportConfig.pruning_mode)
+        self.backend = ctk.StringVar(value=ExportConfig.backend)
         self.gamma_adjustment = ctk.DoubleVar(value=ExportConfig.gamma_adjustment)
         self.broswermodeon = ctk.BooleanVar(value=GUIConfig.browser_mode_on)
 
@@ -223,6 +344,51 @@ class AdditionalOptionsFrame(ctk.CTkFrame):
         self.patch_size_subframe = ctk.CTkFrame(
             self, fg_color="transparent", height=10, width=150
         )
+        self.tile_batch_size_subframe = ctk.CTkFrame(
+            self, fg_color="transparent", height=10, width=150
+        )
+        self.blend_overlap_subframe = ctk.CTkFrame(
+            self, fg_color="transparent", height=10, width=150
+        )
+        self.model_cache_size_subframe = ctk.CTkFrame(
+            self, fg_color="transparent", height=10, width=150
+        )
+        self.tile_cache_size_subframe = ctk.CTkFrame(
+            self, fg_color="transparent", height=10, width=150
+        )
+        self.pipeline_depth_subframe = ctk.CTkFrame(
+            self, fg_color="transparent", height=10, width=150
+        )
+        self.max_memory_subframe = ctk.CTkFrame(
+            self, fg_color="transparent", height=10, width=150
+        )
+        self.pruning_mode_subframe = ctk.CTkFrame(
+            self, fg_color="transparent", height=10, width=150
+        )
+        self.backend_subframe = ctk.CTkFrame(
+            self, fg_color="transparent", height=10, width=150
+        )
+        self.pack_single_channels_subframe = ctk.CTkFrame(
+            self, fg_color="transparent", height=10, width=150
+        )
+        self.tile_triage_subframe = ctk.CTkFrame(
+            self, fg_color="transparent", height=10, width=150
+        )
+        self.triage_threshold_subframe = ctk.CTkFrame(
+            self, fg_color="transparent", height=10, width=150
+        )
+        self.skip_transparent_subframe = ctk.CTkFrame(
+            self, fg_color="transparent", height=10, width=150
+        )
+        self.binary_alpha_subframe = ctk.CTkFrame(
+            self, fg_color="transparent", height=10, width=150
+        )
+        self.normal_map_mode_subframe = ctk.CTkFrame(
+            self, fg_color="transparent", height=10, width=150
+        )
+        self.renormalize_normals_subframe = ctk.CTkFrame(
+            self, fg_color="transparent", height=10, width=150
+        )
 
         self.image_browser_subframe = ctk.CTkFrame(
             self, fg_color="transparent", height=10, width=150
@@ -352,6 +518,156 @@ class AdditionalOptionsFrame(ctk.CTkFrame):
             bg_color=GUIConfig.tooltip_color,
             text_color=GUIConfig.tooltop_text_color,
         )
+        # model cache size label/menu
+        self.model_cache_size_subframe.label = ctk.CTkLabel(
+            self.model_cache_size_subframe,
+            font=fonts.options_font(),
+            text="Model Cache (GiB)",
+            height=20,
+            width=50,
+        )
+        self.model_cache_size_subframe.menu = ctk.CTkOptionMenu(
+            master=self.model_cache_size_subframe,
+            dynamic_resizing=False,
+            values=ConfigReference.model_cache_sizes,
+            command=self.on_model_cache_size_change,
+            variable=self.model_cache_size,
+            height=20,
+            width=80,
+            font=fonts.buttons_font(),
+        )
+        self.model_cache_size_subframe.menu_tt = Hovertip_Frame(
+            anchor_widget=self.model_cache_size_subframe.label,
+            text=ttt.model_cache_size,
+            hover_delay=GUIConfig.tooltip_hover_delay,
+            bg_color=GUIConfig.tooltip_color,
+            text_color=GUIConfig.tooltop_text_color,
+        )
+        # tile cache size label/menu
+        self.tile_cache_size_subframe.label = ctk.CTkLabel(
+            self.tile_cache_size_subframe,
+            font=fonts.options_font(),
+            text="Tile Cache (GiB)",
+            height=20,
+            width=50,
+        )
+        self.tile_cache_size_subframe.menu = ctk.CTkOptionMenu(
+            master=self.tile_cache_size_subframe,
+            dynamic_resizing=False,
+            values=ConfigReference.tile_cache_sizes,
+            command=self.on_tile_cache_size_change,
+            variable=self.tile_cache_size,
+            height=20,
+            width=80,
+            font=fonts.buttons_font(),
+        )
+        self.tile_cache_size_subframe.menu_tt = Hovertip_Frame(
+            anchor_widget=self.tile_cache_size_subframe.label,
+            text=ttt.tile_cache_size,
+            hover_delay=GUIConfig.tooltip_hover_delay,
+            bg_color=GUIConfig.tooltip_color,
+            text_color=GUIConfig.tooltop_text_color,
+        )
+        # export pipeline depth label/menu
+        self.pipeline_depth_subframe.label = ctk.CTkLabel(
+            self.pipeline_depth_subframe,
+            font=fonts.options_font(),
+            text="Pipeline Depth",
+            height=20,
+            width=50,
+        )
+        self.pipeline_depth_subframe.menu = ctk.CTkOptionMenu(
+            master=self.pipeline_depth_subframe,
+            dynamic_resizing=False,
+            values=ConfigReference.pipeline_depths,
+            command=self.on_pipeline_depth_change,
+            variable=self.pipeline_depth,
+            height=20,
+            width=80,
+            font=fonts.buttons_font(),
+        )
+        self.pipeline_depth_subframe.menu_tt = Hovertip_Frame(
+            anchor_widget=self.pipeline_depth_subframe.label,
+            text=ttt.pipeline_depth,
+            hover_delay=GUIConfig.tooltip_hover_delay,
+            bg_color=GUIConfig.tooltip_color,
+            text_color=GUIConfig.tooltop_text_color,
+        )
+        # cpu memory budget label/menu
+        self.max_memory_subframe.label = ctk.CTkLabel(
+            self.max_memory_subframe,
+            font=fonts.options_font(),
+            text="Max CPU Memory (GiB)",
+            height=20,
+            width=50,
+        )
+        self.max_memory_subframe.menu = ctk.CTkOptionMenu(
+            master=self.max_memory_subframe,
+            dynamic_resizing=False,
+            values=ConfigReference.max_memory_sizes,
+            command=self.on_max_memory_change,
+            variable=self.max_memory,
+            height=20,
+            width=80,
+            font=fonts.buttons_font(),
+        )
+        self.max_memory_subframe.menu_tt = Hovertip_Frame(
+            anchor_widget=self.max_memory_subframe.label,
+            text=ttt.max_memory,
+            hover_delay=GUIConfig.tooltip_hover_delay,
+            bg_color=GUIConfig.tooltip_color,
+            text_color=GUIConfig.tooltop_text_color,
+        )
+        # pruning mode label/menu
+        self.pruning_mode_subframe.label = ctk.CTkLabel(
+            self.pruning_mode_subframe,
+            font=fonts.options_font(),
+            text="Model Pruning",
+            height=20,
+            width=50,
+        )
+        self.pruning_mode_subframe.menu = ctk.CTkOptionMenu(
+            master=self.pruning_mode_subframe,
+            dynamic_resizing=False,
+            values=ConfigReference.pruning_modes,
+            command=self.on_pruning_mode_change,
+            variable=self.pruning_mode,
+            height=20,
+            width=80,
+            font=fonts.buttons_font(),
+        )
+        self.pruning_mode_subframe.menu_tt = Hovertip_Frame(
+            anchor_widget=self.pruning_mode_subframe.label,
+            text=ttt.pruning_mode,
+            hover_delay=GUIConfig.tooltip_hover_delay,
+            bg_color=GUIConfig.tooltip_color,
+            text_color=GUIConfig.tooltop_text_color,
+        )
+        # inference backend label/menu
+        self.backend_subframe.label = ctk.CTkLabel(
+            self.backend_subframe,
+            font=fonts.options_font(),
+            text="Inference Backend",
+            height=20,
+            width=50,
+        )
+        self.backend_subframe.menu = ctk.CTkOptionMenu(
+            master=self.backend_subframe,
+            dynamic_resizing=False,
+            values=ConfigReference.inference_backends,
+            command=self.on_backend_change,
+            variable=self.backend,
+            height=20,
+            width=80,
+            font=fonts.buttons_font(),
+        )
+        self.backend_subframe.menu_tt = Hovertip_Frame(
+            anchor_widget=self.backend_subframe.label,
+            text=ttt.backend,
+            hover_delay=GUIConfig.tooltip_hover_delay,
+            bg_color=GUIConfig.tooltip_color,
+            text_color=GUIConfig.tooltop_text_color,
+        )
         # upscale precision label/menu
         self.upscale_precision_subframe.label = ctk.CTkLabel(
             self.upscale_precision_subframe,
@@ -409,6 +725,245 @@ class AdditionalOptionsFrame(ctk.CTkFrame):
             )
         except:
             None
+        # tile batch size label/menu
+        self.tile_batch_size_subframe.label = ctk.CTkLabel(
+            self.tile_batch_size_subframe,
+            font=fonts.options_font(),
+            text="Split Batch Size",
+            height=20,
+            width=50,
+        )
+        self.tile_batch_size_subframe.menu = ctk.CTkOptionMenu(
+            master=self.tile_batch_size_subframe,
+            dynamic_resizing=False,
+            values=ConfigReference.tile_batch_sizes,
+            command=self.on_tile_batch_size_change,
+            variable=self.tile_batch_size,
+            height=20,
+            width=80,
+            font=fonts.buttons_font(),
+        )
+        self.tile_batch_size_subframe.menu_tt = Hovertip_Frame(
+            anchor_widget=self.tile_batch_size_subframe.label,
+            text=ttt.tile_batch_size,
+            hover_delay=GUIConfig.tooltip_hover_delay,
+            bg_color=GUIConfig.tooltip_color,
+            text_color=GUIConfig.tooltop_text_color,
+        )
+        # blend split overlap label/checkbox
+        self.blend_overlap_subframe.label = ctk.CTkLabel(
+            master=self.blend_overlap_subframe,
+            font=fonts.options_font(),
+            text="Blend Split Overlap",
+            height=20,
+            width=50,
+        )
+        self.blend_overlap_subframe.checkbox = ctk.CTkCheckBox(
+            master=self.blend_overlap_subframe,
+            variable=self.blend_overlap,
+            command=lambda: self.on_blend_overlap_change(self.blend_overlap),
+            text="",
+            height=15,
+            width=40,
+            checkbox_height=18,
+            checkbox_width=18,
+            border_width=2,
+        )
+        self.blend_overlap_subframe.checkbox.select() if ExportConfig.blend_patch_overlap else self.blend_overlap_subframe.checkbox.deselect()
+        self.blend_overlap_subframe.checkbox_tt = Hovertip_Frame(
+            anchor_widget=self.blend_overlap_subframe.label,
+            text=ttt.blend_overlap,
+            hover_delay=GUIConfig.tooltip_hover_delay,
+            bg_color=GUIConfig.tooltip_color,
+            text_color=GUIConfig.tooltop_text_color,
+        )
+        # pack single channels label/checkbox
+        self.pack_single_channels_subframe.label = ctk.CTkLabel(
+            master=self.pack_single_channels_subframe,
+            font=fonts.options_font(),
+            text="Pack Greyscale/Alpha Channels",
+            height=20,
+            width=50,
+        )
+        self.pack_single_channels_subframe.checkbox = ctk.CTkCheckBox(
+            master=self.pack_single_channels_subframe,
+            variable=self.pack_single_channels,
+            command=lambda: self.on_pack_single_channels_change(
+                self.pack_single_channels
+            ),
+            text="",
+            height=15,
+            width=40,
+            checkbox_height=18,
+            checkbox_width=18,
+            border_width=2,
+        )
+        self.pack_single_channels_subframe.checkbox.select() if ExportConfig.pack_single_channels else self.pack_single_channels_subframe.checkbox.deselect()
+        self.pack_single_channels_subframe.checkbox_tt = Hovertip_Frame(
+            anchor_widget=self.pack_single_channels_subframe.label,
+            text=ttt.pack_single_channels,
+            hover_delay=GUIConfig.tooltip_hover_delay,
+            bg_color=GUIConfig.tooltip_color,
+            text_color=GUIConfig.tooltop_text_color,
+        )
+        # tile triage label/checkbox
+        self.tile_triage_subframe.label = ctk.CTkLabel(
+            master=self.tile_triage_subframe,
+            font=fonts.options_font(),
+            text="Tile Triage",
+            height=20,
+            width=50,
+        )
+        self.tile_triage_subframe.checkbox = ctk.CTkCheckBox(
+            master=self.tile_triage_subframe,
+            variable=self.tile_triage,
+            command=lambda: self.on_tile_triage_change(self.tile_triage),
+            text="",
+            height=15,
+            width=40,
+            checkbox_height=18,
+            checkbox_width=18,
+            border_width=2,
+        )
+        self.tile_triage_subframe.checkbox.select() if ExportConfig.tile_triage else self.tile_triage_subframe.checkbox.deselect()
+        self.tile_triage_subframe.checkbox_tt = Hovertip_Frame(
+            anchor_widget=self.tile_triage_subframe.label,
+            text=ttt.tile_triage,
+            hover_delay=GUIConfig.tooltip_hover_delay,
+            bg_color=GUIConfig.tooltip_color,
+            text_color=GUIConfig.tooltop_text_color,
+        )
+        # tile triage threshold label/menu
+        self.triage_threshold_subframe.label = ctk.CTkLabel(
+            self.triage_threshold_subframe,
+            font=fonts.options_font(),
+            text="Triage Variance Threshold",
+            height=20,
+            width=50,
+        )
+        self.triage_threshold_subframe.menu = ctk.CTkOptionMenu(
+            master=self.triage_threshold_subframe,
+            dynamic_resizing=False,
+            values=ConfigReference.triage_variance_thresholds,
+            command=self.on_triage_threshold_change,
+            variable=self.triage_threshold,
+            height=20,
+            width=80,
+            font=fonts.buttons_font(),
+        )
+        self.triage_threshold_subframe.menu_tt = Hovertip_Frame(
+            anchor_widget=self.triage_threshold_subframe.label,
+            text=ttt.triage_threshold,
+            hover_delay=GUIConfig.tooltip_hover_delay,
+            bg_color=GUIConfig.tooltip_color,
+            text_color=GUIConfig.tooltop_text_color,
+        )
+        # skip transparent tiles label/checkbox
+        self.skip_transparent_subframe.label = ctk.CTkLabel(
+            master=self.skip_transparent_subframe,
+            font=fonts.options_font(),
+            text="Skip Transparent Tiles",
+            height=20,
+            width=50,
+        )
+        self.skip_transparent_subframe.checkbox = ctk.CTkCheckBox(
+            master=self.skip_transparent_subframe,
+            variable=self.skip_transparent,
+            command=lambda: self.on_skip_transparent_change(self.skip_transparent),
+            text="",
+            height=15,
+            width=40,
+            checkbox_height=18,
+            checkbox_width=18,
+            border_width=2,
+        )
+        self.skip_transparent_subframe.checkbox.select() if ExportConfig.skip_transparent_tiles else self.skip_transparent_subframe.checkbox.deselect()
+        self.skip_transparent_subframe.checkbox_tt = Hovertip_Frame(
+            anchor_widget=self.skip_transparent_subframe.label,
+            text=ttt.skip_transparent,
+            hover_delay=GUIConfig.tooltip_hover_delay,
+            bg_color=GUIConfig.tooltip_color,
+            text_color=GUIConfig.tooltop_text_color,
+        )
+        # binary alpha label/checkbox
+        self.binary_alpha_subframe.label = ctk.CTkLabel(
+            master=self.binary_alpha_subframe,
+            font=fonts.options_font(),
+            text="Fast Binary Alpha",
+            height=20,
+            width=50,
+        )
+        self.binary_alpha_subframe.checkbox = ctk.CTkCheckBox(
+            master=self.binary_alpha_subframe,
+            variable=self.binary_alpha,
+            command=lambda: self.on_binary_alpha_change(self.binary_alpha),
+            text="",
+            height=15,
+            width=40,
+            checkbox_height=18,
+            checkbox_width=18,
+            border_width=2,
+        )
+        self.binary_alpha_subframe.checkbox.select() if ExportConfig.binary_alpha_upscale else self.binary_alpha_subframe.checkbox.deselect()
+        self.binary_alpha_subframe.checkbox_tt = Hovertip_Frame(
+            anchor_widget=self.binary_alpha_subframe.label,
+            text=ttt.binary_alpha,
+            hover_delay=GUIConfig.tooltip_hover_delay,
+            bg_color=GUIConfig.tooltip_color,
+            text_color=GUIConfig.tooltop_text_color,
+        )
+        # normal map mode label/menu
+        self.normal_map_mode_subframe.label = ctk.CTkLabel(
+            self.normal_map_mode_subframe,
+            font=fonts.options_font(),
+            text="Normal Maps",
+            height=20,
+            width=50,
+        )
+        self.normal_map_mode_subframe.menu = ctk.CTkOptionMenu(
+            master=self.normal_map_mode_subframe,
+            dynamic_resizing=False,
+            values=ConfigReference.normal_map_modes,
+            command=self.on_normal_map_mode_change,
+            variable=self.normal_map_mode,
+            height=20,
+            width=80,
+            font=fonts.buttons_font(),
+        )
+        self.normal_map_mode_subframe.menu_tt = Hovertip_Frame(
+            anchor_widget=self.normal_map_mode_subframe.label,
+            text=ttt.normal_map_mode,
+            hover_delay=GUIConfig.tooltip_hover_delay,
+            bg_color=GUIConfig.tooltip_color,
+            text_color=GUIConfig.tooltop_text_color,
+        )
+        # renormalize normals label/checkbox
+        self.renormalize_normals_subframe.label = ctk.CTkLabel(
+            master=self.renormalize_normals_subframe,
+            font=fonts.options_font(),
+            text="Renormalize Normals",
+            height=20,
+            width=50,
+        )
+        self.renormalize_normals_subframe.checkbox = ctk.CTkCheckBox(
+            master=self.renormalize_normals_subframe,
+            variable=self.renormalize_normals,
+            command=lambda: self.on_renormalize_normals_change(self.renormalize_normals),
+            text="",
+            height=15,
+            width=40,
+            checkbox_height=18,
+            checkbox_width=18,
+            border_width=2,
+        )
+        self.renormalize_normals_subframe.checkbox.select() if ExportConfig.renormalize_normals else self.renormalize_normals_subframe.checkbox.deselect()
+        self.renormalize_normals_subframe.checkbox_tt = Hovertip_Frame(
+            anchor_widget=self.renormalize_normals_subframe.label,
+            text=ttt.renormalize_normals,
+            hover_delay=GUIConfig.tooltip_hover_delay,
+            bg_color=GUIConfig.tooltip_color,
+            text_color=GUIConfig.tooltop_text_color,
+        )
         # padding size label/slider
         self.gamma_adjustment_subframe.label = ctk.CTkLabel(
             self.gamma_adjustment_subframe,
@@ -515,6 +1070,51 @@ class AdditionalOptionsFrame(ctk.CTkFrame):
     def on_patch_size_change(self, value):
         self.settings_manager.set_patch_size(self, value)
 
+    def on_tile_batch_size_change(self, value):
+        self.settings_manager.set_tile_batch_size(value)
+
+    def on_model_cache_size_change(self, value):
+        self.settings_manager.set_model_cache_size(value)
+
+    def on_tile_cache_size_change(self, value):
+        self.settings_manager.set_tile_cache_size(value)
+
+    def on_pipeline_depth_change(self, value):
+        self.settings_manager.set_pipeline_depth(value)
+
+    def on_max_memory_change(self, value):
+        self.settings_manager.set_max_memory(value)
+
+    def on_pruning_mode_change(self, value):
+        self.settings_manager.set_pruning_mode(value)
+
+    def on_backend_change(self, value):
+        self.settings_manager.set_backend(value)
+
+    def on_blend_overlap_change(self, value):
+        self.settings_manager.set_blend_overlap(value)
+
+    def on_pack_single_channels_change(self, value):
+        self.settings_manager.set_pack_single_channels(value)
+
+    def on_tile_triage_change(self, value):
+        self.settings_manager.set_tile_triage(value)
+
+    def on_triage_threshold_change(self, value):
+        self.settings_manager.set_triage_threshold(value)
+
+    def on_skip_transparent_change(self, value):
+        self.settings_manager.set_skip_transparent(value)
+
+    def on_binary_alpha_change(self, value):
+        self.settings_manager.set_binary_alpha(value)
+
+    def on_normal_map_mode_change(self, value):
+        self.settings_manager.set_normal_map_mode(value)
+
+    def on_renormalize_normals_change(self, value):
+        self.settings_manager.set_renormalize_normals(value)
+
     def on_color_depth_change(self, value):
         self.settings_manager.set_color_depth(value)
 
@@ -581,6 +1181,45 @@ class AdditionalOptionsFrame(ctk.CTkFrame):
             row=9, column=0, padx=35, pady=5, sticky="new"
         )
         self.patch_size_subframe.grid(row=10, column=0, padx=35, pady=5, sticky="new")
+        self.tile_batch_size_subframe.grid(
+            row=11, column=0, padx=35, pady=5, sticky="new"
+        )
+        self.blend_overlap_subframe.grid(
+            row=12, column=0, padx=35, pady=5, sticky="new"
+        )
+        self.model_cache_size_subframe.grid(
+            row=13, column=0, padx=35, pady=5, sticky="new"
+        )
+        self.pruning_mode_subframe.grid(
+            row=14, column=0, padx=35, pady=5, sticky="new"
+        )
+        self.backend_subframe.grid(row=15, column=0, padx=35, pady=5, sticky="new")
+        self.max_memory_subframe.grid(
+            row=16, column=0, padx=35, pady=5, sticky="new"
+        )
+        self.pack_single_channels_subframe.grid(
+            row=17, column=0, padx=35, pady=5, sticky="new"
+        )
+        self.tile_triage_subframe.grid(row=18, column=0, padx=35, pady=5, sticky="new")
+        self.triage_threshold_subframe.grid(
+            row=19, column=0, padx=35, pady=5, sticky="new"
+        )
+        self.skip_transparent_subframe.grid(
+            row=20, column=0, padx=35, pady=5, sticky="new"
+        )
+        self.binary_alpha_subframe.grid(row=21, column=0, padx=35, pady=5, sticky="new")
+        self.normal_map_mode_subframe.grid(
+            row=22, column=0, padx=35, pady=5, sticky="new"
+        )
+        self.renormalize_normals_subframe.grid(
+            row=23, column=0, padx=35, pady=5, sticky="new"
+        )
+        self.tile_cache_size_subframe.grid(
+            row=24, column=0, padx=35, pady=5, sticky="new"
+        )
+        self.pipeline_depth_subframe.grid(
+            row=25, column=0, padx=35, pady=5, sticky="new"
+        )
 
         # plot subframe elements
 
@@ -628,6 +1267,60 @@ class AdditionalOptionsFrame(ctk.CTkFrame):
         self.patch_size_subframe.label.pack(side=LEFT)
         self.patch_size_subframe.slider.pack(side=RIGHT)
 
+        self.tile_batch_size_subframe.label.pack(side=LEFT)
+        self.tile_batch_size_subframe.menu.pack(side=RIGHT)
+
+        self.blend_overlap_subframe.checkbox.pack(side=RIGHT)
+        self.blend_overlap_subframe.label.pack(side=LEFT)
+
+        # model cache size
+        self.model_cache_size_subframe.label.pack(side=LEFT)
+        self.model_cache_size_subframe.menu.pack(side=RIGHT)
+
+        # tile cache size
+        self.tile_cache_size_subframe.label.pack(side=LEFT)
+        self.tile_cache_size_subframe.menu.pack(side=RIGHT)
+
+        # export pipeline depth
+        self.pipeline_depth_subframe.label.pack(side=LEFT)
+        self.pipeline_depth_subframe.menu.pack(side=RIGHT)
+
+        # cpu memory budget
+        self.max_memory_subframe.label.pack(side=LEFT)
+        self.max_memory_subframe.menu.pack(side=RIGHT)
+
+        # pruning mode
+        self.pruning_mode_subframe.label.pack(side=LEFT)
+        self.pruning_mode_subframe.menu.pack(side=RIGHT)
+
+        # inference backend
+        self.backend_subframe.label.pack(side=LEFT)
+        self.backend_subframe.menu.pack(side=RIGHT)
+
+        # single channel packing
+        self.pack_single_channels_subframe.checkbox.pack(side=RIGHT)
+        self.pack_single_channels_subframe.label.pack(side=LEFT)
+
+        # tile triage
+        self.tile_triage_subframe.checkbox.pack(side=RIGHT)
+        self.tile_triage_subframe.label.pack(side=LEFT)
+        self.triage_threshold_subframe.label.pack(side=LEFT)
+        self.triage_threshold_subframe.menu.pack(side=RIGHT)
+
+        # transparent tiles
+        self.skip_transparent_subframe.checkbox.pack(side=RIGHT)
+        self.skip_transparent_subframe.label.pack(side=LEFT)
+
+        # binary alpha
+        self.binary_alpha_subframe.checkbox.pack(side=RIGHT)
+        self.binary_alpha_subframe.label.pack(side=LEFT)
+
+        # normal maps
+        self.normal_map_mode_subframe.label.pack(side=LEFT)
+        self.normal_map_mode_subframe.menu.pack(side=RIGHT)
+        self.renormalize_normals_subframe.checkbox.pack(side=RIGHT)
+        self.renormalize_normals_subframe.label.pack(side=LEFT)
+
         # setup device
         self.on_upscale_precision_change(ExportConfig.upscale_precision)
         self.on_patch_size_change(ExportConfig.patch_size)
@@ -285,6 +285,28 @@ class ExportFrame(ctk.CTkFrame):
                 "export_color_depth": valid_config.get("export_color_depth", "8-bit"),
                 "split_large_image": valid_config.get("split_large_image", True),
                 "split_size": valid_config.get("split_size", 0.0),
+                "tile_batch_size": valid_config.get("tile_batch_size", "auto"),
+                "blend_patch_overlap": valid_config.get("blend_patch_overlap", False),
+                "pack_single_channels": valid_config.get("pack_single_channels", False),
+                "tile_triage": valid_config.get("tile_triage", False),
+                "triage_variance_threshold": valid_config.get("triage_variance_threshold", 0.0001),
+                "skip_transparent_tiles": valid_config.get("skip_transparent_tiles", False),
+                "binary_alpha_upscale": valid_config.get("binary_alpha_upscale", False),
+                "normal_map_mode": valid_config.get("normal_map_mode", "off"),
+                "renormalize_normals": valid_config.get("renormalize_normals", False),
+                "model_cache_memory_gb": valid_config.get("model_cache_memory_gb", 1.0),
+                "tile_cache_memory_gb": valid_config.get("tile_cache_memory_gb", 0.5),
+                "pipeline_depth": valid_config.get("pipeline_depth", 2),
+                "workers": valid_config.get("workers", 1),
+                "threads_per_worker": valid_config.get("threads_per_worker", 0),
+                "tile_workers": valid_config.get("tile_workers", 1),
+                "out_of_core": valid_config.get("out_of_core", False),
+                "max_memory_gb": valid_config.get("max_memory_gb", 4.0),
+                "pruning_mode": valid_config.get("pruning_mode", "bake"),
+                "backend": valid_config.get("backend", "eager"),
+                "intra_op_threads": valid_config.get("intra_op_threads", 0),
+                "inter_op_threads": valid_config.get("inter_op_threads", 0),
+                "calibration_dir": valid_config.get("calibration_dir", ""),
             }
             return export_config
 
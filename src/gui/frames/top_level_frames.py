@@ -149,6 +149,28 @@ class SaveConfigWindow(ctk.CTkToplevel):
             "upscale_precision": ExportConfig.upscale_precision,
             "split_large_image": ExportConfig.split_large_image,
             "split_size": ExportConfig.patch_size,
+            "tile_batch_size": ExportConfig.tile_batch_size,
+            "blend_patch_overlap": ExportConfig.blend_patch_overlap,
+            "pack_single_channels": ExportConfig.pack_single_channels,
+            "tile_triage": ExportConfig.tile_triage,
+            "triage_variance_threshold": ExportConfig.triage_variance_threshold,
+            "skip_transparent_tiles": ExportConfig.skip_transparent_tiles,
+            "binary_alpha_upscale": ExportConfig.binary_alpha_upscale,
+            "normal_map_mode": ExportConfig.normal_map_mode,
+            "renormalize_normals": ExportConfig.renormalize_normals,
+            "model_cache_memory_gb": ExportConfig.model_cache_memory_gb,
+            "tile_cache_memory_gb": ExportConfig.tile_cache_memory_gb,
+            "pipeline_depth": ExportConfig.pipeline_depth,
+            "workers": ExportConfig.workers,
+            "threads_per_worker": ExportConfig.threads_per_worker,
+            "tile_workers": ExportConfig.tile_workers,
+            "out_of_core": ExportConfig.out_of_core,
+            "max_memory_gb": ExportConfig.max_memory_gb,
+            "pruning_mode": ExportConfig.pruning_mode,
+            "backend": ExportConfig.backend,
+            "intra_op_threads": ExportConfig.intra_op_threads,
+            "inter_op_threads": ExportConfig.inter_op_threads,
+            "calibration_dir": ExportConfig.calibration_dir,
         }
 
         if not os.path.exists("user_config"):
@@ -518,6 +540,80 @@ class LoadConfigWindow(ctk.CTkToplevel):
             int(self.parsed_conf["split_size"])
         )
 
+        tile_batch_size = self.parsed_conf.get(
+            "tile_batch_size", ConfigReference.tile_batch_sizes[0]
+        )
+        self.addit_sett_frame.on_tile_batch_size_change(tile_batch_size)
+        self.addit_sett_frame.tile_batch_size_subframe.menu.set(tile_batch_size)
+
+        blend_patch_overlap = self.parsed_conf.get("blend_patch_overlap", False)
+        self.addit_sett_frame.on_blend_overlap_change(blend_patch_overlap)
+        self.addit_sett_frame.blend_overlap_subframe.checkbox.select() if blend_patch_overlap else self.addit_sett_frame.blend_overlap_subframe.checkbox.deselect()
+
+        pack_single_channels = self.parsed_conf.get("pack_single_channels", False)
+        self.addit_sett_frame.on_pack_single_channels_change(pack_single_channels)
+        self.addit_sett_frame.pack_single_channels_subframe.checkbox.select() if pack_single_channels else self.addit_sett_frame.pack_single_channels_subframe.checkbox.deselect()
+
+        tile_triage = self.parsed_conf.get("tile_triage", False)
+        self.addit_sett_frame.on_tile_triage_change(tile_triage)
+        self.addit_sett_frame.tile_triage_subframe.checkbox.select() if tile_triage else self.addit_sett_frame.tile_triage_subframe.checkbox.deselect()
+
+        triage_threshold = f'{self.parsed_conf.get("triage_variance_threshold", 0.0001):g}'
+        self.addit_sett_frame.on_triage_threshold_change(triage_threshold)
+        self.addit_sett_frame.triage_threshold_subframe.menu.set(triage_threshold)
+
+        skip_transparent_tiles = self.parsed_conf.get("skip_transparent_tiles", False)
+        self.addit_sett_frame.on_skip_transparent_change(skip_transparent_tiles)
+        self.addit_sett_frame.skip_transparent_subframe.checkbox.select() if skip_transparent_tiles else self.addit_sett_frame.skip_transparent_subframe.checkbox.deselect()
+
+        binary_alpha_upscale = self.parsed_conf.get("binary_alpha_upscale", False)
+        self.addit_sett_frame.on_binary_alpha_change(binary_alpha_upscale)
+        self.addit_sett_frame.binary_alpha_subframe.checkbox.select() if binary_alpha_upscale else self.addit_sett_frame.binary_alpha_subframe.checkbox.deselect()
+
+        normal_map_mode = self.parsed_conf.get(
+            "normal_map_mode", ConfigReference.normal_map_modes[0]
+        )
+        self.addit_sett_frame.on_normal_map_mode_change(normal_map_mode)
+        self.addit_sett_frame.normal_map_mode_subframe.menu.set(normal_map_mode)
+
+        renormalize_normals = self.parsed_conf.get("renormalize_normals", False)
+        self.addit_sett_frame.on_renormalize_normals_change(renormalize_normals)
+        self.addit_sett_frame.renormalize_normals_subframe.checkbox.select() if renormalize_normals else self.addit_sett_frame.renormalize_normals_subframe.checkbox.deselect()
+
+        model_cache_size = f'{self.parsed_conf.get("model_cache_memory_gb", 1.0):g}'
+        self.addit_sett_frame.on_model_cache_size_change(model_cache_size)
+        self.addit_sett_frame.model_cache_size_subframe.menu.set(model_cache_size)
+
+        tile_cache_size = f'{self.parsed_conf.get("tile_cache_memory_gb", 0.5):g}'
+        self.addit_sett_frame.on_tile_cache_size_change(tile_cache_size)
+        self.addit_sett_frame.tile_cache_size_subframe.menu.set(tile_cache_size)
+
+        pipeline_depth = str(self.parsed_conf.get("pipeline_depth", 2))
+        self.addit_sett_frame.on_pipeline_depth_change(pipeline_depth)
+        self.addit_sett_frame.pipeline_depth_subframe.menu.set(pipeline_depth)
+
+        max_memory = f'{self.parsed_conf.get("max_memory_gb", 4.0):g}'
+        self.addit_sett_frame.on_max_memory_change(max_memory)
+        self.addit_sett_frame.max_memory_subframe.menu.set(max_memory)
+
+        pruning_mode = self.parsed_conf.get(
+            "pruning_mode", ConfigReference.pruning_modes[0]
+        )
+        self.addit_sett_frame.on_pruning_mode_change(pruning_mode)
+        self.addit_sett_frame.pruning_mode_subframe.menu.set(pruning_mode)
+
+        backend = self.parsed_conf.get("backend", ConfigReference.inference_backends[0])
+        self.addit_sett_frame.on_backend_change(backend)
+        self.addit_sett_frame.backend_subframe.menu.set(backend)
+        # worker processes, out-of-core upscaling, onnxruntime threads and the int8 calibration folder are only set through the config file
+        ExportConfig.workers = self.parsed_conf.get("workers", 1)
+        ExportConfig.threads_per_worker = self.parsed_conf.get("threads_per_worker", 0)
+        ExportConfig.tile_workers = self.parsed_conf.get("tile_workers", 1)
+        ExportConfig.out_of_core = self.parsed_conf.get("out_of_core", False)
+        ExportConfig.intra_op_threads = self.parsed_conf.get("intra_op_threads", 0)
+        ExportConfig.inter_op_threads = self.parsed_conf.get("inter_op_threads", 0)
+        ExportConfig.calibration_dir = self.parsed_conf.get("calibration_dir", "")
+
     def set_export_frame(self):
         self.export_frame.save_in_original_checkbox.select() if self.parsed_conf[
             "save_in_original"
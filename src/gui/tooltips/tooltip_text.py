@@ -147,7 +147,13 @@ upscale_precision = (" Recommended: normal precision. High \n"
                      " precision uses significantly more   \n"
                      " video memory and takes longer to    \n"
                      " process and doesn't split images to \n"
-                     " avoid running out of video memory.    ")
+                     " avoid running out of video memory.  \n"
+                     " bf16 (CPU only) is faster on CPUs   \n"
+                     " that support bfloat16 and otherwise \n"
+                     " falls back to high precision.       \n"
+                     " int8 (CPU only) quantizes the model \n"
+                     " for several times faster upscaling  \n"
+                     " at a slightly lower quality.          ")
 
 split_large_image = (" (Recommended) If an image is too large  \n"
                      " for your video memory, it will be split \n"
@@ -159,3 +165,68 @@ pad_size =         (" Recommended: 10%. The size of the margines   \n"
                     " better final image but comes at greater      \n" 
                     " memory cost. Too large of a pad size may     \n"
                     " result in distortions or bluriness.            ")
+tile_batch_size =  (" The number of split images upscaled at    \n"
+                    " once. Auto fits as many as your video      \n"
+                    " memory allows. Larger batches are faster   \n"
+                    " but use more video memory.                   ")
+model_cache_size = (" Memory (GiB) used to keep upscaling models   \n"
+                    " loaded between exports so that they aren't  \n"
+                    " loaded again each time. 0 disables keeping  \n"
+                    " models loaded.                                ")
+max_memory =       (" Memory (GiB) CPU upscaling may use. Large   \n"
+                    " images are split into patches that fit    \n"
+                    " it. Split Size only applies to the GPU.     ")
+pruning_mode =     (" bake: prunes individual model weights.       \n"
+                    " structured: removes whole model channels     \n"
+                    " for faster upscaling at a slightly lower     \n"
+                    " quality.                                     \n"
+                    " none: doesn't prune the model.                 ")
+backend =          (" eager: runs the model as it is.             \n"
+                    " torchscript, compile, onnxruntime: compile  \n"
+                    " the model once for faster upscaling. The    \n"
+                    " first export takes longer while the model   \n"
+                    " is compiled. onnxruntime is the fastest on  \n"
+                    " CPU.                                          ")
+pack_single_channels = (" Upscale greyscale and alpha channels     \n"
+                    " three at a time by packing them into the \n"
+                    " red, green and blue of one upscale       \n"
+                    " instead of upscaling each as an RGB      \n"
+                    " image. Faster, at a slightly different   \n"
+                    " quality.                                   ")
+tile_triage =      (" Split images into tiles and only upscale  \n"
+                    " tiles with detail with the model. Solid  \n"
+                    " tiles are filled and low detail tiles    \n"
+                    " are upscaled with Lanczos. Much faster   \n"
+                    " for atlases with flat regions.             ")
+triage_threshold = (" Tiles whose variance is below this value \n"
+                    " are upscaled with Lanczos instead of the \n"
+                    " model. 0 only skips solid tiles.           ")
+skip_transparent = (" Upscale the color under fully transparent \n"
+                    " alpha with bilinear scaling instead of   \n"
+                    " the model since it is invisible. Much    \n"
+                    " faster for decal and foliage atlases.      ")
+binary_alpha =     (" Upscale cutout alpha channels (only fully  \n"
+                    " opaque and fully transparent pixels) by   \n"
+                    " smoothing and thresholding their edges    \n"
+                    " instead of with the model.                  ")
+normal_map_mode =  (" Upscale only the X and Y channels of      \n"
+                    " normal maps and rebuild Z from them.      \n"
+                    " auto: detects normal maps by name         \n"
+                    " (i.e. brick_nrm.png) or by their pixels.  \n"
+                    " all: treats every image as a normal map.  \n"
+                    " off: upscales normal maps as RGB.           ")
+renormalize_normals = (" Scale upscaled normals that overshoot  \n"
+                    " unit length back onto it before Z is     \n"
+                    " rebuilt.                                   ")
+tile_cache_size =  (" Memory (GiB) used to keep upscaled tiles so  \n"
+                    " that identical tiles (i.e. in trim sheets   \n"
+                    " and atlases) are upscaled once. Only applies \n"
+                    " to images split into tiles. 0 disables it.     ")
+pipeline_depth =   (" The number of images read ahead and       \n"
+                    " queued to be written while other images  \n"
+                    " are upscaled. Larger depths keep the      \n"
+                    " device busy but use more memory. 0        \n"
+                    " processes one image at a time.              ")
+blend_overlap =    (" Blend the overlapping margins of split     \n"
+                    " images when recombining them instead of    \n"
+                    " cutting the margins off.                     ")
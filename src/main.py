@@ -1,3 +1,4 @@
+import multiprocessing
 import sys
 from typing import Dict, Union
 from tkinter import *
@@ -45,6 +46,8 @@ def main(args: Union[Dict[str, int | str | float], None]):
 
 
 if __name__ == "__main__":
+    # in the frozen executable, worker processes run their target instead of main()
+    multiprocessing.freeze_support()
     if len(sys.argv) > 1:
         args = parser.parse_args()
     else:
@@ -1 +1 @@
-from model.model import RESRGAN, RESRGAN_TS 
\ No newline at end of file
+from model.model import RESRGAN, RESRGAN_TS, RESRGAN_ONNX 
\ No newline at end of file
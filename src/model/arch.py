@@ -1,10 +1,21 @@
 import sys, os
+import math
 import torch
 from torch import nn as nn
 from torch.nn import functional as F
 from model.utils import default_init_weights
 
 
+def use_inference_forward(x) -> bool:
+    """Whether the inference-only forward passes can run: in inference mode on real
+    tensors, i.e. not while the model is being traced or exported."""
+    return (
+        torch.is_inference_mode_enabled()
+        and isinstance(x, torch.Tensor)
+        and not torch.jit.is_tracing()
+    )
+
+
 class DenseBlock(nn.Module):
     """Residual Dense Block.
 
@@ -54,6 +65,60 @@ class DenseBlock(nn.Module):
             0.1,
         )
 
+    @torch.no_grad()
+    def prune_channels(self, amount: float) -> None:
+        """Structured L1 pruning: removes the growth channels (the outputs of conv_block_1
+        to conv_block_4) whose filters have the smallest L1 norm, narrowing these convs
+        as well as the input channels of the convs they are concatenated into.
+        The output channels of conv_block_5 are kept for the residual connection.
+
+        Args:
+            amount (float): The fraction of growth channels to remove from each conv.
+        """
+        in_channels = self.conv_list[0].in_channels
+        # indices of the kept channels in the unpruned concatenation of outs
+        kept_inputs = [torch.arange(in_channels, device=self.conv_list[0].weight.device)]
+        offset = in_channels
+        for i, conv in enumerate(self.conv_list):
+            weight, bias = conv.weight[:, torch.cat(kept_inputs)], conv.bias
+            if i < len(self.conv_list) - 1:
+                num_kept = max(1, round(conv.out_channels * (1 - amount)))
+                norms = conv.weight.abs().sum(dim=(1, 2, 3), dtype=torch.float32)
+                keep = torch.topk(norms, num_kept).indices.sort().values
+                weight, bias = weight[keep], bias[keep]
+                kept_inputs.append(keep + offset)
+                offset += conv.out_channels
+            pruned_conv = nn.Conv2d(
+                weight.shape[1], weight.shape[0], conv.kernel_size, conv.stride, conv.padding
+            ).to(device=weight.device, dtype=weight.dtype)
+            pruned_conv.weight.copy_(weight)
+            pruned_conv.bias.copy_(bias)
+            setattr(self, f"conv_block_{i + 1}", pruned_conv)
+        self.conv_list = [
+            self.conv_block_1,
+            self.conv_block_2,
+            self.conv_block_3,
+            self.conv_block_4,
+            self.conv_block_5,
+        ]
+
+    def forward_inference(self, features):
+        """Inference-only forward pass that avoids concatenating the growing feature
+        history. features is a buffer of shape (n, conv_block_5.in_channels, h, w) whose
+        first in_channels channels hold the input; each conv writes its output into the
+        following channels and the block's output replaces the input in place.
+        """
+        in_channels = self.conv_list[0].in_channels
+        offset = in_channels
+        for layer in self.conv_list[:-1]:
+            growth = layer.out_channels
+            features[:, offset : offset + growth] = self.act(layer(features[:, :offset]))
+            offset += growth
+        features[:, :in_channels].add_(
+            self.conv_list[-1](features[:, :offset]), alpha=self.res_scale
+        )
+        return features
+
     def forward(self, x):
         outs = [x]
         for i, layer in enumerate(self.conv_list):
@@ -89,7 +154,24 @@ class Basic_Block(nn.Module):
         self.dense_block_3 = DenseBlock(in_channels, channels_per_conv)
         self.dense_blocks = [self.dense_block_1, self.dense_block_2, self.dense_block_3]
 
+    def forward_inference(self, x):
+        """Inference-only forward pass; the dense blocks share one preallocated channel
+        buffer and the residual connections are added in place. x is left unchanged.
+        """
+        in_channels = x.shape[1]
+        features = x.new_empty(
+            (x.shape[0], self.dense_block_1.conv_list[-1].in_channels) + x.shape[2:]
+        )
+        features[:, :in_channels] = x
+        for block in self.dense_blocks:
+            block.forward_inference(features)
+        return torch.add(x, features[:, :in_channels], alpha=self.res_scale)
+
     def forward(self, x):
+        # channel slices of channels_last features aren't dense, so convolving them
+        # costs more than the concatenations it saves
+        if use_inference_forward(x) and x.is_contiguous():
+            return self.forward_inference(x)
         residual = x.clone()
         for i, block in enumerate(self.dense_blocks):
             x = block(x)
@@ -118,6 +200,11 @@ class Generator(nn.Module):
         num_grow_ch (int): Channels for each growth. Default: 32.
     """
 
+    # number of bands of trunk feature rows upsampled one at a time in inference mode
+    upsample_bands = 8
+    # trunk feature rows an upsampled row depends on above and below it
+    upsample_band_halo = 2
+
     def __init__(
         self, num_in_ch, num_out_ch, scale=4, num_feat=64, num_block=23, num_grow_ch=32
     ):
@@ -161,6 +248,12 @@ class Generator(nn.Module):
         basic_blocks = self.conv_body(self.basic_blocks(x))
         x = x + basic_blocks
         del basic_blocks
+        if use_inference_forward(x):
+            return self.upsample_in_bands(x)
+        return self.upsample(x)
+
+    def upsample(self, x):
+        """Upsamples the trunk features x 4 times and maps them to the output image."""
         x = self.act(
             self.upsample_2x_1_convblock(
                 F.interpolate(x, scale_factor=2, mode="nearest")
@@ -175,3 +268,28 @@ class Generator(nn.Module):
         x = self.pen_conv(x)
         x = self.final_conv(self.act(x))
         return x
+
+    def upsample_in_bands(self, x):
+        """
+        Upsamples the trunk features in bands of rows so that only one band of the
+        full resolution features is held in memory at once. Each band is upsampled
+        with upsample_band_halo extra rows above and below it which are cropped off,
+        so the result matches upsampling x at once up to float rounding.
+        """
+        height = x.shape[2]
+        # bands are kept several times taller than their halo
+        band_rows = max(math.ceil(height / self.upsample_bands), 4 * self.upsample_band_halo)
+        if height <= band_rows:
+            return self.upsample(x)
+        output = None
+        for top in range(0, height, band_rows):
+            bottom = min(top + band_rows, height)
+            band_top = max(0, top - self.upsample_band_halo)
+            band_bottom = min(height, bottom + self.upsample_band_halo)
+            band = self.upsample(x[:, :, band_top:band_bottom])
+            if output is None:
+                output = band.new_empty(band.shape[:2] + (height * 4, band.shape[3]))
+            output[:, :, top * 4 : bottom * 4] = band[
+                :, :, (top - band_top) * 4 : (bottom - band_top) * 4
+            ]
+        return output
@@ -1,7 +1,10 @@
+import os
+import pickle
+import numpy as np
 import torch
 from model.arch import Generator
 from model.arch_ts import Generator as Generator_TS
-from model.utils import prune_model_for_inference
+from model.utils import prune_model_for_inference, quantize_model_for_inference
 
 
 class RESRGAN:
@@ -9,7 +12,7 @@ class RESRGAN:
     Real ESRGAN pipeline orchestrator
     """
 
-    def __init__(self, device, scale=4):
+    def __init__(self, device, scale=4, half=False, pruning_mode="bake"):
         self.device = device
         self.scale = scale
         self.gen = Generator(
@@ -20,14 +23,33 @@ class RESRGAN:
             num_grow_ch=32,
             scale=scale,
         )
+        if half:
+            self.gen.half()
 
         self.gen.to(self.device)
-        self.quantize = False
-        self.prune = True
+        self.pruning_mode = pruning_mode
+
+    @staticmethod
+    def read_weights(model_path):
+        """
+        Reads the state dict of a .safetensors or .pth weight file. Weight files are
+        memory-mapped where possible so that only the pages being copied into the
+        Generator are read from disk.
+        """
+        if model_path.endswith(".safetensors"):
+            from safetensors.torch import load_file
+
+            return load_file(model_path, device="cpu")
+        try:
+            return torch.load(model_path, map_location="cpu", mmap=True, weights_only=True)
+        except (RuntimeError, TypeError, pickle.UnpicklingError):
+            # weight files saved in the legacy (non-zip) format can't be memory-mapped
+            # and torch versions prior to 2.1 don't support mmap
+            return torch.load(model_path, map_location="cpu")
 
     def load_weights(self, model_path):
 
-        loadnet = torch.load(model_path)
+        loadnet = self.read_weights(model_path)
         if "params" in loadnet:
             self.gen.load_state_dict(loadnet["params"], strict=True)
         elif "params_ema" in loadnet:
@@ -37,16 +59,25 @@ class RESRGAN:
 
         self.gen.eval()
 
-        if self.prune:
-            self.gen = prune_model_for_inference(self.gen, pruning_amount=0.2)
-
-        if self.quantize:
-            self.gen = torch.quantization.quantize_dynamic(
-                self.gen,
-                {torch.nn.Conv2d},  # only conv2d in Real-ESRGAN
-                dtype=torch.qint8,
+        if self.pruning_mode != "none":
+            self.gen = prune_model_for_inference(
+                self.gen, pruning_amount=0.2, mode=self.pruning_mode
             )
 
+    def quantize_weights(self, calibration_patches):
+        """
+        Quantizes the Generator to INT8 for CPU inference, calibrating the quantization
+        of its activations on calibration_patches of shape (n, c, h, w).
+        """
+        self.gen = quantize_model_for_inference(self.gen, calibration_patches)
+
+    def cast_to_bfloat16(self):
+        """
+        Casts the Generator's weights to bfloat16 in the channels_last memory format
+        for CPU inference.
+        """
+        self.gen = BF16Generator(self.gen)
+
 
 class RESRGAN_TS:
     def __init__(self, device):
@@ -55,5 +86,83 @@ class RESRGAN_TS:
         # Load the TorchScript model from model_path
 
     def load_weights(self, model_path):
-        self.gen = torch.jit.load(model_path).to(self.device)
+        self.gen = torch.jit.load(model_path, map_location=self.device)
         self.gen.eval()
+
+
+class RESRGAN_ONNX:
+    def __init__(self, device, intra_op_threads=0, inter_op_threads=0):
+        self.device = device
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+
+        # Load the ONNX export of the Generator from model_path
+
+    def load_weights(self, model_path):
+        self.gen = ONNXGenerator(
+            model_path, self.device, self.intra_op_threads, self.inter_op_threads
+        )
+        self.gen.eval()
+
+
+class BF16Generator(torch.nn.Module):
+    """
+    Runs the Generator in bfloat16 on the CPU. It is called like the Generator: it
+    takes and returns float32 image tensors of shape (batch size, c, h, w).
+    The weights are cast to bfloat16 once and, like the activations, kept in the
+    channels_last memory format that oneDNN's bfloat16 convolutions run fastest in.
+    Autocasting keeps the operations that need float32 accuracy in float32.
+
+    Args:
+        gen (Generator): The float32 Generator.
+    """
+
+    def __init__(self, gen):
+        super().__init__()
+        self.gen = gen.to(dtype=torch.bfloat16, memory_format=torch.channels_last)
+
+    def forward(self, x):
+        with torch.autocast("cpu", dtype=torch.bfloat16):
+            output = self.gen(x.contiguous(memory_format=torch.channels_last))
+        return output.float()
+
+
+class ONNXGenerator(torch.nn.Module):
+    """
+    Runs an ONNX export of the Generator with ONNX Runtime. It is called like the
+    Generator: it takes and returns image tensors of shape (batch size, c, h, w).
+
+    Args:
+        model_path (str): Path of the .onnx file.
+        device (str): cpu or cuda; cuda is used if ONNX Runtime supports it.
+        intra_op_threads (int): Threads used within an operator, 0 lets ONNX Runtime decide.
+        inter_op_threads (int): Threads used across operators, 0 lets ONNX Runtime decide.
+    """
+
+    def __init__(self, model_path, device, intra_op_threads=0, inter_op_threads=0):
+        super().__init__()
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        providers = ["CPUExecutionProvider"]
+        if device == "cuda" and "CUDAExecutionProvider" in ort.get_available_providers():
+            providers.insert(0, "CUDAExecutionProvider")
+        self.session = ort.InferenceSession(
+            model_path, sess_options=options, providers=providers
+        )
+        self.input = self.session.get_inputs()[0]
+        self.input_dtype = (
+            np.float16 if self.input.type == "tensor(float16)" else np.float32
+        )
+        # the weights are held by the session rather than by module parameters
+        self.memory_size = os.path.getsize(model_path)
+
+    def forward(self, x):
+        output = self.session.run(
+            None,
+            {self.input.name: x.detach().cpu().numpy().astype(self.input_dtype, copy=False)},
+        )[0]
+        return torch.from_numpy(output).to(x.device)
@@ -1,6 +1,92 @@
+import os
+import time
+import cv2
+import numpy as np
 import torch
 from model.arch_ts import Generator  # Adjust this according to your actual model imports
 
+
+def convert_weights(weight_file, half=False):
+    """
+    Converts a .pth weight file into weights that can be memory-mapped when loaded: a
+    .safetensors file if safetensors is installed, otherwise a zip-format .pth file.
+    With half, the weights are converted to float16 for upscaling in normal precision.
+    The converted weights are saved next to the original weight file, i.e.
+    saved_models/4x.pth -> saved_models/4x_fp16.safetensors
+    """
+    loadnet = torch.load(weight_file, map_location="cpu")
+    if "params" in loadnet:
+        state_dict = loadnet["params"]
+    elif "params_ema" in loadnet:
+        state_dict = loadnet["params_ema"]
+    else:
+        state_dict = loadnet
+    state_dict = {
+        name: (tensor.half() if half else tensor).contiguous()
+        for name, tensor in state_dict.items()
+    }
+
+    save_path = os.path.splitext(weight_file)[0] + ("_fp16" if half else "")
+    try:
+        from safetensors.torch import save_file
+
+        save_path += ".safetensors"
+        save_file(state_dict, save_path)
+    except ImportError:
+        save_path += ".pth"
+        torch.save(state_dict, save_path)
+    print(f"Weights {weight_file} have been converted and saved as {save_path}.")
+    return save_path
+
+
+def benchmark_pruning(
+    weight_file, scale, image_dir=None, patch_size=128, runs=3, device="cpu"
+):
+    """
+    Reports the time it takes each pruning mode to upscale a patch and the PSNR of its
+    output against the output of the unpruned Generator. Patches are cropped from the
+    centre of the images in image_dir, random patches are used if no image_dir is given.
+    i.e. benchmark_pruning(os.path.join("saved_models", "4x.pth"), scale=4, image_dir="textures")
+    """
+    from model.model import RESRGAN
+
+    patches = []
+    for file_name in sorted(os.listdir(image_dir)) if image_dir else []:
+        image = cv2.imread(os.path.join(image_dir, file_name), cv2.IMREAD_COLOR)
+        if image is None or min(image.shape[:2]) < patch_size:
+            continue
+        top = (image.shape[0] - patch_size) // 2
+        left = (image.shape[1] - patch_size) // 2
+        patch = image[top : top + patch_size, left : left + patch_size, ::-1]
+        patches.append(torch.from_numpy(patch / 255.0).permute(2, 0, 1))
+    if not patches:
+        patches = list(torch.rand(4, 3, patch_size, patch_size, dtype=torch.float64))
+    patches = torch.stack(patches).to(device=device, dtype=torch.float32)
+
+    results, reference = {}, None
+    for mode in ["none", "bake", "structured"]:
+        model = RESRGAN(device=device, scale=scale, pruning_mode=mode)
+        model.load_weights(weight_file)
+        with torch.inference_mode():
+            model.gen(patches[:1])  # warm-up
+            if device == "cuda":
+                torch.cuda.synchronize()
+            start_time = time.perf_counter()
+            for _ in range(runs):
+                outputs = torch.cat([model.gen(patch[None]) for patch in patches])
+            if device == "cuda":
+                torch.cuda.synchronize()
+            seconds = (time.perf_counter() - start_time) / (runs * len(patches))
+        outputs = outputs.clamp(0, 1)
+        if reference is None:
+            reference = outputs
+        mse = torch.mean((outputs - reference) ** 2).item()
+        psnr = float("inf") if mse == 0 else 10 * np.log10(1 / mse)
+        results[mode] = {"seconds_per_patch": seconds, "psnr": psnr}
+        print(f"{mode:>10}: {seconds:.3f} s/patch, PSNR {psnr:.2f} dB")
+    return results
+
+
 def convert_and_save_model(scale, model_name):
     device = "cuda" if torch.cuda.is_available() else "cpu"
     
@@ -24,6 +110,11 @@ def convert_and_save_model(scale, model_name):
     print(f"Model {model_name} has been converted to TorchScript and saved as {save_path}.")
 
 if __name__ == "__main__":
+    # Convert the inference weights into memory-mappable float32 and float16 weights
+    for scale in [2, 4]:
+        for half in [False, True]:
+            convert_weights(os.path.join("saved_models", f"{scale}x.pth"), half=half)
+
     # Example for converting different models
     convert_and_save_model(scale=8, model_name="RealESRGAN_x8.pth")
     convert_and_save_model(scale=4, model_name="RealESRGAN_x4.pth")
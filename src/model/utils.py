@@ -127,14 +127,64 @@ def pad_reflect(image: np.ndarray, pad_size: int) -> np.ndarray:
 
     return new_img
 
-def prune_model_for_inference(model, pruning_amount=0.2):
-    """Apply L1 unstructured pruning to all Conv2d layers in the model for inference."""
-    # Iterate over all modules in the model and prune Conv2d layers
-    for _, module in model.named_modules():
-        if isinstance(module, torch.nn.Conv2d):
-            prune.l1_unstructured(module, name="weight", amount=pruning_amount)
+def prune_model_for_inference(model, pruning_amount=0.2, mode="bake"):
+    """Prune the model for inference.
+    Modes:
+        - bake: apply L1 unstructured pruning to all Conv2d layers and make it permanent
+          so that the pruned weights are used as they are rather than being rebuilt
+          from the unpruned weights and the pruning mask on every forward pass,
+        - structured: remove the growth channels with the smallest L1 norm from each
+          DenseBlock, resulting in narrower convs that require fewer computations,
+        - none: leave the model as it is.
+    """
+    from model.arch import DenseBlock
+
+    if mode == "bake":
+        # Iterate over all modules in the model and prune Conv2d layers
+        for _, module in model.named_modules():
+            if isinstance(module, torch.nn.Conv2d):
+                prune.l1_unstructured(module, name="weight", amount=pruning_amount)
+                prune.remove(module, name="weight")
+    elif mode == "structured":
+        for _, module in model.named_modules():
+            if isinstance(module, DenseBlock):
+                module.prune_channels(pruning_amount)
     return model
 
+def quantize_model_for_inference(model, calibration_patches, backend="x86"):
+    """Apply INT8 post-training static quantization to the model for CPU inference.
+    Observers are inserted into the model (FX graph mode quantization), the ranges of
+    the activations are calibrated on calibration_patches of shape (n, c, h, w) and the
+    model is then converted to use quantized kernels.
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    if backend not in torch.backends.quantized.supported_engines:
+        backend = "fbgemm"
+    torch.backends.quantized.engine = backend
+    prepared = prepare_fx(
+        model.eval(),
+        get_default_qconfig_mapping(backend),
+        example_inputs=(calibration_patches[:1],),
+    )
+    with torch.no_grad():
+        for patch in calibration_patches.split(1):
+            prepared(patch)
+    return convert_fx(prepared)
+
+
+def cpu_supports_bf16() -> bool:
+    """Whether oneDNN can run bfloat16 kernels natively on this CPU (AVX512-BF16/AMX)."""
+    try:
+        return (
+            torch.backends.mkldnn.is_available()
+            and torch.ops.mkldnn._is_mkldnn_bf16_supported()
+        )
+    except (AttributeError, RuntimeError):  # torch versions without the check
+        return False
+
+
 def unpad_image(image: np.ndarray, pad_size: int) -> torch.Tensor:
     return image[pad_size:-pad_size, pad_size:-pad_size, :]
 
@@ -215,6 +265,75 @@ def split_image_into_overlapping_patches(
     return (np.array(patches), padded_image.shape)
 
 
+class OverlappingPatchBands:
+    """Lazily splits an image into the patches of
+    split_image_into_overlapping_patches(pad_reflect(image, reflect_size), ...),
+    one band of patch rows at a time, so that neither the padded image nor the
+    full array of patches is held in memory.
+
+    The rows and columns of the padded image are gathered from the image through
+    index maps of the reflect padding, the edge extension to a multiple of the
+    patch size and the edge padding, so each band is read from the image with its
+    halo of neighbouring rows. Patches keep the dtype of the image.
+
+    Args:
+        image: array of the input image (h, w, c).
+        patch_size: size of the patches from the original image (without padding).
+        padding_size: size of the overlapping area.
+        reflect_size: size of the reflect padding applied to the image first.
+        band_pixels: largest number of input pixels (without halo) per band.
+    """
+
+    def __init__(
+        self,
+        image: np.ndarray,
+        patch_size: int,
+        padding_size: int,
+        reflect_size: int,
+        band_pixels: int,
+    ):
+        self.image = image
+        self.patch_size = int(patch_size)
+        self.padding_size = int(padding_size)
+        self.reflect_size = int(reflect_size)
+        self.row_map = self.index_map(image.shape[0])
+        self.col_map = self.index_map(image.shape[1])
+        self.padded_shape = (len(self.row_map), len(self.col_map), *image.shape[2:])
+        self.no_rows = (len(self.row_map) - 2 * self.padding_size) // self.patch_size
+        self.no_cols = (len(self.col_map) - 2 * self.padding_size) // self.patch_size
+        self.rows_per_band = max(1, band_pixels // (self.patch_size * len(self.col_map)))
+        kernel = self.patch_size + 2 * self.padding_size
+        # the shape of the array of patches split_image_into_overlapping_patches returns
+        self.shape = (self.no_rows * self.no_cols, kernel, kernel, *image.shape[2:])
+
+    def index_map(self, length: int) -> np.ndarray:
+        """Indices along an axis of the image of each pixel along the padded axis."""
+        index = np.arange(length)
+        if self.reflect_size:
+            index = np.pad(index, self.reflect_size, mode="symmetric")
+        extend = (self.patch_size - len(index) % self.patch_size) % self.patch_size
+        index = np.pad(index, (0, extend), mode="edge")
+        return np.pad(index, self.padding_size, mode="edge")
+
+    def __len__(self) -> int:
+        return math.ceil(self.no_rows / self.rows_per_band)
+
+    def __iter__(self):
+        """Yields the patches (n, h, w, c) of each band of patch rows in order."""
+        size, p = self.patch_size, self.padding_size
+        for first in range(0, self.no_rows, self.rows_per_band):
+            no_rows = min(self.rows_per_band, self.no_rows - first)
+            rows = self.row_map[first * size : (first + no_rows) * size + 2 * p]
+            band = self.image[rows][:, self.col_map]
+            yield np.array(
+                [
+                    band[row * size : (row + 1) * size + 2 * p, col * size : (col + 1) * size + 2 * p]
+                    for row in range(no_rows)
+                    for col in range(self.no_cols)
+                ]
+            )
+
+
 def stitch_together(
     patches: torch.Tensor,
     padded_image_shape: Tuple[int],
@@ -231,27 +350,122 @@ def stitch_together(
         padding_size: size of the overlapping area.
         no_channels: number of channels in the original image (thus far, the Generator only supports a 3-channel image)
     """
+    stitcher = TileStitcher(
+        padded_image_shape=padded_image_shape,
+        target_shape=target_shape,
+        patch_size=patches.size()[1] - 2 * int(padding_size),
+        padding_size=padding_size,
+        no_channels=no_channels,
+    )
+    stitcher.add(patches.permute(0, 3, 1, 2))
+    return stitcher.image
 
-    xmax, ymax, _ = padded_image_shape
-    patches = unpad_patches(patches, padding_size)
-    patch_size = patches.size()[1]
-    n_patches_per_row = ymax // patch_size
-
-    complete_image = torch.zeros((xmax, ymax, no_channels), dtype=patches.dtype)
-
-    row = -1
-    col = 0
-    for i in range(len(patches)):
-        if i % n_patches_per_row == 0:
-            row += 1
-            col = 0
-        complete_image[
-            row * patch_size : (row + 1) * patch_size,
-            col * patch_size : (col + 1) * patch_size,
-            :,
-        ] = patches[i]
-        col += 1
-        
-    complete_image=complete_image[padding_size : target_shape[0] + padding_size, padding_size : target_shape[1] + padding_size, :]
-    return complete_image
 
+class TileStitcher:
+    """Reconstructs an image from upscaled overlapping patches as they come out
+    of the generator.
+
+    Patches (n, c, h, w) are added in the order produced by
+    split_image_into_overlapping_patches and are written straight into a
+    preallocated (h, w, c) image of the target shape, one row of patches at a
+    time, so the full set of upscaled patches is never held in memory.
+    Optionally, the overlapping margins of neighbouring patches are blended
+    with linear (feathered) weights that sum to 1 across each overlap.
+
+    Args:
+        padded_image_shape: shape of the padded image contructed in split_image_into_overlapping_patches (scaled)
+        target_shape: shape of the final image (scaled)
+        patch_size: size of the patches without their padding (scaled)
+        padding_size: size of the overlapping area (scaled)
+        no_channels: number of channels in the patches
+        blend: whether to blend the overlapping area of neighbouring patches
+        image: zeroed image of the target shape to stitch into (i.e. memory-mapped),
+            allocated once the first patches are added if None
+    """
+
+    def __init__(
+        self,
+        padded_image_shape: Tuple[int],
+        target_shape: Tuple[int],
+        patch_size: int,
+        padding_size: int,
+        no_channels: int = 3,
+        blend: bool = False,
+        image: torch.Tensor = None,
+    ):
+        self.patch_size = int(patch_size)
+        self.padding_size = int(padding_size)
+        self.target_shape = (int(target_shape[0]), int(target_shape[1]), no_channels)
+        self.no_rows = (int(padded_image_shape[0]) - 2 * self.padding_size) // self.patch_size
+        self.no_cols = (int(padded_image_shape[1]) - 2 * self.padding_size) // self.patch_size
+        # the feathered weights only sum to 1 if a patch's leading and trailing
+        # overlap don't meet
+        self.blend = blend and 0 < 2 * self.padding_size <= self.patch_size
+        if self.blend:
+            self.col_weights = torch.stack(
+                [self.feather_weights(col, self.no_cols) for col in range(self.no_cols)]
+            )
+        self.image = image
+        self.pending = []
+        self.row = 0
+
+    def feather_weights(self, index: int, count: int) -> torch.Tensor:
+        """1D weights of a patch along one axis: rising over the overlap with the
+        previous patch, falling over the overlap with the next one."""
+        overlap = 2 * self.padding_size
+        ramp = (torch.arange(overlap, dtype=torch.float32) + 0.5) / overlap
+        weights = torch.ones(self.patch_size + overlap, dtype=torch.float32)
+        if index > 0:
+            weights[:overlap] = ramp
+        if index < count - 1:
+            weights[-overlap:] = ramp.flip(0)
+        return weights
+
+    def add(self, patches: torch.Tensor) -> None:
+        if self.image is None:
+            self.image = torch.zeros(self.target_shape, dtype=patches.dtype)
+        self.pending.append(patches)
+        pending = torch.cat(self.pending, dim=0) if len(self.pending) > 1 else patches
+        while len(pending) >= self.no_cols:
+            self.write_row(pending[: self.no_cols])
+            pending = pending[self.no_cols :]
+        self.pending = [pending] if len(pending) else []
+
+    def write_row(self, patches: torch.Tensor) -> None:
+        """Writes a full row of patches into the image. Coordinates are relative
+        to the target image, which starts padding_size into the padded image."""
+        p, size = self.padding_size, self.patch_size
+        no_channels = patches.shape[1]
+        if self.blend:
+            kernel = size + 2 * p
+            weights = (
+                self.feather_weights(self.row, self.no_rows)[:, None]
+                * self.col_weights[:, None, :]
+            )
+            weighted = patches.to(torch.float32) * weights[:, None]
+            strip = F.fold(
+                weighted.reshape(self.no_cols, -1).T.unsqueeze(0),
+                output_size=(kernel, self.no_cols * size + 2 * p),
+                kernel_size=kernel,
+                stride=size,
+            )[0].permute(1, 2, 0)
+            top, left = self.row * size - 2 * p, -2 * p
+        else:
+            strip = (
+                patches[:, :, p : p + size, p : p + size]
+                .permute(2, 0, 3, 1)
+                .reshape(size, self.no_cols * size, no_channels)
+            )
+            top, left = self.row * size - p, -p
+
+        # clip the strip to the bounds of the target image
+        y0, x0 = max(top, 0), max(left, 0)
+        y1 = min(top + strip.shape[0], self.target_shape[0])
+        x1 = min(left + strip.shape[1], self.target_shape[1])
+        if y1 > y0:
+            region = strip[y0 - top : y1 - top, x0 - left : x1 - left]
+            if self.blend:
+                self.image[y0:y1, x0:x1] += region.to(self.image.dtype)
+            else:
+                self.image[y0:y1, x0:x1] = region
+        self.row += 1
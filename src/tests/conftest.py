@@ -4,6 +4,9 @@ from typing import List, Tuple
 
 sys.path.append("C:\\Users\\Moham\\Desktop\\official_cg_tool_dev_repo\\src")
 import pytest
+import torch
+from app_config.config import ExportConfig
+from model.arch import Generator
 from utils.export_utils import write_log_to_file
 from tests.test_data.testing_config.test_generator_config import (
     generator_constructor_args,
@@ -50,3 +53,33 @@ def test_export_config(multiple_images: bool = False):
         obj=None, parent=test_image_path, recursive=recursive, thread=False
     )
     return TestConfig
+
+
+@pytest.fixture()
+def generator():
+    """Fixture for a small, seeded 2x Generator that upscales test images quickly."""
+    torch.manual_seed(0)
+    return Generator(num_in_ch=3, num_out_ch=3, scale=2, num_block=1).eval()
+
+
+@pytest.fixture()
+def no_compression(monkeypatch):
+    """Fixture that exports images without compression."""
+    monkeypatch.setattr(ExportConfig, "compression", "0")
+
+
+@pytest.fixture()
+def image_export_config(no_compression):
+    """Fixture for the export configuration of 8 bit RGBA png ImageContainers,
+    tests add the options they exercise."""
+    return {
+        "export_format": "png",
+        "export_color_depth": "8",
+        "export_color_mode": "RGBA",
+        "color_space": "sRGB In/ sRGB Out",
+        "device": "cpu",
+        "scale": "2x",
+        "upscale_precision": "high",
+        "noise_level": 0.0,
+        "gamma_adjustment": 1.0,
+    }
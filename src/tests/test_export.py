@@ -3,6 +3,8 @@ import sys
 sys.path.append("C:\\Users\\Moham\\Desktop\\official_cg_tool_dev_repo\\src")
 import os
 import time
+import numpy
+import PIL
 import torch
 import pytest
 from gui.frames.export_frame import ExportFrame, ExportThread
@@ -290,3 +292,428 @@ def test_export_location(test_export_config):  # TODO: restore pytest fixture ar
             os.path.join(parsed_config["single_export_location"], f_name[:-4] + ".tga")
         )
     return
+
+
+
+def test_cross_image_batching(tmp_path, monkeypatch, generator):
+    """
+    Test that images of the same size are scheduled into batches that are upscaled
+    together and that batched upscaling matches upscaling each image on its own.
+    """
+    from types import SimpleNamespace
+    from app_config.config import ExportConfig
+    from utils.export_utils import schedule_image_batches, upscale_image_batch
+
+    names = []
+    for i, size in enumerate([(32, 24), (16, 16), (32, 24), (32, 24)]):
+        names.append(f"texture_{i}.png")
+        PIL.Image.new("RGB", size).save(tmp_path / names[-1])
+    cache = (names, [str(tmp_path)] * len(names))
+    export_config = {"device": "cpu", "upscale_precision": "high", "gamma_adjustment": 1.0}
+    monkeypatch.setattr(ExportConfig, "tile_batch_size", "2")
+    assert schedule_image_batches([0, 1, 2, 3], cache, export_config, 2) == [[0, 2], [1], [3]]
+    assert schedule_image_batches([0, 1, 2, 3], cache, export_config, 1) == [[0], [1], [2], [3]]
+
+    arrays = [numpy.random.rand(24, 32, 3).astype(numpy.float32) for _ in range(2)]
+    images = [
+        SimpleNamespace(
+            src_image_name=f"texture_{i}.png",
+            color_channels=array,
+            alpha=None,
+            upscale_color_with_generator=True,
+            upscale_alpha_with_generator=False,
+            packed_channels=[],
+            is_packed=lambda channel_type: False,
+            transparent_mask=None,
+            handle_gamma_correction=lambda gamma: None,
+            recombine_channels=lambda: None,
+        )
+        for i, array in enumerate(arrays)
+    ]
+    assert upscale_image_batch(None, generator, export_config, images, 2) == images
+    with torch.inference_mode():
+        for image, array in zip(images, arrays):
+            expected = generator(torch.from_numpy(array).permute(2, 0, 1).unsqueeze(0))[0]
+            assert image.color_channels.shape == (3, 48, 64)
+            assert torch.allclose(image.color_channels, expected, atol=1e-5)
+
+
+def test_single_channel_packing(tmp_path, generator, image_export_config):
+    """
+    Test that greyscale color channels and alpha channels of different images are
+    packed into a single forward pass and unpacked into the channels they came from.
+    """
+    from utils.export_utils import ImageContainer, compare_plane_packing, upscale_packed_planes
+
+    rng = numpy.random.default_rng(0)
+    PIL.Image.fromarray((rng.random((32, 24)) * 255).astype("uint8"), "L").save(tmp_path / "grey.png")
+    PIL.Image.fromarray((rng.random((32, 24, 4)) * 255).astype("uint8"), "RGBA").save(tmp_path / "rgba.png")
+    export_config = {**image_export_config, "pack_single_channels": True}
+    images = []
+    for name in ["grey.png", "rgba.png"]:
+        img = ImageContainer(0, str(tmp_path), str(tmp_path), name, **export_config)
+        img.check_all_values_equivalent().split_image().convert_datatype(input=True)
+        images.append(img)
+    grey, rgba = images
+    assert grey.packed_channels == ["color"] and rgba.packed_channels == ["alpha"]
+    assert grey.color_channels.shape == rgba.alpha.shape == (32, 24, 1)
+    pack = numpy.concatenate([grey.color_channels, rgba.alpha, grey.color_channels], axis=2)
+
+    upscale_packed_planes(None, generator, export_config, images, 2)
+    with torch.inference_mode():
+        expected = generator(torch.from_numpy(pack).permute(2, 0, 1).unsqueeze(0))[0]
+    assert grey.color_channels.shape == (1, 64, 48)  # expanded when written
+    assert torch.allclose(grey.color_channels, expected[:1], atol=1e-5)
+    assert torch.allclose(rgba.alpha, expected[1:2], atol=1e-5)
+    # the color channels of the rgba image are still upscaled on their own
+    assert rgba.color_channels.shape == (32, 24, 3)
+
+    planes = [rng.random((16, 16, 1)).astype(numpy.float32) for _ in range(3)]
+    psnr, speed_up = compare_plane_packing(generator, planes, {"device": "cpu", "upscale_precision": "high"}, 2)
+    assert psnr > 0 and speed_up > 0
+
+
+def test_skip_transparent_tiles(tmp_path, monkeypatch, generator, image_export_config):
+    """
+    Test that color tiles under fully transparent alpha (and away from visible
+    pixels) are upscaled bilinearly instead of with the generator.
+    """
+    from app_config.config import ConfigReference, ExportConfig
+    from utils.export_utils import ImageContainer
+    from utils.patch_upscale_strategy import PatchUpscalingStrategy
+
+    rng = numpy.random.default_rng(0)
+    rgba = (rng.random((64, 128, 4)) * 255).astype("uint8")
+    rgba[:, :64, 3] = 0  # the left half is fully transparent
+    PIL.Image.fromarray(rgba, "RGBA").save(tmp_path / "decal.png")
+    monkeypatch.setattr(ExportConfig, "tile_batch_size", "auto")
+    monkeypatch.setattr(ConfigReference, "triage_tile_size", 32)
+    monkeypatch.setattr(ConfigReference, "triage_pad_size", 4)
+    for route in PatchUpscalingStrategy.triage_counts:
+        monkeypatch.setitem(PatchUpscalingStrategy.triage_counts, route, 0)
+    export_config = {**image_export_config, "skip_transparent_tiles": True}
+    img = ImageContainer(0, str(tmp_path), str(tmp_path), "decal.png", **export_config)
+    img.check_all_values_equivalent().split_image().convert_datatype(input=True)
+    # pixels within the dilation margin of visible pixels aren't transparent
+    margin = ConfigReference.transparent_dilation
+    assert img.transparent_mask[:, : 64 - margin].all() and not img.transparent_mask[:, 64 - margin :].any()
+
+    with torch.inference_mode():
+        upscaled = PatchUpscalingStrategy().upscale(img, "color", generator, export_config, 2)
+    assert upscaled.shape == (128, 256, 3)
+    counts = PatchUpscalingStrategy.triage_counts
+    # the reflect padded image is split into 3 rows of 5 tiles, the padded tiles of the
+    # second column reach into the dilation margin
+    assert counts["transparent"] == 3 and counts["generator"] == 12
+    # without an exported alpha channel, the color under it is visible
+    export_config["export_color_mode"] = "RGB"
+    img = ImageContainer(0, str(tmp_path), str(tmp_path), "decal.png", **export_config)
+    img.check_all_values_equivalent().split_image()
+    assert img.transparent_mask is None
+    # mostly opaque images without a whole transparent tile aren't split into tiles
+    # unless tile triage is enabled anyway
+    export_config["export_color_mode"] = "RGBA"
+    rgba[:, :, 3] = 255
+    rgba[:32, :32, 3] = 0
+    PIL.Image.fromarray(rgba, "RGBA").save(tmp_path / "decal.png")
+    img = ImageContainer(0, str(tmp_path), str(tmp_path), "decal.png", **export_config)
+    img.check_all_values_equivalent().split_image()
+    assert img.transparent_mask is None
+    monkeypatch.setattr(ExportConfig, "tile_triage", True)
+    img = ImageContainer(0, str(tmp_path), str(tmp_path), "decal.png", **export_config)
+    img.check_all_values_equivalent().split_image()
+    assert img.transparent_mask is not None
+
+
+def test_binary_alpha(tmp_path, image_export_config):
+    """
+    Test that binary (cutout) alpha channels are detected and upscaled with the
+    edge-aware threshold instead of the generator, and that other alphas aren't.
+    """
+    import cv2
+    from utils.export_utils import ImageContainer
+
+    rng = numpy.random.default_rng(0)
+    rgba = (rng.random((64, 64, 4)) * 255).astype("uint8")
+    cutout = numpy.zeros((64, 64), dtype="uint8")
+    cv2.circle(cutout, (32, 32), 20, 255, -1)
+    rgba[..., 3] = cutout
+    PIL.Image.fromarray(rgba, "RGBA").save(tmp_path / "cutout.png")
+    rgba[..., 3] = numpy.linspace(0, 255, 64, dtype="uint8")[None, :]
+    PIL.Image.fromarray(rgba, "RGBA").save(tmp_path / "gradient.png")
+    export_config = {**image_export_config, "binary_alpha_upscale": True}
+    img = ImageContainer(0, str(tmp_path), str(tmp_path), "cutout.png", **export_config)
+    img.check_all_values_equivalent().split_image()
+    assert img.upscale_color_with_generator and not img.upscale_alpha_with_generator
+    assert img.alpha.shape == (128, 128, 1)
+    assert set(numpy.unique(img.alpha)) == {0.0, 1.0}
+    expected = cv2.resize(cutout, (128, 128), interpolation=cv2.INTER_NEAREST) > 0
+    assert (img.alpha[..., 0] > 0.5).sum() == pytest.approx(expected.sum(), rel=0.05)
+    assert ((img.alpha[..., 0] > 0.5) != expected).mean() < 0.02
+
+    img = ImageContainer(0, str(tmp_path), str(tmp_path), "gradient.png", **export_config)
+    img.check_all_values_equivalent().split_image()
+    assert img.upscale_alpha_with_generator and img.alpha.shape == (64, 64, 3)
+
+
+def test_normal_map_mode(tmp_path, generator, image_export_config):
+    """
+    Test that normal maps are detected by name or by their pixels, that only their
+    X and Y channels are upscaled and that Z is rebuilt into unit vectors.
+    """
+    from utils.export_utils import ImageContainer, upscale_packed_planes
+
+    rng = numpy.random.default_rng(0)
+    normals = rng.normal(size=(32, 24, 3)) * [0.3, 0.3, 1.0]
+    normals[..., 2] = numpy.abs(normals[..., 2])
+    normals /= numpy.linalg.norm(normals, axis=2, keepdims=True)
+    encoded = ((normals + 1) / 2 * 255).round().astype("uint8")
+    PIL.Image.fromarray(encoded, "RGB").save(tmp_path / "brick_nrm.png")
+    PIL.Image.fromarray(encoded, "RGB").save(tmp_path / "brick.png")
+    PIL.Image.fromarray((rng.random((32, 24, 3)) * 255).astype("uint8"), "RGB").save(tmp_path / "noise.png")
+    export_config = {
+        **image_export_config,
+        "export_color_mode": "RGB",
+        "normal_map_mode": "auto",
+        "renormalize_normals": True,
+    }
+    images = {}
+    for name in ["brick_nrm.png", "brick.png", "noise.png"]:
+        img = ImageContainer(0, str(tmp_path), str(tmp_path), name, **export_config)
+        img.check_all_values_equivalent().split_image().convert_datatype(input=True)
+        images[name] = img
+    assert images["brick_nrm.png"].packed_channels == ["normal_x", "normal_y"]
+    assert images["brick.png"].packed_channels == ["normal_x", "normal_y"]  # by its pixels
+    assert images["noise.png"].packed_channels == [] and not images["noise.png"].normal_map
+
+    normal_map = images["brick_nrm.png"]
+    assert normal_map.color_channels.shape == (32, 24, 2)
+    upscale_packed_planes(None, generator, export_config, [normal_map], 2)
+    assert normal_map.color_channels.shape == (3, 64, 48)
+    x, y, z = (normal_map.color_channels[i] * 2 - 1 for i in normal_map.normal_channel_indices())
+    assert torch.allclose(torch.sqrt(x**2 + y**2 + z**2), torch.ones_like(x), atol=1e-3)
+    assert (z >= 0).all()
+
+
+def test_image_statistics(tmp_path, monkeypatch, image_export_config):
+    """
+    Test that the single chunked statistics pass matches full image reductions and
+    that an ImageContainer gathers it once and reuses it for its routing decisions.
+    """
+    from app_config.config import ConfigReference
+    from utils.export_utils import ImageContainer
+    from utils.image_statistics import ImageStatistics
+
+    monkeypatch.setattr(ConfigReference, "statistics_chunk_pixels", 100)  # several chunks
+    rng = numpy.random.default_rng(0)
+    rgba = (rng.random((36, 24, 4)) * 255).astype("uint8")
+    rgba[..., 3] = 0
+    rgba[10:30, 5:20, 3] = 255
+    rgba[10, 5, 3] = 128  # a single antialiased pixel
+    statistics = ImageStatistics(rgba, has_alpha=True)
+    assert (statistics.channel_min == rgba.min(axis=(0, 1))).all()
+    assert (statistics.channel_max == rgba.max(axis=(0, 1))).all()
+    assert statistics.color_min == rgba[..., :3].min() and statistics.color_max == rgba[..., :3].max()
+    assert not statistics.constant and not statistics.rgb_equal
+    assert statistics.alpha_binary and not statistics.alpha_constant
+    assert statistics.alpha_coverage == pytest.approx(numpy.count_nonzero(rgba[..., 3]) / (36 * 24))
+
+    grey = numpy.repeat(rng.random((37, 23, 1)).astype(numpy.float32), 3, axis=2)
+    statistics = ImageStatistics(grey, has_alpha=False)
+    assert statistics.rgb_equal and statistics.alpha_coverage is None and not statistics.alpha_binary
+    gradient = numpy.concatenate([grey, numpy.linspace(0, 1, 23, dtype=numpy.float32)[None, :, None].repeat(37, 0)], axis=2)
+    assert not ImageStatistics(gradient, has_alpha=True).alpha_binary
+    assert ImageStatistics(numpy.full((8, 8), 3, dtype="uint16"), has_alpha=False).constant
+
+    PIL.Image.fromarray(rgba, "RGBA").save(tmp_path / "rgba.png")
+    export_config = {**image_export_config, "binary_alpha_upscale": True}
+    constructed = []
+    monkeypatch.setattr(
+        "utils.image_container.ImageStatistics",
+        lambda *args: constructed.append(ImageStatistics(*args)) or constructed[-1],
+    )
+    img = ImageContainer(0, str(tmp_path), str(tmp_path), "rgba.png", **export_config)
+    img.check_all_values_equivalent().split_image()
+    assert len(constructed) == 1 and img.statistics is constructed[0]
+    assert not img.upscale_alpha_with_generator and img.alpha.shape == (72, 48, 1)
+
+
+def test_greyscale_stored_as_rgb(tmp_path, monkeypatch, generator, image_export_config):
+    """
+    Test that RGB(A) images whose R, G and B are equal (within the tolerance) are
+    processed as single channel images and expanded to the export color mode when
+    they are written.
+    """
+    from app_config.config import ConfigReference
+    from utils.export_utils import ImageContainer, upscale_packed_planes
+
+    rng = numpy.random.default_rng(0)
+    grey = (rng.random((32, 24, 1)) * 254).astype("uint8")
+    rgba = numpy.concatenate([grey, grey + 1, grey, (rng.random((32, 24, 1)) * 255).astype("uint8")], axis=2)
+    PIL.Image.fromarray(rgba, "RGBA").save(tmp_path / "roughness.png")
+    rgba[..., 1] = grey[..., 0] // 2
+    PIL.Image.fromarray(rgba, "RGBA").save(tmp_path / "color.png")
+    export_config = image_export_config
+    img = ImageContainer(0, str(tmp_path), str(tmp_path), "color.png", **export_config)
+    img.check_all_values_equivalent()
+    assert img.mode == "RGBA" and img.image.shape == (32, 24, 4)
+
+    img = ImageContainer(0, str(tmp_path), str(tmp_path), "roughness.png", **export_config)
+    img.check_all_values_equivalent().split_image()
+    assert img.mode == "LA" and img.color_channels.shape == (32, 24, 3)  # without packing
+
+    export_config["pack_single_channels"] = True
+    img = ImageContainer(0, str(tmp_path), str(tmp_path), "roughness.png", **export_config)
+    img.check_all_values_equivalent().split_image().convert_datatype(input=True)
+    assert sorted(img.packed_channels) == ["alpha", "color"]
+    assert img.color_channels.shape == img.alpha.shape == (32, 24, 1)
+    upscale_packed_planes(None, generator, export_config, [img], 2)
+    monkeypatch.setattr(ConfigReference, "split_color", False)  # reset per image by the export loop
+    monkeypatch.setattr(ConfigReference, "split_alpha", False)
+    img.recombine_channels().convert_datatype(input=False)
+    assert img.image.shape == (64, 48, 2)
+    written = img.handle_write_channel_mode(img.image)
+    assert written.shape == (64, 48, 4)
+    assert (written[..., 0] == written[..., 1]).all() and (written[..., 1] == written[..., 2]).all()
+    assert (written[..., 3] == img.image[..., 1]).all()
+
+
+def test_export_pipeline():
+    """
+    Test that the export pipeline reads ahead and writes behind by at most its
+    depth, keeps the order of the images and stops reading once it is cancelled.
+    """
+    import threading
+    from utils.export_pipeline import ExportPipeline
+
+    lock = threading.Lock()
+    read_started, written = [], []
+
+    def read(i):
+        with lock:
+            read_started.append(i)
+        time.sleep(0.01)
+        if i == 3:
+            raise ValueError("unreadable image")
+        return i
+
+    def write(item):
+        time.sleep(0.02)
+        with lock:
+            written.append(item)
+
+    batches = [[0, 1], [2], [3, 4], [5], [6], [7], [8], [9]]
+    pipeline = ExportPipeline(read, write, depth=2)
+    upscaled, finished = [], []
+    for batch, futures in zip(batches, pipeline.read_batches(batches)):
+        # the reads of this batch and of at most the next 2 images have started
+        assert len(read_started) <= sum(len(b) for b in batches[: batches.index(batch) + 1]) + 2
+        for i, future in zip(batch, futures):
+            if i == 3:
+                with pytest.raises(ValueError):
+                    future.result()
+                continue
+            upscaled.append(future.result())
+            finished += pipeline.submit_write(future.result())
+            assert len(pipeline.writes) <= 2
+        if batch == [5]:
+            pipeline.cancel()  # i.e. the export was stopped
+            break
+    finished += pipeline.close()
+    assert upscaled == [0, 1, 2, 4, 5]
+    assert [item for item, _ in finished] == sorted(written) == upscaled
+    # only the 2 images after the last batch were read ahead
+    assert sorted(read_started) == list(range(6 + 2))
+    assert pipeline.busy["read"] > 0 and pipeline.busy["write"] > 0
+
+
+def test_export_workers(tmp_path, monkeypatch, generator, image_export_config):
+    """
+    Test that export worker processes upscale images like the export thread does,
+    hand them back through shared memory and that a worker that dies only fails the
+    image it was upscaling.
+    """
+    from multiprocessing import shared_memory
+    from app_config.config import ConfigReference
+    from utils import export_utils
+    from utils.export_workers import ExportWorkers, attach_array, share_array
+
+    array = numpy.arange(24, dtype=numpy.uint16).reshape(2, 4, 3)
+    block, descriptor = share_array(array)
+    attached, shared = attach_array(descriptor)
+    assert numpy.array_equal(shared, array)
+    attached.close()
+    block.close()
+    block.unlink()
+
+    rng = numpy.random.default_rng(0)
+    names = [f"texture_{i}.png" for i in range(6)]
+    for name in names:
+        PIL.Image.fromarray((rng.random((16, 12, 3)) * 255).astype("uint8"), "RGB").save(tmp_path / name)
+    (tmp_path / "broken.png").write_text("not an image")
+    cache = (names + ["broken.png"], [str(tmp_path)] * (len(names) + 1))
+    export_config = {
+        **image_export_config, "export_color_mode": "RGB",
+        "export_to_original": True, "single_export_location": "", "prefix": "",
+        "suffix": "", "numbering": "", "mipmaps": "none", "compression": "0",
+    }
+    monkeypatch.setattr(ConfigReference, "split_color", False)
+    monkeypatch.setattr(ConfigReference, "split_alpha", False)
+    # forked workers inherit the test generator and the failing postprocessing
+    monkeypatch.setattr(ConfigReference, "worker_start_method", "fork")
+    monkeypatch.setattr(ConfigReference, "max_worker_restarts", 1)
+    monkeypatch.setattr(export_utils, "setup_generator", lambda export_config, _: (generator, 2))
+    postprocess_image = export_utils.postprocess_image
+
+    def crashing_postprocess(image, im_name, *args):
+        if im_name == "texture_3.png":
+            os._exit(3)
+        return postprocess_image(image, im_name, *args)
+
+    monkeypatch.setattr(export_utils, "postprocess_image", crashing_postprocess)
+
+    written = {}
+    workers = ExportWorkers(
+        2, 1, export_config, cache, lambda image, array: written.update({image.src_image_name: array.copy()})
+    )
+    try:
+        results = {i: error for i, _, error in workers.run(list(range(len(cache[0]))), lambda: False)}
+    finally:
+        workers.close()
+    assert sorted(results) == list(range(len(cache[0])))
+    assert {cache[0][i] for i, error in results.items() if error is not None} == {"texture_3.png", "broken.png"}
+    assert workers.restarts == 1
+
+    for name in names:
+        if name == "texture_3.png":
+            assert name not in written
+            continue
+        image, *_ = export_utils.read_image(names.index(name), cache, export_config, None, False)
+        export_utils.img, export_utils.scale = image, 2
+        export_utils.scale_image(None, generator, export_config, name)
+        ConfigReference.split_color, ConfigReference.split_alpha = False, False
+        postprocess_image(image, name, export_config, None)
+        assert numpy.array_equal(written[name], image.image)
+    assert not [block for block in os.listdir("/dev/shm") if block.startswith("psm_")]
+
+def test_out_of_core_conversion(tmp_path, monkeypatch, image_export_config):
+    """
+    Test that out of core, upscaled images are converted to the export datatype
+    band by band into the same image as in memory.
+    """
+    from app_config.config import ConfigReference, ExportConfig
+    from utils.export_utils import ImageContainer
+
+    rng = numpy.random.default_rng(0)
+    image = rng.random((160, 128, 3)).astype(numpy.float32)
+    upscaled = rng.random((320, 256, 3)).astype(numpy.float32)
+    monkeypatch.setattr(ConfigReference, "out_of_core_band_pixels", 64 * 128)
+    PIL.Image.fromarray((image * 255).astype("uint8"), "RGB").save(tmp_path / "huge.png")
+    export_config = {**image_export_config, "export_color_mode": "RGB"}
+    img = ImageContainer(0, str(tmp_path), str(tmp_path), "huge.png", **export_config)
+    converted = {}
+    for out_of_core in [False, True]:
+        monkeypatch.setattr(ExportConfig, "out_of_core", out_of_core)
+        converted[out_of_core] = img.convert_output_image_dtype(upscaled)
+    assert converted[True].dtype == numpy.uint8
+    assert numpy.array_equal(converted[True], converted[False])
@@ -1,6 +1,7 @@
 import os
 import sys
 import time
+import copy
 
 
 sys.path.append("C:\\Users\\Moham\\Desktop\\official_cg_tool_dev_repo\\src")
@@ -85,3 +86,618 @@ def test_model_output(test_export_config): #TODO: restore pytest fixture argumen
                 for channel in range(test.shape[2])]
                 )
             os.remove(os.path.join(export_dir, pair[0]))
+
+
+def test_batched_patch_upscaling():
+    """
+    Test that upscaling split patches in batches yields the same pixels as upscaling
+    them one at a time. This test upscales random patches with a single-block
+    Generator at each supported tile batch size and compares them to the per-patch result.
+    """
+    from app_config.config import ExportConfig, ConfigReference as confref
+    from utils.patch_upscale_strategy import PatchUpscalingStrategy
+
+    torch.manual_seed(0)
+    patches = numpy.random.rand(5, 96, 96, 3)
+    export_config = {"device": "cpu", "upscale_precision": "high"}
+    for scale in [2, 4]:
+        gen = Generator(num_in_ch=3, num_out_ch=3, scale=scale, num_block=1).eval()
+        with torch.inference_mode():
+            per_patch = torch.cat(
+                [
+                    gen(
+                        confref.inference_transform(image=patch)["image"]
+                        .unsqueeze(0)
+                        .to(dtype=torch.float32)
+                    )
+                    for patch in patches
+                ]
+            )
+            for tile_batch_size in confref.tile_batch_sizes:
+                ExportConfig.tile_batch_size = tile_batch_size
+                batched = PatchUpscalingStrategy().upscale_patches(
+                    patches, gen, export_config, scale
+                )
+                assert torch.equal(batched, per_patch)
+    ExportConfig.tile_batch_size = confref.tile_batch_sizes[0]
+
+
+def test_stitch_split_patches():
+    """
+    Test that split patches are stitched back into the original image. Without
+    blending the recombined image is an exact copy; with blending the feathered
+    weights over the overlapping margins sum to 1, so it matches up to rounding.
+    """
+    from model.utils import TileStitcher, pad_reflect, split_image_into_overlapping_patches
+
+    image = numpy.random.rand(150, 230, 3)
+    patch_size, padding_size = 64, 8
+    patches, p_shape = split_image_into_overlapping_patches(
+        pad_reflect(image, padding_size), patch_size=patch_size, padding_size=padding_size
+    )
+    for blend in [False, True]:
+        stitcher = TileStitcher(
+            padded_image_shape=p_shape[:2],
+            target_shape=image.shape[:2],
+            patch_size=patch_size,
+            padding_size=padding_size,
+            blend=blend,
+        )
+        # patches are added in uneven batches as they would come out of the generator
+        for batch in numpy.array_split(patches, 4):
+            stitcher.add(torch.from_numpy(batch).permute(0, 3, 1, 2))
+        if blend:
+            assert torch.allclose(stitcher.image, torch.from_numpy(image), atol=1e-6)
+        else:
+            assert torch.equal(stitcher.image, torch.from_numpy(image))
+
+
+def test_model_registry():
+    """
+    Test that the model registry loads each generator once, returns the loaded
+    generator on later lookups and evicts the least recently used generators once
+    the memory cap is exceeded.
+    """
+    from caches.model_registry import ModelRegistry
+
+    registry = ModelRegistry()
+    loads = []
+
+    def loader(scale):
+        loads.append(scale)
+        return Generator(num_in_ch=3, num_out_ch=3, scale=scale, num_block=1)
+
+    gen_size = ModelRegistry.model_size(loader(2))
+    loads.clear()
+    memory_cap_gb = 2.5 * gen_size / 1024**3
+    key_2x = (2, "cpu", "high", "eager", "bake", (0, 0))
+    key_4x = (4, "cpu", "high", "eager", "bake", (0, 0))
+
+    gen_2x = registry.get(key_2x, lambda: loader(2), memory_cap_gb)
+    assert registry.get(key_2x, lambda: loader(2), memory_cap_gb) is gen_2x
+    registry.get(key_4x, lambda: loader(4), memory_cap_gb)
+    assert loads == [2, 4]
+    # a third generator exceeds the cap, evicting the least recently used one (2x)
+    registry.get((4, "cpu", "normal", "eager", "bake", (0, 0)), lambda: loader(4), memory_cap_gb)
+    assert registry.get(key_4x, lambda: loader(4), memory_cap_gb) is not None
+    assert loads == [2, 4, 4]
+    assert registry.get(key_2x, lambda: loader(2), memory_cap_gb) is not gen_2x
+    assert loads == [2, 4, 4, 2]
+    # a memory cap of 0 doesn't keep generators loaded
+    registry.get(key_2x, lambda: loader(2), 0)
+    registry.get(key_2x, lambda: loader(2), 0)
+    assert loads == [2, 4, 4, 2, 2, 2] and registry.memory_used == 0
+
+
+def test_weight_conversion(tmp_path):
+    """
+    Test that converted (memory-mappable) weights hold the same values as the original
+    .pth weights and that the converted float16 weights are picked when upscaling in
+    half precision.
+    """
+    from app_config.config import ExportConfig
+    from model.model import RESRGAN
+    from model.optimization_script import convert_weights
+    from utils.export_utils import find_weight_file, load_model
+
+    weight_dir, default_weight_dir = str(tmp_path), ExportConfig.weight_file
+    state_dict = Generator(num_in_ch=3, num_out_ch=3, scale=2).state_dict()
+    # the released weights are saved in the legacy format which can't be memory-mapped
+    torch.save(
+        {"params_ema": state_dict},
+        os.path.join(weight_dir, "2x.pth"),
+        _use_new_zipfile_serialization=False,
+    )
+    ExportConfig.weight_file = weight_dir
+    try:
+        assert find_weight_file(2, half=True) == (os.path.join(weight_dir, "2x.pth"), False)
+        fp32_file = convert_weights(os.path.join(weight_dir, "2x.pth"))
+        fp16_file = convert_weights(os.path.join(weight_dir, "2x.pth"), half=True)
+        assert find_weight_file(2, half=False) == (fp32_file, False)
+        assert find_weight_file(2, half=True) == (fp16_file, True)
+
+        for weight_file, dtype in [(fp32_file, torch.float32), (fp16_file, torch.float16)]:
+            converted = RESRGAN.read_weights(weight_file)
+            assert all(
+                torch.equal(converted[name], tensor.to(dtype))
+                for name, tensor in state_dict.items()
+            )
+        gen = load_model(device="cpu", scale=2, half=True)
+        assert all(param.dtype == torch.float16 for param in gen.parameters())
+    finally:
+        ExportConfig.weight_file = default_weight_dir
+
+
+def test_model_pruning():
+    """
+    Test the pruning modes. Baked pruning should leave no pruning hooks behind while
+    upscaling exactly like the masked weights of unstructured pruning, and structured
+    pruning should result in narrower convs that upscale to the same output shape.
+    """
+    import copy
+    from torch.nn.utils import prune
+    from model.utils import prune_model_for_inference
+
+    torch.manual_seed(0)
+    gen = Generator(num_in_ch=3, num_out_ch=3, scale=4, num_block=2).eval()
+    x = torch.rand(1, 3, 32, 32)
+
+    masked = copy.deepcopy(gen)
+    for module in masked.modules():
+        if isinstance(module, torch.nn.Conv2d):
+            prune.l1_unstructured(module, name="weight", amount=0.2)
+    baked = prune_model_for_inference(copy.deepcopy(gen), pruning_amount=0.2, mode="bake")
+    unpruned_channels = prune_model_for_inference(
+        copy.deepcopy(gen), pruning_amount=0.0, mode="structured"
+    )
+    structured = prune_model_for_inference(
+        copy.deepcopy(gen), pruning_amount=0.2, mode="structured"
+    )
+    with torch.inference_mode():
+        assert not any(module._forward_pre_hooks for module in baked.modules())
+        assert torch.equal(baked(x), masked(x))
+        assert torch.equal(unpruned_channels(x), gen(x))
+        assert structured(x).shape == gen(x).shape
+    dense_block = structured.basic_blocks[0].dense_block_1
+    assert [conv.out_channels for conv in dense_block.conv_list] == [26, 26, 26, 26, 64]
+    assert [conv.in_channels for conv in dense_block.conv_list] == [64, 90, 116, 142, 168]
+
+
+def test_inference_backends(tmp_path, monkeypatch):
+    """
+    Test that the torchscript backend upscales like the eager Generator and is cached
+    on disk for later loads, and that a backend that fails to compile falls back to
+    the eager Generator.
+    """
+    from app_config.config import ExportConfig
+    from utils.export_utils import compile_generator, load_model
+
+    default_weight_dir = ExportConfig.weight_file
+    torch.save(
+        {"params_ema": Generator(num_in_ch=3, num_out_ch=3, scale=2).state_dict()},
+        os.path.join(str(tmp_path), "2x.pth"),
+    )
+    ExportConfig.weight_file = str(tmp_path)
+    try:
+        x = torch.rand(1, 3, 32, 32)
+        eager = load_model(device="cpu", scale=2)
+        scripted = load_model(device="cpu", scale=2, backend="torchscript")
+        assert isinstance(scripted, torch.jit.ScriptModule)
+        assert os.listdir(os.path.join(str(tmp_path), "compiled")) == ["2x_fp32_bake_cpu.pt"]
+        cached = load_model(device="cpu", scale=2, backend="torchscript")
+        with torch.no_grad():
+            assert torch.allclose(scripted(x), eager(x), atol=1e-5)
+            assert torch.equal(cached(x), scripted(x))
+
+        def failing_compile(*args, **kwargs):
+            raise RuntimeError("no compiler available")
+
+        monkeypatch.setattr(torch, "compile", failing_compile)
+        assert compile_generator(eager, "compile", "cpu", False, "") is eager
+    finally:
+        ExportConfig.weight_file = default_weight_dir
+
+
+def test_onnxruntime_backend(tmp_path):
+    """
+    Test that the ONNX Runtime backend upscales images of different sizes and batches
+    of split patches within a tolerance of the PyTorch Generator.
+    """
+    pytest.importorskip("onnxruntime")
+    from utils.export_utils import compile_generator
+    from utils.patch_upscale_strategy import PatchUpscalingStrategy
+
+    torch.manual_seed(0)
+    export_config = {"device": "cpu", "upscale_precision": "high"}
+    for scale in [2, 4]:
+        gen = Generator(num_in_ch=3, num_out_ch=3, scale=scale, num_block=2).eval()
+        onnx_gen = compile_generator(
+            gen, "onnxruntime", "cpu", False, os.path.join(str(tmp_path), f"{scale}x.onnx")
+        )
+        assert onnx_gen is not gen
+        with torch.inference_mode():
+            for shape in [(1, 3, 32, 48), (2, 3, 40, 24)]:
+                x = torch.rand(shape)
+                assert torch.allclose(onnx_gen(x), gen(x), atol=1e-4)
+            patches = numpy.random.rand(3, 32, 32, 3)
+            assert torch.allclose(
+                PatchUpscalingStrategy().upscale_patches(patches, onnx_gen, export_config, scale),
+                PatchUpscalingStrategy().upscale_patches(patches, gen, export_config, scale),
+                atol=1e-4,
+            )
+
+
+def test_int8_quantization(tmp_path):
+    """
+    Test that the Generator quantized to INT8 with calibration textures read from a
+    folder upscales images close to the float32 Generator.
+    """
+    import cv2
+    from app_config.config import ExportConfig
+    from utils.export_utils import calibration_fingerprint, load_calibration_patches
+    from model.utils import quantize_model_for_inference
+
+    numpy.random.seed(0)
+    for i in range(4):
+        cv2.imwrite(
+            os.path.join(str(tmp_path), f"texture_{i}.png"),
+            numpy.random.randint(0, 256, (80, 96, 3), dtype=numpy.uint8),
+        )
+    ExportConfig.calibration_dir = str(tmp_path)
+    try:
+        calibration_patches = load_calibration_patches(patch_size=32)
+        # the cached INT8 Generator is recalibrated once the calibration textures change
+        fingerprint = calibration_fingerprint()
+        assert calibration_fingerprint() == fingerprint
+        cv2.imwrite(
+            os.path.join(str(tmp_path), "texture_4.png"),
+            numpy.random.randint(0, 256, (80, 96, 3), dtype=numpy.uint8),
+        )
+        assert calibration_fingerprint() != fingerprint
+        # only the textures read for calibration are hashed
+        fingerprint = calibration_fingerprint(max_images=4)
+        with open(os.path.join(str(tmp_path), "notes.txt"), "w") as f:
+            f.write("not a texture")
+        cv2.imwrite(
+            os.path.join(str(tmp_path), "texture_5.png"),
+            numpy.random.randint(0, 256, (80, 96, 3), dtype=numpy.uint8),
+        )
+        assert calibration_fingerprint(max_images=4) == fingerprint
+    finally:
+        ExportConfig.calibration_dir = ""
+    assert calibration_patches.shape == (4, 3, 32, 32)
+    assert calibration_patches.dtype == torch.float32
+
+    torch.manual_seed(0)
+    gen = Generator(num_in_ch=3, num_out_ch=3, scale=2, num_block=2).eval()
+    x = calibration_patches[:2]
+    with torch.no_grad():
+        reference = gen(x).clamp(0, 1)
+        quantized_gen = quantize_model_for_inference(gen, calibration_patches)
+        quantized = quantized_gen(x).clamp(0, 1)
+        # quantized generators upscale sizes other than the calibration size
+        assert quantized_gen(torch.rand(1, 3, 24, 40)).shape == (1, 3, 48, 80)
+    assert quantized.shape == reference.shape
+    mse = torch.mean((reference - quantized) ** 2).item()
+    assert 10 * numpy.log10(1 / mse) > 30
+
+
+def test_bf16_generator():
+    """
+    Test that the bfloat16 Generator takes and returns float32 tensors and upscales
+    split patches close to the float32 Generator.
+    """
+    from model.model import BF16Generator
+    from utils.patch_upscale_strategy import PatchUpscalingStrategy
+
+    torch.manual_seed(0)
+    gen = Generator(num_in_ch=3, num_out_ch=3, scale=2, num_block=2).eval()
+    patches = numpy.random.rand(3, 32, 32, 3).astype(numpy.float32)
+    with torch.inference_mode():
+        reference = PatchUpscalingStrategy().upscale_patches(
+            patches, gen, {"device": "cpu", "upscale_precision": "high"}, 2
+        )
+        bf16_gen = BF16Generator(copy.deepcopy(gen)).eval()
+        upscaled = PatchUpscalingStrategy().upscale_patches(
+            patches, bf16_gen, {"device": "cpu", "upscale_precision": "bf16"}, 2
+        )
+    assert next(bf16_gen.parameters()).dtype == torch.bfloat16
+    assert upscaled.dtype == torch.float32
+    assert upscaled.shape == reference.shape == (3, 3, 64, 64)
+    mse = torch.mean((reference.clamp(0, 1) - upscaled.clamp(0, 1)) ** 2).item()
+    assert 10 * numpy.log10(1 / mse) > 40
+
+
+def test_cpu_memory_budget_split(monkeypatch, generator):
+    """
+    Test that images upscaled on the cpu are split into patches that fit the memory
+    budget and that the patches are recombined into the full upscaled image.
+    """
+    from types import SimpleNamespace
+    from app_config.config import ConfigReference, ExportConfig
+    from utils.patch_upscale_strategy import PatchUpscalingStrategy
+
+    export_config = {"device": "cpu", "upscale_precision": "high"}
+    strategy = PatchUpscalingStrategy()
+    # the budget allows 64x64 upscaled pixels at float32
+    monkeypatch.setattr(
+        ExportConfig, "max_memory_gb", 64 * 64 * ConfigReference.ram_per_output_pixel["high"] / 1024**3
+    )
+    monkeypatch.setattr(ExportConfig, "tile_batch_size", "auto")
+    assert strategy.max_split_size(export_config) == 64 * 64
+    # lower precisions fit more pixels in the same budget
+    assert strategy.max_split_size({"device": "cpu", "upscale_precision": "bf16"}) > 64 * 64
+    # tile workers share the budget
+    monkeypatch.setattr(PatchUpscalingStrategy, "tile_workers", SimpleNamespace(no_workers=4))
+    assert strategy.max_split_size(export_config) == 32 * 32
+    patches = numpy.zeros((16, 8, 8, 3), dtype=numpy.float32)
+    assert strategy.handle_tile_batch_size(patches, 2, export_config) == 4 * (32 * 32 // (16 * 16))
+    monkeypatch.setattr(PatchUpscalingStrategy, "tile_workers", None)
+
+    img = SimpleNamespace(color_channels=numpy.random.rand(96, 80, 3).astype(numpy.float32))
+    patches, p_shape, pad_size, size = strategy.handle_image_split("color", 2, img, export_config)
+    assert len(patches) > 1
+    assert (patches.shape[1] * 2) ** 2 <= 64 * 64
+    assert strategy.handle_tile_batch_size(patches, 2, export_config) == 1
+
+    with torch.inference_mode():
+        upscaled = strategy.upscale(img, "color", generator, export_config, 2)
+    assert upscaled.shape == (192, 160, 3)
+
+
+def test_inference_forward():
+    """
+    Test that the inference-only forward pass (preallocated dense block features and
+    upsampling in bands) matches the regular forward pass, including for structured
+    pruned Generators, batches and heights that don't split evenly into bands.
+    """
+    from model.utils import prune_model_for_inference
+
+    torch.manual_seed(0)
+    for scale, shape, pruning_mode in [
+        (4, (1, 3, 37, 20), "none"),
+        (2, (2, 3, 90, 34), "none"),
+        (4, (2, 3, 41, 24), "structured"),
+    ]:
+        gen = Generator(num_in_ch=3, num_out_ch=3, scale=scale, num_block=2).eval()
+        gen = prune_model_for_inference(gen, pruning_amount=0.2, mode=pruning_mode)
+        x = torch.rand(shape)
+        with torch.no_grad():
+            expected = gen(x)
+        with torch.inference_mode():
+            output = gen(x)
+        assert output.shape == expected.shape == (shape[0], 3, shape[2] * scale, shape[3] * scale)
+        assert torch.allclose(output, expected, atol=1e-5)
+
+
+def test_tile_triage(monkeypatch, generator):
+    """
+    Test that tiles are routed by content: constant tiles are filled, low detail
+    tiles are Lanczos upscaled and only detailed tiles go through the generator.
+    """
+    from types import SimpleNamespace
+    from app_config.config import ConfigReference, ExportConfig
+    from utils.patch_upscale_strategy import PatchUpscalingStrategy
+
+    rng = numpy.random.default_rng(0)
+    image = numpy.full((64, 96, 3), 0.25, dtype=numpy.float32)  # constant third
+    image[:, 32:64] += numpy.linspace(0, 0.01, 32, dtype=numpy.float32)[None, :, None]  # low detail
+    image[:, 64:] = rng.random((64, 32, 3))  # detailed third
+    monkeypatch.setattr(ConfigReference, "triage_tile_size", 32)
+    monkeypatch.setattr(ConfigReference, "triage_pad_size", 4)
+    monkeypatch.setattr(ExportConfig, "tile_triage", True)
+    monkeypatch.setattr(ExportConfig, "triage_variance_threshold", 1e-4)
+    monkeypatch.setattr(ExportConfig, "tile_batch_size", "auto")
+    for route in PatchUpscalingStrategy.triage_counts:
+        monkeypatch.setitem(PatchUpscalingStrategy.triage_counts, route, 0)
+
+    strategy = PatchUpscalingStrategy()
+    export_config = {"device": "cpu", "upscale_precision": "high"}
+    calls = []
+    monkeypatch.setattr(strategy, "upscale_batch", lambda patches, *args: calls.append(len(patches)) or PatchUpscalingStrategy.upscale_batch(strategy, patches, *args))
+    with torch.inference_mode():
+        upscaled = strategy.upscale(SimpleNamespace(color_channels=image), "color", generator, export_config, 2)
+    assert upscaled.shape == (128, 192, 3)
+    # the image is reflect padded before it is split, adding a row and a column of tiles
+    counts = PatchUpscalingStrategy.triage_counts
+    assert counts["constant"] > 0 and counts["low detail"] > 0 and counts["generator"] > 0
+    assert sum(counts.values()) == 12 and sum(calls) == counts["generator"]
+    assert torch.allclose(upscaled[:, :40], torch.tensor(0.25))
+    # a threshold of 0 only skips constant tiles
+    routes = strategy.classify_patches(numpy.stack([image[:32, :32], image[:32, 32:64], image[:32, 64:]]), 0.0)
+    assert routes.tolist() == [0, 2, 2]
+
+
+def test_tile_cache(monkeypatch, generator):
+    """
+    Test that identical tiles (including their padding) are upscaled once and
+    reused, that the stitched image is identical to the uncached one and that
+    only cached tiles are upscaled in padded batches.
+    """
+    from types import SimpleNamespace
+    from app_config.config import ConfigReference, ExportConfig
+    from caches.tile_cache import tile_cache
+    from utils.patch_upscale_strategy import PatchUpscalingStrategy
+
+    rng = numpy.random.default_rng(0)
+    image = numpy.tile(rng.random((16, 16, 3)).astype(numpy.float32), (6, 6, 1))  # a repeated brick
+    monkeypatch.setattr(ConfigReference, "triage_tile_size", 16)
+    monkeypatch.setattr(ConfigReference, "triage_pad_size", 4)
+    monkeypatch.setattr(ExportConfig, "tile_triage", True)
+    monkeypatch.setattr(ExportConfig, "triage_variance_threshold", 0.0)
+    # the reflect padded image is split into 7 rows of 7 tiles, 7 generator batches
+    monkeypatch.setattr(ExportConfig, "tile_batch_size", "7")
+    for route in PatchUpscalingStrategy.triage_counts:
+        monkeypatch.setitem(PatchUpscalingStrategy.triage_counts, route, 0)
+
+    strategy = PatchUpscalingStrategy()
+    export_config = {"device": "cpu", "upscale_precision": "high"}
+    calls, generator_calls = [], []
+    monkeypatch.setattr(strategy, "upscale_batch", lambda patches, *args: calls.append(len(patches)) or PatchUpscalingStrategy.upscale_batch(strategy, patches, *args))
+    monkeypatch.setattr(strategy, "run_generator", lambda patches, *args: generator_calls.append(len(patches)) or PatchUpscalingStrategy.run_generator(strategy, patches, *args))
+    upscaled = {}
+    for memory_cap_gb in [0, 0.5]:
+        monkeypatch.setattr(ExportConfig, "tile_cache_memory_gb", memory_cap_gb)
+        tile_cache.clear()
+        calls.clear()
+        generator_calls.clear()
+        with torch.inference_mode():
+            upscaled[memory_cap_gb] = strategy.upscale(SimpleNamespace(color_channels=image), "color", generator, export_config, 2)
+        no_tiles = sum(PatchUpscalingStrategy.triage_counts.values()) // (2 if memory_cap_gb else 1)
+        if not memory_cap_gb:
+            # uncached batches aren't padded
+            assert sum(generator_calls) == no_tiles == 49
+    assert torch.equal(upscaled[0], upscaled[0.5])
+    # tiles away from the (reflect padded) border share their content and their padding
+    assert sum(calls) < no_tiles and tile_cache.hits == no_tiles - sum(calls)
+    assert tile_cache.misses == sum(calls) and 0 < tile_cache.hit_rate < 1
+    assert all(size == 7 for size in generator_calls)
+    # with a warm cache, every tile is reused and the image is unchanged
+    generator_calls.clear()
+    with torch.inference_mode():
+        warm = strategy.upscale(SimpleNamespace(color_channels=image), "color", generator, export_config, 2)
+    assert not generator_calls and torch.equal(warm, upscaled[0.5])
+
+    # the least recently used tiles are evicted once the cache exceeds its memory cap
+    tile_cache.put(("another tile",), torch.zeros(1), tile_cache.memory_used / 1024**3)
+    assert len(tile_cache._tiles) == tile_cache.misses
+    tile_cache.clear()
+    assert tile_cache.memory_used == 0 and tile_cache.hits == tile_cache.misses == 0
+
+
+def test_share_generator_weights(generator):
+    """
+    Test that sharing a Generator's weights keeps its output, places its weights
+    in one shared memory block per dtype that other processes map instead of
+    copying and that compiled Generators aren't shared.
+    """
+    import multiprocessing
+    from utils.export_utils import share_generator_weights
+
+    example = torch.rand(1, 3, 16, 16)
+    with torch.inference_mode():
+        expected = generator(example)
+    assert share_generator_weights(generator)
+    parameters = list(generator.parameters())
+    assert all(parameter.is_shared() for parameter in parameters)
+    assert len({parameter.untyped_storage().data_ptr() for parameter in parameters}) == 1
+    with torch.inference_mode():
+        assert torch.equal(generator(example), expected)
+    assert share_generator_weights(generator)  # already shared
+
+    def write_weight(weight):
+        with torch.no_grad():
+            weight.fill_(0.5)
+
+    process = multiprocessing.get_context("fork").Process(target=write_weight, args=(parameters[0],))
+    process.start()
+    process.join()
+    assert torch.all(parameters[0] == 0.5)
+
+    assert not share_generator_weights(torch.jit.trace(generator, example))
+    assert not share_generator_weights(None)
+
+
+def test_tile_workers(monkeypatch, generator):
+    """
+    Test that tile worker processes split the tiles of an image between them,
+    that the stitched image matches upscaling it in a single process and that the
+    tiles of a worker that dies or gets stuck are upscaled by the export thread.
+    """
+    from types import SimpleNamespace
+    from app_config.config import ConfigReference, ExportConfig
+    from utils.export_workers import TileWorkers
+    from utils.patch_upscale_strategy import PatchUpscalingStrategy
+
+    image = numpy.random.default_rng(0).random((160, 128, 3)).astype(numpy.float32)
+    monkeypatch.setattr(ExportConfig, "split_large_image", True)
+    monkeypatch.setattr(ExportConfig, "tile_triage", False)
+    monkeypatch.setattr(ExportConfig, "tile_batch_size", "2")
+    monkeypatch.setattr(ExportConfig, "tile_cache_memory_gb", 0)
+    monkeypatch.setattr(ConfigReference, "split_color", False)
+    monkeypatch.setattr(ConfigReference, "worker_start_method", "fork")
+    monkeypatch.setattr(ConfigReference, "max_worker_restarts", 1)
+    strategy = PatchUpscalingStrategy()
+    monkeypatch.setattr(strategy, "max_split_size", lambda export_config: 64 * 64)
+    export_config = {"device": "cpu", "upscale_precision": "high", "scale": "2x"}
+    with torch.inference_mode():
+        expected = strategy.upscale(SimpleNamespace(color_channels=image), "color", generator, export_config, 2)
+
+    parent = os.getpid()
+    run_local_generator = PatchUpscalingStrategy.run_local_generator
+    local_tiles = []
+    monkeypatch.setattr(ConfigReference, "tile_batch_timeout", 2.0)
+    for failure in ["crash", "hang"]:
+
+        def failing_generator(self, patches, *args):
+            # the worker handed the last, single tile of a batch dies or gets stuck
+            if os.getpid() != parent and len(patches) == 1:
+                if failure == "crash":
+                    os._exit(3)
+                time.sleep(60)
+            if os.getpid() == parent:
+                local_tiles.append(len(patches))
+            return run_local_generator(self, patches, *args)
+
+        monkeypatch.setattr(PatchUpscalingStrategy, "run_local_generator", failing_generator)
+        local_tiles.clear()
+        tile_workers = TileWorkers(2, 1, export_config, ([], []), generator)
+        monkeypatch.setattr(PatchUpscalingStrategy, "tile_workers", tile_workers)
+        start_time = time.monotonic()
+        try:
+            assert strategy.handle_tile_batch_size(numpy.zeros((9, 8, 8, 3)), 2, export_config) == 4
+            with torch.inference_mode():
+                upscaled = strategy.upscale(SimpleNamespace(color_channels=image), "color", generator, export_config, 2)
+        finally:
+            tile_workers.close()
+        assert time.monotonic() - start_time < 60
+        assert upscaled.shape == expected.shape
+        assert torch.allclose(upscaled, expected, atol=1e-5)
+        assert local_tiles and tile_workers.restarts == 1
+
+
+def test_out_of_core_upscale(tmp_path, monkeypatch, generator):
+    """
+    Test that out of core, images are split band by band into the same patches and
+    stitched into a memory-mapped image identical to the in-memory one.
+    """
+    from types import SimpleNamespace
+    from app_config.config import ConfigReference, ExportConfig
+    from model.utils import OverlappingPatchBands, pad_reflect, split_image_into_overlapping_patches
+    from utils.patch_upscale_strategy import PatchUpscalingStrategy
+
+    rng = numpy.random.default_rng(0)
+    for shape, patch_size, pad_size in [((37, 53, 3), 10, 2), ((30, 30, 1), 7, 3)]:
+        image = rng.random(shape).astype(numpy.float32)
+        patches, p_shape = split_image_into_overlapping_patches(pad_reflect(image, pad_size), patch_size, pad_size)
+        bands = OverlappingPatchBands(image, patch_size, pad_size, pad_size, 100)
+        assert len(bands) > 1 and bands.shape == patches.shape and bands.padded_shape == p_shape
+        assert numpy.array_equal(numpy.concatenate(list(bands)), patches)
+
+    image = rng.random((160, 128, 3)).astype(numpy.float32)
+    mask = numpy.zeros((160, 128, 1), dtype=bool)
+    mask[:, :48] = True
+    monkeypatch.setattr(ExportConfig, "split_large_image", True)
+    monkeypatch.setattr(ExportConfig, "tile_batch_size", "auto")
+    monkeypatch.setattr(ExportConfig, "tile_cache_memory_gb", 0)
+    monkeypatch.setattr(ExportConfig, "triage_variance_threshold", 1e-4)
+    monkeypatch.setattr(ConfigReference, "split_color", False)
+    monkeypatch.setattr(ConfigReference, "triage_tile_size", 32)
+    monkeypatch.setattr(ConfigReference, "out_of_core_band_pixels", 64 * 128)
+    strategy = PatchUpscalingStrategy()
+    monkeypatch.setattr(strategy, "max_split_size", lambda export_config: 64 * 64)
+    export_config = {"device": "cpu", "upscale_precision": "high"}
+    for triage, transparent_mask in [(False, None), (True, None), (True, mask)]:
+        monkeypatch.setattr(ExportConfig, "tile_triage", triage)
+        img = SimpleNamespace(color_channels=image, transparent_mask=transparent_mask, trg_path=str(tmp_path))
+        upscaled = {}
+        for out_of_core in [False, True]:
+            monkeypatch.setattr(ExportConfig, "out_of_core", out_of_core)
+            with torch.inference_mode():
+                upscaled[out_of_core] = strategy.upscale(img, "color", generator, export_config, 2)
+        assert upscaled[True].shape == (320, 256, 3)
+        assert torch.allclose(upscaled[True], upscaled[False], atol=1e-6)
+    patches = strategy.handle_image_split("color", 2, img, export_config)[0]
+    assert isinstance(patches, OverlappingPatchBands) and len(patches) > 1
+    # the temporary file of the memory-mapped image is removed
+    assert not os.listdir(tmp_path)
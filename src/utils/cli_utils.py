@@ -138,12 +138,18 @@ parser.add_argument(
 parser.add_argument(
     "--upscale_precision",
     type=str,
-    choices=list(confref.upscale_precision_levels["cuda"].keys()),
+    choices=list(
+        dict.fromkeys(
+            list(confref.upscale_precision_levels["cuda"].keys())
+            + list(confref.upscale_precision_levels["cpu"].keys())
+        )
+    ),
     default="normal",
     help=""" 
         The quality of detail in the upscale. Normal is good for most usecases since most image formats 
         support an 8 or 16 bit depth (bpc). High upscale precision should be used for images exported 
-        in exr format. 
+        in exr format. bf16 upscales faster on cpus that support bfloat16 (falling back to high precision
+        otherwise) and int8 quantizes the model for faster cpu upscaling at a slightly lower quality.
         """,
 )
 
@@ -181,6 +187,157 @@ parser.add_argument(
     help=" If split_image_if_too_large is used, specify the split size of the image. If the chosen size is too large for your video memory capacity, try a smaller split size. i.e. --image_split_size large ",
 )
 
+parser.add_argument(
+    "--tile_batch_size",
+    type=str,
+    choices=confref.tile_batch_sizes,
+    default=confref.tile_batch_sizes[0],
+    help=" If split_image_if_too_large is used, the number of split patches to upscale at once. 'auto' fits as many patches as the available video memory allows. i.e. --tile_batch_size 4 ",
+)
+
+parser.add_argument(
+    "--blend_split_overlap",
+    action="store_true",
+    help="If split_image_if_too_large is used, blend the overlapping margins of neighbouring patches instead of cutting them off. i.e. --blend_split_overlap",
+)
+
+parser.add_argument(
+    "--pack_single_channels",
+    action="store_true",
+    help="Upscale greyscale and alpha channels three at a time by packing them into the red, green and blue channels of a single upscale, instead of upscaling each as a full RGB image. i.e. --pack_single_channels",
+)
+
+parser.add_argument(
+    "--tile_triage",
+    action="store_true",
+    help="Split images into tiles and only upscale tiles with detail with the model: constant tiles are filled and tiles whose variance is below --triage_threshold are upscaled with Lanczos. i.e. --tile_triage",
+)
+
+parser.add_argument(
+    "--triage_threshold",
+    type=float,
+    default=expconf.triage_variance_threshold,
+    help="If tile_triage is used, the variance (of channel values between 0 and 1) below which a tile is upscaled with Lanczos instead of the model, 0 only skips constant tiles. i.e. --triage_threshold 0.0001",
+)
+
+parser.add_argument(
+    "--skip_transparent",
+    action="store_true",
+    help="Upscale the color of tiles whose alpha is fully transparent with bilinear scaling instead of the model, since it is invisible. Only applies when the image is exported with an alpha channel. i.e. --skip_transparent",
+)
+
+parser.add_argument(
+    "--binary_alpha",
+    action="store_true",
+    help="Upscale alpha channels that only hold two levels (i.e. cutouts) with an edge-aware threshold instead of the model. i.e. --binary_alpha",
+)
+
+parser.add_argument(
+    "--normal_maps",
+    type=str,
+    choices=confref.normal_map_modes,
+    default=expconf.normal_map_mode,
+    help="Upscale only the X and Y channels of tangent-space normal maps and rebuild Z from them. 'auto' detects normal maps by their name (i.e. brick_nrm.png) or their pixels, 'all' treats every RGB(A) image as a normal map. i.e. --normal_maps auto",
+)
+
+parser.add_argument(
+    "--renormalize_normals",
+    action="store_true",
+    help="If normal_maps is used, scale upscaled X and Y channels that overshoot the unit circle back onto it before Z is rebuilt. i.e. --renormalize_normals",
+)
+
+parser.add_argument(
+    "--tile_cache_size",
+    type=float,
+    default=expconf.tile_cache_memory_gb,
+    help="The memory (GiB) used to keep upscaled tiles so that identical tiles (within an image or across images) are upscaled once, 0 disables the tile cache. Only applies to images that are split into tiles. i.e. --tile_cache_size 1",
+)
+
+parser.add_argument(
+    "--pipeline_depth",
+    type=int,
+    default=expconf.pipeline_depth,
+    help="The number of images read ahead of the images being upscaled and queued to be written while the next images are upscaled, 0 processes one image at a time. Larger depths keep the device busy but hold more images in memory. i.e. --pipeline_depth 4",
+)
+
+parser.add_argument(
+    "--workers",
+    type=int,
+    default=expconf.workers,
+    help="If the device is cpu, the number of worker processes that upscale images in parallel, each with its own threads. i.e. --workers 4",
+)
+
+parser.add_argument(
+    "--threads_per_worker",
+    type=int,
+    default=expconf.threads_per_worker,
+    help="If --workers or --tile_workers is greater than 1, the number of threads each worker process upscales with, 0 splits the CPU cores between the workers. i.e. --threads_per_worker 16",
+)
+
+parser.add_argument(
+    "--tile_workers",
+    type=int,
+    default=expconf.tile_workers,
+    help="If the device is cpu and --workers is 1, the number of worker processes that split the tiles of each image between them, each with its own threads. Speeds up exports of a few very large images. i.e. --tile_workers 4",
+)
+
+parser.add_argument(
+    "--out_of_core",
+    action="store_true",
+    help="If split_image_if_too_large, tile_triage or skip_transparent is used, split images into patches one band of rows at a time and stitch the upscaled patches into a memory-mapped file in the export directory, so that huge textures don't have to fit in memory. i.e. --out_of_core",
+)
+
+parser.add_argument(
+    "--max_memory_gb",
+    type=float,
+    default=expconf.max_memory_gb,
+    help="If the device is cpu and split_image_if_too_large is used, the memory (GiB) upscaling may use. Images are split into patches that fit it instead of using the image split size. i.e. --max_memory_gb 8",
+)
+
+parser.add_argument(
+    "--model_cache_size",
+    type=float,
+    default=expconf.model_cache_memory_gb,
+    help="The memory (GiB) used to keep loaded models for reuse, 0 disables keeping models loaded. i.e. --model_cache_size 2",
+)
+
+parser.add_argument(
+    "--pruning",
+    type=str,
+    choices=confref.pruning_modes,
+    default=confref.pruning_modes[0],
+    help="How the model is pruned: 'bake' prunes individual weights (same quality as before), 'structured' removes whole channels for faster but lower quality upscaling, 'none' doesn't prune the model. i.e. --pruning structured",
+)
+
+parser.add_argument(
+    "--backend",
+    type=str,
+    choices=confref.inference_backends,
+    default=confref.inference_backends[0],
+    help="The backend used to run the model: 'torchscript', 'compile' and 'onnxruntime' compile the model once (and cache it on disk) for faster upscaling, falling back to 'eager' if compiling fails. i.e. --backend onnxruntime",
+)
+
+parser.add_argument(
+    "--intra_op_threads",
+    type=int,
+    default=expconf.intra_op_threads,
+    help="If the onnxruntime backend is used, the number of threads used to run each operation of the model, 0 lets onnxruntime decide. i.e. --intra_op_threads 8",
+)
+
+parser.add_argument(
+    "--inter_op_threads",
+    type=int,
+    default=expconf.inter_op_threads,
+    help="If the onnxruntime backend is used, the number of threads used to run independent operations of the model in parallel, 0 lets onnxruntime decide. i.e. --inter_op_threads 1",
+)
+
+parser.add_argument(
+    "--calibration_dir",
+    type=str,
+    default=expconf.calibration_dir,
+    help="If the int8 upscale precision is used, a folder of textures used to calibrate the quantized model, the exported textures are used if not set. i.e. --calibration_dir 'C:/textures/calibration'",
+)
+
 parser.add_argument(
     "--unique_id",
     "-id",
@@ -291,7 +448,19 @@ def parse_args(args: argparse.ArgumentParser):
             sys.exit(1)
     # device
     if args.device == "cpu":
-        args.upscale_precision = "high"
+        # float16 upscaling isn't supported on cpu
+        if args.upscale_precision == "normal":
+            args.upscale_precision = "high"
+    elif args.upscale_precision not in confref.upscale_precision_levels["cuda"]:
+        write_log_to_file(
+            "WARNING",
+            f"{args.upscale_precision} upscale precision is only supported on cpu, using normal precision.",
+        )
+        if args.verbose:
+            print(
+                f"[WARNING] {args.upscale_precision} upscale precision is only supported on cpu, using normal precision."
+            )
+        args.upscale_precision = "normal"
 
     # color depth
     if not args.export_color_depth in [8, 16, 32]:
@@ -400,10 +569,68 @@ def parse_args(args: argparse.ArgumentParser):
         sys.exit(1)
 
     # upscale_precision
-    if args.upscale_precision == "high":
+    if args.upscale_precision == "high" and args.device == "cuda":
         args.image_split_size = "small"
         args.split_image_if_too_large = False
 
+    # memory budget
+    if not args.max_memory_gb > 0:
+        if args.verbose:
+            print("[ERROR] max_memory_gb must be greater than 0.")
+        write_log_to_file(
+            "ERROR",
+            "max_memory_gb must be greater than 0. ",
+        )
+        sys.exit(1)
+
+    # tile triage
+    if args.triage_threshold < 0:
+        if args.verbose:
+            print("[ERROR] triage_threshold must be 0 or greater.")
+        write_log_to_file(
+            "ERROR",
+            "triage_threshold must be 0 or greater. ",
+        )
+        sys.exit(1)
+
+    # tile cache
+    if args.tile_cache_size < 0:
+        if args.verbose:
+            print("[ERROR] tile_cache_size must be 0 or greater.")
+        write_log_to_file(
+            "ERROR",
+            "tile_cache_size must be 0 or greater. ",
+        )
+        sys.exit(1)
+
+    # export pipeline
+    if args.pipeline_depth < 0:
+        if args.verbose:
+            print("[ERROR] pipeline_depth must be 0 or greater.")
+        write_log_to_file(
+            "ERROR",
+            "pipeline_depth must be 0 or greater. ",
+        )
+        sys.exit(1)
+
+    # export worker processes
+    if args.workers < 1 or args.threads_per_worker < 0:
+        if args.verbose:
+            print("[ERROR] workers must be 1 or greater and threads_per_worker 0 or greater.")
+        write_log_to_file(
+            "ERROR",
+            "workers must be 1 or greater and threads_per_worker 0 or greater. ",
+        )
+        sys.exit(1)
+    if args.tile_workers < 1:
+        if args.verbose:
+            print("[ERROR] tile_workers must be 1 or greater.")
+        write_log_to_file(
+            "ERROR",
+            "tile_workers must be 1 or greater. ",
+        )
+        sys.exit(1)
+
     # split large image
     if args.split_image_if_too_large:
         args.image_split_size = {
@@ -476,6 +703,28 @@ def parse_args(args: argparse.ArgumentParser):
         "gamma_adjustment": args.gamma_correction,
         "split_large_image": args.split_image_if_too_large,
         "image_split_size": args.image_split_size,
+        "tile_batch_size": args.tile_batch_size,
+        "blend_split_overlap": args.blend_split_overlap,
+        "pack_single_channels": args.pack_single_channels,
+        "tile_triage": args.tile_triage,
+        "triage_variance_threshold": args.triage_threshold,
+        "skip_transparent_tiles": args.skip_transparent,
+        "binary_alpha_upscale": args.binary_alpha,
+        "normal_map_mode": args.normal_maps,
+        "renormalize_normals": args.renormalize_normals,
+        "max_memory_gb": args.max_memory_gb,
+        "model_cache_memory_gb": args.model_cache_size,
+        "tile_cache_memory_gb": args.tile_cache_size,
+        "pipeline_depth": args.pipeline_depth,
+        "workers": args.workers,
+        "threads_per_worker": args.threads_per_worker,
+        "tile_workers": args.tile_workers,
+        "out_of_core": args.out_of_core,
+        "pruning_mode": args.pruning,
+        "backend": args.backend,
+        "intra_op_threads": args.intra_op_threads,
+        "inter_op_threads": args.inter_op_threads,
+        "calibration_dir": args.calibration_dir,
     }
 
     # update ExportConfig data class
@@ -496,6 +745,28 @@ def parse_args(args: argparse.ArgumentParser):
     expconf.gamma_adjustment = export_config["gamma_adjustment"]
     expconf.split_large_image = export_config["split_large_image"]
     expconf.patch_size = export_config["image_split_size"]
+    expconf.tile_batch_size = export_config["tile_batch_size"]
+    expconf.blend_patch_overlap = export_config["blend_split_overlap"]
+    expconf.pack_single_channels = export_config["pack_single_channels"]
+    expconf.tile_triage = export_config["tile_triage"]
+    expconf.triage_variance_threshold = export_config["triage_variance_threshold"]
+    expconf.skip_transparent_tiles = export_config["skip_transparent_tiles"]
+    expconf.binary_alpha_upscale = export_config["binary_alpha_upscale"]
+    expconf.normal_map_mode = export_config["normal_map_mode"]
+    expconf.renormalize_normals = export_config["renormalize_normals"]
+    expconf.max_memory_gb = export_config["max_memory_gb"]
+    expconf.model_cache_memory_gb = export_config["model_cache_memory_gb"]
+    expconf.tile_cache_memory_gb = export_config["tile_cache_memory_gb"]
+    expconf.pipeline_depth = export_config["pipeline_depth"]
+    expconf.workers = export_config["workers"]
+    expconf.threads_per_worker = export_config["threads_per_worker"]
+    expconf.tile_workers = export_config["tile_workers"]
+    expconf.out_of_core = export_config["out_of_core"]
+    expconf.pruning_mode = export_config["pruning_mode"]
+    expconf.backend = export_config["backend"]
+    expconf.intra_op_threads = export_config["intra_op_threads"]
+    expconf.inter_op_threads = export_config["inter_op_threads"]
+    expconf.calibration_dir = export_config["calibration_dir"]
 
     pprint.pprint(export_config)
     return export_config
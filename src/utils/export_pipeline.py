@@ -0,0 +1,135 @@
+import contextlib
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Deque, Dict, Iterator, List, Tuple
+
+from app_config.config import ConfigReference as confref
+from utils.logger import write_log_to_file
+
+
+class ExportPipeline:
+    """
+    Bounded read / infer / write pipeline for the export loop.
+
+    A read pool decodes and preprocesses the images of the next batches while the
+    export thread runs the generator on the current batch, and a write pool
+    postprocesses, encodes and saves upscaled images behind it. The pipeline depth
+    caps the images read ahead of the current batch and the images waiting to be
+    written, which bounds the memory held by images in flight. A depth of 0 reads
+    one batch at a time and waits for each image to be written.
+    """
+
+    def __init__(
+        self,
+        read: Callable[[int], Any],
+        write: Callable[[Any], Any],
+        depth: int,
+    ):
+        self.read = read
+        self.write = write
+        self.depth = max(0, int(depth))
+        self.read_pool = ThreadPoolExecutor(
+            max_workers=confref.pipeline_read_workers, thread_name_prefix="export-read"
+        )
+        self.write_pool = ThreadPoolExecutor(
+            max_workers=confref.pipeline_write_workers, thread_name_prefix="export-write"
+        )
+        self.reads: Deque[Future] = deque()
+        self.writes: Deque[Tuple[Any, Future]] = deque()
+        # seconds each stage spent working and the export thread spent waiting on a stage
+        self.busy: Dict[str, float] = {"read": 0.0, "infer": 0.0, "write": 0.0}
+        self.stalls: Dict[str, float] = {"read": 0.0, "write": 0.0}
+        self._lock = threading.Lock()
+        self.start_time = time.perf_counter()
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Adds the time spent in the block to the busy time of a stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.busy[name] += time.perf_counter() - start
+
+    def run_stage(self, name: str, function: Callable, *args) -> Any:
+        with self.stage(name):
+            return function(*args)
+
+    def read_batches(self, batches: List[List[int]]) -> Iterator[List[Future]]:
+        """
+        Yields the read futures of each batch once they are done (they raise the
+        exception the read ran into, if any), reading up to depth images of the
+        following batches ahead.
+        """
+        queue = [i for batch in batches for i in batch]
+        submitted, batch_end = 0, 0
+        for batch in batches:
+            batch_end += len(batch)
+            while submitted < min(len(queue), batch_end + self.depth):
+                self.reads.append(
+                    self.read_pool.submit(self.run_stage, "read", self.read, queue[submitted])
+                )
+                submitted += 1
+            futures = [self.reads.popleft() for _ in batch]
+            start = time.perf_counter()
+            wait(futures)
+            self.stalls["read"] += time.perf_counter() - start
+            yield futures
+
+    def submit_write(self, item: Any) -> List[Tuple[Any, Future]]:
+        """
+        Queues an item to be written and returns the items (and their futures) whose
+        writes finished. Waits for the oldest writes while more than depth items
+        are queued.
+        """
+        self.writes.append(
+            (item, self.write_pool.submit(self.run_stage, "write", self.write, item))
+        )
+        finished = []
+        while self.writes and (len(self.writes) > self.depth or self.writes[0][1].done()):
+            start = time.perf_counter()
+            wait([self.writes[0][1]])
+            self.stalls["write"] += time.perf_counter() - start
+            finished.append(self.writes.popleft())
+        return finished
+
+    def cancel(self) -> None:
+        """Cancels the reads that haven't started, i.e. once the export is stopped."""
+        while self.reads:
+            self.reads.popleft().cancel()
+
+    def close(self) -> List[Tuple[Any, Future]]:
+        """
+        Waits for the queued writes, shuts the pools down, logs the utilisation of
+        each stage and returns the items (and their futures) that were still queued.
+        """
+        self.cancel()
+        finished = []
+        while self.writes:
+            item, future = self.writes.popleft()
+            wait([future])
+            finished.append((item, future))
+        self.read_pool.shutdown(wait=True)
+        self.write_pool.shutdown(wait=True)
+        self.log_utilisation()
+        return finished
+
+    def log_utilisation(self) -> None:
+        elapsed = max(time.perf_counter() - self.start_time, 1e-9)
+        utilisation = {
+            "read": self.busy["read"] / (elapsed * confref.pipeline_read_workers),
+            "infer": self.busy["infer"] / elapsed,
+            "write": self.busy["write"] / (elapsed * confref.pipeline_write_workers),
+        }
+        write_log_to_file(
+            "INFO",
+            f"Export pipeline (depth {self.depth}) over {round(elapsed, 2)} seconds: "
+            f"read {round(utilisation['read'] * 100, 1)}% ({confref.pipeline_read_workers} workers), "
+            f"inference {round(utilisation['infer'] * 100, 1)}%, "
+            f"write {round(utilisation['write'] * 100, 1)}% ({confref.pipeline_write_workers} workers). "
+            f"Inference waited {round(self.stalls['read'], 2)} seconds for reads and "
+            f"{round(self.stalls['write'], 2)} seconds for writes.",
+        )
@@ -1,13 +1,30 @@
 from __future__ import annotations
 from typing import TYPE_CHECKING
+import contextlib
 import gc
+import hashlib
+import inspect
 import math
+from concurrent.futures import Future
+from types import SimpleNamespace
 from PIL import ImageFile
+from PIL import Image as PILImage
 from wand.image import Image
 from utils.patch_upscale_strategy import *
 from utils import *
 from utils.logger import write_log_to_file
 from utils.image_container import ImageContainer
+from utils.export_pipeline import ExportPipeline
+from utils.export_workers import ExportWorkers, TileWorkers
+from caches.model_registry import model_registry
+from caches.tile_cache import tile_cache
+
+try:
+    import safetensors
+
+    safetensors_available = True
+except ImportError:
+    safetensors_available = False
 
 from model.utils import *
 
@@ -26,22 +43,314 @@ def get_cuda_device_memory(device: int):
     return round(torch.cuda.get_device_properties(device).total_memory / 1024**3, 2)
 
 
-def load_model(device, scale, load: bool = True):
+def find_weight_file(scale, half: bool = False) -> Tuple[str, bool]:
     """
-    Loads the Generator model architecture and respective inference weights.
+    Finds the weight file to load for the given scale. Converted .safetensors weights
+    are preferred over .pth weights and, when upscaling in half precision, weights
+    pre-converted to float16 are preferred over float32 weights.
+    Returns the path of the weight file and whether it holds float16 weights.
+    """
+    candidates = [(f"{scale}x.safetensors", False), (f"{scale}x.pth", False)]
+    if half:
+        candidates = [
+            (f"{scale}x_fp16.safetensors", True),
+            (f"{scale}x_fp16.pth", True),
+        ] + candidates
+    for file_name, fp16 in candidates:
+        if file_name.endswith(".safetensors") and not safetensors_available:
+            continue
+        weight_file = os.path.join(ExportConfig.weight_file, file_name)
+        if os.path.exists(weight_file):
+            return weight_file, fp16
+    return os.path.join(ExportConfig.weight_file, f"{scale}x.pth"), False
+
+
+def warm_up_generator(generator: Generator, device: str, half: bool) -> None:
+    """
+    Runs a small input through a compiled generator so that compiling and optimizing
+    its graph happens before the first image is upscaled.
+    """
+    example = torch.rand(
+        1, 3, 64, 64, device=device, dtype=torch.float16 if half else torch.float32
+    )
+    with torch.no_grad():
+        for _ in range(2):  # TorchScript optimizes the graph on its second run
+            generator(example)
+
+
+def compile_generator(
+    generator: Generator, backend: str, device: str, half: bool, compiled_file: str
+) -> Generator:
+    """
+    Compiles the generator with the chosen inference backend:
+        - torchscript: traces the generator and saves it to compiled_file,
+        - onnxruntime: exports the generator to ONNX (with a dynamic batch size,
+          height and width) at compiled_file and runs it with ONNX Runtime,
+        - compile: compiles the generator with torch.compile, which caches the compiled
+          kernels on disk,
+        - eager: leaves the generator as it is.
+    Falls back to the eager generator if compiling fails.
+    """
+    from model import RESRGAN_ONNX
+
+    if backend == "eager":
+        return generator
+    start_time = time.time()
+    example = torch.rand(
+        1, 3, 64, 64, device=device, dtype=torch.float16 if half else torch.float32
+    )
+    try:
+        if backend == "torchscript":
+            with torch.no_grad():
+                compiled = torch.jit.trace(generator.eval(), example)
+            os.makedirs(os.path.dirname(compiled_file), exist_ok=True)
+            torch.jit.save(compiled, compiled_file)
+        elif backend == "onnxruntime":
+            os.makedirs(os.path.dirname(compiled_file), exist_ok=True)
+            dynamic_axes = {0: "batch", 2: "height", 3: "width"}
+            # the dynamo exporter (the default in newer torch versions) ignores dynamic_axes
+            export_kwargs = (
+                {"dynamo": False}
+                if "dynamo" in inspect.signature(torch.onnx.export).parameters
+                else {}
+            )
+            torch.onnx.export(
+                generator.eval(),
+                example,
+                compiled_file,
+                input_names=["input"],
+                output_names=["output"],
+                dynamic_axes={"input": dynamic_axes, "output": dynamic_axes},
+                opset_version=17,
+                **export_kwargs,
+            )
+            model = RESRGAN_ONNX(
+                device=device,
+                intra_op_threads=ExportConfig.intra_op_threads,
+                inter_op_threads=ExportConfig.inter_op_threads,
+            )
+            model.load_weights(compiled_file)
+            compiled = model.gen
+        else:
+            os.environ.setdefault(
+                "TORCHINDUCTOR_CACHE_DIR", os.path.dirname(os.path.abspath(compiled_file))
+            )
+            compiled = torch.compile(generator, dynamic=True)
+        # torch.compile only compiles on the first run, so compile errors surface here
+        warm_up_generator(compiled, device, half)
+    except Exception as e:
+        write_log_to_file(
+            "ERROR",
+            f"Failed to compile the Generator with the {backend} backend, falling back to eager: \n\t{e}\n",
+        )
+        return generator
+    write_log_to_file(
+        "INFO",
+        f"Compiled the Generator with the {backend} backend in {round(time.time()-start_time, 2)} seconds.",
+    )
+    return compiled
+
+
+def calibration_image_paths(max_images: int = 16) -> List[str]:
     """
-    from model import RESRGAN
-    # from model import RESRGAN_TS
+    Paths of the textures used to calibrate INT8 quantization: the first max_images
+    readable textures in ExportConfig.calibration_dir or, if it isn't set, in the
+    loaded textures.
+    """
+    if ExportConfig.calibration_dir:
+        image_paths = [
+            os.path.join(ExportConfig.calibration_dir, file_name)
+            for file_name in sorted(os.listdir(ExportConfig.calibration_dir))
+        ]
+    else:
+        image_paths = sorted(os.path.join(path, name) for name, path in zip(*im_cache))
+    return [
+        image_path
+        for image_path in image_paths
+        if image_path[-3:].lower() in confref.read_lib_map
+    ][:max_images]
 
 
-    model = RESRGAN(device=device, scale=scale)
-    # model = RESRGAN_TS(device=device)
+def calibration_fingerprint(max_images: int = 16) -> str:
+    """
+    Hash of the paths, sizes and modification times of the calibration textures that
+    names the cached INT8 Generator, so that it is calibrated again once the
+    calibration textures change.
+    """
+    digest = hashlib.blake2b(digest_size=8)
+    for image_path in calibration_image_paths(max_images):
+        try:
+            stat = os.stat(image_path)
+        except OSError:
+            continue
+        digest.update(f"{image_path}|{stat.st_size}|{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
 
-    if load:
-        model.load_weights(os.path.join(ExportConfig.weight_file, f"{scale}x.pth"))
-        # model.load_weights(os.path.join(ExportConfig.weight_file, f"x{scale}_ts.pt"))
 
-    return model.gen
+def load_calibration_patches(patch_size: int = 64, max_images: int = 16) -> torch.Tensor:
+    """
+    Reads the centre patch of each texture used to calibrate INT8 quantization (see
+    calibration_image_paths). Returns the patches as a tensor of shape
+    (n, 3, patch_size, patch_size).
+    """
+    patches = []
+    for image_path in calibration_image_paths(max_images):
+        image_format = image_path[-3:].lower()
+        try:
+            if confref.read_lib_map[image_format] == "opencv":
+                image = cv2.imread(image_path, cv2.IMREAD_UNCHANGED)
+                if image.ndim == 3:
+                    image[..., :3] = image[..., 2::-1]  # BGR to RGB
+            else:
+                image = np.array(PILImage.open(image_path))
+        except Exception:
+            continue
+        if image is None or min(image.shape[:2]) < patch_size:
+            continue
+        if image.ndim == 2:
+            image = np.stack([image] * 3, axis=-1)
+        top = (image.shape[0] - patch_size) // 2
+        left = (image.shape[1] - patch_size) // 2
+        patch = image[top : top + patch_size, left : left + patch_size, :3]
+        if patch.dtype in [np.uint8, np.uint16]:
+            patch = patch / (255 if patch.dtype == np.uint8 else 65535)
+        patches.append(np.clip(patch, 0, 1).astype(np.float32))
+    if not patches:
+        raise ValueError(
+            f"No textures of at least {patch_size}x{patch_size} were found to calibrate INT8 quantization."
+        )
+    return torch.from_numpy(np.stack(patches)).permute(0, 3, 1, 2).contiguous()
+
+
+def quantize_generator(model) -> None:
+    """
+    Quantizes the Generator of a RESRGAN to INT8 and reports the speed up and the
+    PSNR of the quantized Generator against the float32 Generator.
+    """
+    calibration_patches = load_calibration_patches()
+    test_patches = calibration_patches[:4]
+    with torch.no_grad():
+        start_time = time.time()
+        reference = model.gen(test_patches).clamp(0, 1)
+        fp32_time = time.time() - start_time
+        model.quantize_weights(calibration_patches)
+        model.gen(test_patches[:1])  # the first run prepares the quantized kernels
+        start_time = time.time()
+        quantized = model.gen(test_patches).clamp(0, 1)
+        int8_time = time.time() - start_time
+    mse = torch.mean((reference - quantized) ** 2).item()
+    psnr = 10 * math.log10(1 / mse) if mse else math.inf
+    write_log_to_file(
+        "INFO" if psnr >= 30 else "WARNING",
+        f"Quantized the Generator to INT8 using {len(calibration_patches)} calibration textures: "
+        f"{round(fp32_time / int8_time, 2)}x faster than float32 with a PSNR of "
+        f"{round(psnr, 2)} dB against float32."
+        + ("" if psnr >= 30 else " Use high precision if the upscaled textures lose detail."),
+    )
+
+
+def load_model(
+    device,
+    scale,
+    load: bool = True,
+    half: bool = False,
+    pruning_mode: str = "bake",
+    backend: str = "eager",
+    quantize: bool = False,
+    bf16: bool = False,
+):
+    """
+    Loads the Generator model architecture and respective inference weights.
+    Generators compiled with the torchscript and onnxruntime backends are cached on
+    disk per scale, precision, pruning mode and device and reused until the weight
+    file changes. INT8 (quantized) Generators are cached like torchscript Generators,
+    per set of calibration textures.
+    """
+    from model import RESRGAN, RESRGAN_TS, RESRGAN_ONNX
+
+    if quantize:
+        if backend != "torchscript":
+            write_log_to_file(
+                "WARNING",
+                f"INT8 Generators are run with the torchscript backend, not the {backend} backend.",
+            )
+        backend = "torchscript"
+    if bf16 and backend == "onnxruntime":
+        write_log_to_file(
+            "WARNING",
+            "ONNX Runtime doesn't run bfloat16 Generators on the CPU, using the eager backend.",
+        )
+        backend = "eager"
+    weight_file, fp16 = find_weight_file(scale, half)
+    precision = (
+        f"int8_{calibration_fingerprint()}" if quantize else "bf16" if bf16 else "fp16" if half else "fp32"
+    )
+    compiled_file = os.path.join(
+        ExportConfig.weight_file,
+        "compiled",
+        f"{scale}x_{precision}_{pruning_mode}_{device}"
+        + (".onnx" if backend == "onnxruntime" else ".pt"),
+    )
+    if (
+        load
+        and backend in ["torchscript", "onnxruntime"]
+        and os.path.exists(compiled_file)
+        and os.path.getmtime(compiled_file) >= os.path.getmtime(weight_file)
+    ):
+        try:
+            model = (
+                RESRGAN_TS(device=device)
+                if backend == "torchscript"
+                else RESRGAN_ONNX(
+                    device=device,
+                    intra_op_threads=ExportConfig.intra_op_threads,
+                    inter_op_threads=ExportConfig.inter_op_threads,
+                )
+            )
+            model.load_weights(compiled_file)
+            warm_up_generator(model.gen, device, half)
+            write_log_to_file("INFO", f"Loaded compiled Generator {compiled_file}.")
+            return model.gen
+        except Exception as e:
+            write_log_to_file(
+                "ERROR",
+                f"Failed to load compiled Generator {compiled_file}, compiling it again: \n\t{e}\n",
+            )
+
+    # float16 weights are loaded straight into a half precision Generator
+    model = RESRGAN(device=device, scale=scale, half=fp16, pruning_mode=pruning_mode)
+
+    if not load:
+        return model.gen
+    write_log_to_file("INFO", f"Loading weights from {weight_file}.")
+    model.load_weights(weight_file)
+    if quantize:
+        try:
+            quantize_generator(model)
+        except Exception as e:
+            write_log_to_file(
+                "ERROR",
+                f"Failed to quantize the Generator to INT8, falling back to float32: \n\t{e}\n",
+            )
+            return model.gen
+    if bf16:
+        model.cast_to_bfloat16()
+    generator = model.gen.half() if half else model.gen
+    generator = compile_generator(generator, backend, device, half, compiled_file)
+    if quantize and os.path.exists(compiled_file):
+        # drop the INT8 Generators calibrated on earlier calibration textures
+        compiled_dir = os.path.dirname(compiled_file)
+        for file_name in os.listdir(compiled_dir):
+            if (
+                file_name.startswith(f"{scale}x_int8_")
+                and file_name.endswith(f"_{pruning_mode}_{device}.pt")
+                and file_name != os.path.basename(compiled_file)
+            ):
+                try:
+                    os.remove(os.path.join(compiled_dir, file_name))
+                except OSError:
+                    pass
+    return generator
 
 
 def process_export_location(
@@ -246,6 +555,42 @@ def handle_channel_order(
     return img
 
 
+def share_generator_weights(generator: Union[Generator, None]) -> bool:
+    """
+    Moves the weights and buffers of an eager Generator into one shared memory
+    block per dtype, leaving its parameters as views into the blocks. Export worker
+    processes that receive the Generator map the same physical copy instead of
+    loading their own, through a single file descriptor per block rather than one
+    per tensor. Compiled Generators can't be handed to other processes.
+    """
+    if (
+        not isinstance(generator, torch.nn.Module)
+        or isinstance(generator, torch.jit.ScriptModule)
+        or hasattr(generator, "_orig_mod")  # torch.compile
+    ):
+        return False
+    tensors = list(generator.parameters()) + list(generator.buffers())
+    if all(tensor.is_shared() for tensor in tensors):
+        return True
+    if any(tensor.device.type != "cpu" for tensor in tensors):
+        return False
+    for dtype in {tensor.dtype for tensor in tensors}:
+        group = [tensor for tensor in tensors if tensor.dtype == dtype]
+        block = torch.empty(sum(tensor.numel() for tensor in group), dtype=dtype)
+        block.share_memory_()
+        offset = 0
+        for tensor in group:
+            view = block[offset : offset + tensor.numel()].view_as(tensor)
+            view.copy_(tensor.data)
+            tensor.data = view
+            offset += tensor.numel()
+    write_log_to_file(
+        "INFO",
+        f"Shared the Generator weights ({round(model_registry.model_size(generator)/1024**2, 1)} MiB) with the export workers.",
+    )
+    return True
+
+
 def setup_generator(
     export_config: Union[Dict[str, Union[str, int, bool]], None], generator: Generator
 ):
@@ -253,13 +598,56 @@ def setup_generator(
     if scale != 1:
         if scale != 0.5:
             try:
-                if generator == None:
-                    generator = load_model(device=export_config["device"], scale=scale)
-
-                if (
+                half = (
                     export_config["upscale_precision"] != "high"
                     and export_config["device"] != "cpu"
-                ):
+                )
+                quantize = (
+                    export_config["upscale_precision"] == "int8"
+                    and export_config["device"] == "cpu"
+                )
+                bf16 = (
+                    export_config["upscale_precision"] == "bf16"
+                    and export_config["device"] == "cpu"
+                )
+                if bf16 and not cpu_supports_bf16():
+                    write_log_to_file(
+                        "WARNING",
+                        "This CPU doesn't support bfloat16, upscaling in float32 (high precision) instead.",
+                    )
+                    export_config["upscale_precision"] = "high"
+                    bf16 = False
+                precision = (
+                    "int8" if quantize else "bf16" if bf16 else "normal" if half else "high"
+                )
+                if generator == None:
+                    # generators are kept warm between exports and only loaded once
+                    # per (scale, device, precision, backend, pruning mode, threads)
+                    generator = model_registry.get(
+                        key=(
+                            scale,
+                            export_config["device"],
+                            # INT8 Generators are calibrated per set of calibration textures
+                            f"{precision}_{calibration_fingerprint()}" if quantize else precision,
+                            export_config["backend"],
+                            export_config["pruning_mode"],
+                            # ONNX Runtime sessions are created with a fixed thread count
+                            (ExportConfig.intra_op_threads, ExportConfig.inter_op_threads)
+                            if export_config["backend"] == "onnxruntime"
+                            else (0, 0),
+                        ),
+                        loader=lambda: load_model(
+                            device=export_config["device"],
+                            scale=scale,
+                            half=half,
+                            pruning_mode=export_config["pruning_mode"],
+                            backend=export_config["backend"],
+                            quantize=quantize,
+                            bf16=bf16,
+                        ),
+                        memory_cap_gb=float(export_config["model_cache_memory_gb"]),
+                    )
+                elif half:
                     generator.half()
 
                 if export_config["device"] == "cuda":
@@ -329,6 +717,8 @@ def scale_image(
     patch_upscale_strategy = (
         PatchUpscalingStrategy()
         if ExportConfig.split_large_image
+        or ExportConfig.tile_triage
+        or img.transparent_mask is not None
         else RegularUpscalingStrategy()
     )
     if generator:
@@ -337,61 +727,40 @@ def scale_image(
             device = export_config["device"]
             if master:
                 master.print_export_logs(f"Upscaling {im_name}")
-            with torch.inference_mode():
-                if device == "cuda":
-                    with torch.autocast(
-                        device_type=device,
-                        dtype=confref.upscale_precision_levels[device][
-                            export_config["upscale_precision"]
-                        ][1],
-                    ):
-                        # upscaling color
-                        if img.upscale_color_with_generator:
-
-                            img.color_channels = patch_upscale_strategy.upscale(
-                                img, "color", generator, export_config, scale
-                            )
-                            if (not ExportConfig.split_large_image) or (
-                                not confref.split_color
-                            ):
-                                img.color_channels = generator(
-                                    confref.inference_transform(
-                                        image=img.color_channels
-                                    )["image"]
-                                    .unsqueeze(0)
-                                    .to(export_config["device"])
-                                )[0]
-
-                        # upscaling alpha
-                        if img.upscale_alpha_with_generator:
-                            img.alpha = patch_upscale_strategy.upscale(
-                                img, "alpha", generator, export_config, scale
-                            )
-                            if (not ExportConfig.split_large_image) or (
-                                not confref.split_alpha
-                            ):
-                                img.alpha = generator(
-                                    confref.inference_transform(image=img.alpha)[
-                                        "image"
-                                    ]
-                                    .unsqueeze(0)
-                                    .to(export_config["device"])
-                                )[0]
-
-                else:
-                    if img.upscale_color_with_generator:
+            dtype = confref.upscale_precision_levels[device][
+                export_config["upscale_precision"]
+            ][1]
+            # cpu precisions other than float32 are handled by the generator itself
+            autocast = (
+                torch.autocast(device_type=device, dtype=dtype)
+                if device == "cuda"
+                else contextlib.nullcontext()
+            )
+            with torch.inference_mode(), autocast:
+                # upscaling color
+                if img.upscale_color_with_generator and not img.is_packed("color"):
+                    img.color_channels = patch_upscale_strategy.upscale(
+                        img, "color", generator, export_config, scale
+                    )
+                    if not confref.split_color:
                         img.color_channels = generator(
                             confref.inference_transform(image=img.color_channels)[
                                 "image"
                             ]
                             .unsqueeze(0)
-                            .to(device=device, dtype=torch.float32)
+                            .to(device=device, dtype=dtype)
                         )[0]
-                    if img.upscale_alpha_with_generator:
+
+                # upscaling alpha
+                if img.upscale_alpha_with_generator and not img.is_packed("alpha"):
+                    img.alpha = patch_upscale_strategy.upscale(
+                        img, "alpha", generator, export_config, scale
+                    )
+                    if not confref.split_alpha:
                         img.alpha = generator(
                             confref.inference_transform(image=img.alpha)["image"]
                             .unsqueeze(0)
-                            .to(device=device, dtype=torch.float32)
+                            .to(device=device, dtype=dtype)
                         )[0]
 
                 img.handle_gamma_correction(1 / export_config["gamma_adjustment"])
@@ -422,6 +791,465 @@ def scale_image(
         ).recombine_channels()
 
 
+def upscale_image_batch(
+    master: Union[ExportFrame, None],
+    generator: Union[Generator, None],
+    export_config: dict,
+    images: List[ImageContainer],
+    scale: float,
+) -> List[ImageContainer]:
+    """
+    Upscales the color and alpha channels of images that aren't split into patches
+    together, stacking channels of the same size into batches, and then applies the
+    same post-upscale steps as scale_image to each image. Returns the images that
+    were upscaled; the others are left to scale_image. If the batch fails, no image
+    is modified so that each can still be upscaled on its own.
+    """
+    # triaged images are upscaled tile by tile by scale_image
+    if not generator or scale not in [2, 4] or len(images) < 2 or ExportConfig.tile_triage:
+        return []
+    strategy = PatchUpscalingStrategy()
+    max_pixels = strategy.max_split_size(export_config)
+    batched, channels = [], {}
+    for image in images:
+        height, width = image.color_channels.shape[:2]
+        if ExportConfig.split_large_image and height * width * scale * scale > max_pixels:
+            continue  # split into patches by scale_image
+        if image.transparent_mask is not None:
+            continue  # transparent tiles are skipped by scale_image
+        batched.append(image)
+        for channel_type in ["color", "alpha"]:
+            if (
+                getattr(image, f"upscale_{channel_type}_with_generator")
+                and not image.is_packed(channel_type)
+            ):
+                array = image.color_channels if channel_type == "color" else image.alpha
+                channels.setdefault(array.shape, []).append((image, channel_type))
+    if len(batched) < 2:
+        return []
+
+    names = ", ".join(image.src_image_name for image in batched)
+    if master:
+        master.print_export_logs(f"Upscaling {names}")
+    write_log_to_file("INFO", f"Upscaling {len(batched)} images together: {names}.")
+    device = export_config["device"]
+    dtype = confref.upscale_precision_levels[device][export_config["upscale_precision"]][1]
+    autocast = (
+        torch.autocast(device_type=device, dtype=dtype)
+        if device == "cuda"
+        else contextlib.nullcontext()
+    )
+    try:
+        upscaled = []
+        with torch.inference_mode(), autocast:
+            for group in channels.values():
+                stacked = np.stack(
+                    [
+                        image.color_channels if channel_type == "color" else image.alpha
+                        for image, channel_type in group
+                    ]
+                )
+                outputs = [
+                    output
+                    for upscaled_batch in strategy.iter_upscaled_patches(
+                        stacked, generator, export_config, scale, use_tile_cache=False
+                    )
+                    for output in upscaled_batch
+                ]
+                del stacked
+                upscaled += [
+                    (image, channel_type, output)
+                    for (image, channel_type), output in zip(group, outputs)
+                ]
+    except Exception as e:
+        write_log_to_file(
+            "ERROR",
+            f"Could not upscale {names} together, upscaling them one at a time: \n\t{e}\n",
+        )
+        return []
+
+    with torch.inference_mode():
+        for image, channel_type, output in upscaled:
+            setattr(image, "color_channels" if channel_type == "color" else "alpha", output)
+        for image in batched:
+            image.handle_gamma_correction(1 / export_config["gamma_adjustment"])
+            image.recombine_channels()
+    return batched
+
+
+def pack_planes(planes: List[np.ndarray]) -> np.ndarray:
+    """
+    Packs up to three single channel planes of shape (h, w, 1) into the channels of
+    one (h, w, 3) input. Empty channels are filled with the first plane so that a
+    lone plane goes into the generator like its 3-channel repeat would. Its output
+    is channel 0 of the upscaled pack though, whereas an unpacked single channel
+    image is collapsed from all 3 upscaled channels by the luma weighting in
+    ImageContainer.recombine_channels, so the two differ slightly.
+    """
+    return np.concatenate(planes + [planes[0]] * (3 - len(planes)), axis=2)
+
+
+def upscale_packs(
+    packs: np.ndarray,
+    generator: Generator,
+    export_config: dict,
+    scale: float,
+) -> List[torch.Tensor]:
+    """
+    Upscales packed planes of shape (num of packs, h, w, 3) and returns each upscaled
+    pack as a tensor of shape (3, h, w). Packs too large for the device are split
+    into patches (or triaged tile by tile), the others are upscaled in batches.
+    """
+    strategy = PatchUpscalingStrategy()
+    height, width = packs.shape[1:3]
+    if not ExportConfig.tile_triage and not (
+        ExportConfig.split_large_image
+        and height * width * scale * scale > strategy.max_split_size(export_config)
+    ):
+        return [
+            output
+            for upscaled_batch in strategy.iter_upscaled_patches(
+                packs, generator, export_config, scale, use_tile_cache=False
+            )
+            for output in upscaled_batch
+        ]
+    outputs = []
+    for pack in packs:
+        split_color = confref.split_color
+        output = strategy.upscale(
+            SimpleNamespace(color_channels=pack), "color", generator, export_config, scale
+        )
+        confref.split_color = split_color  # the flag refers to the images' own channels
+        outputs.append(output.permute(2, 0, 1))
+    return outputs
+
+
+def upscale_packed_planes(
+    master: Union[ExportFrame, None],
+    generator: Union[Generator, None],
+    export_config: dict,
+    images: List[ImageContainer],
+    scale: float,
+) -> None:
+    """
+    Upscales the single channel planes (greyscale color channels, alpha channels and
+    the X and Y channels of normal maps) of images three per forward pass by packing independent planes of the same size,
+    from any of the images, into the red, green and blue channels of one input and
+    unpacking the upscaled channels. If packing fails, the planes are expanded into
+    3 channels so that scale_image upscales them instead.
+    """
+    planes = {}
+    for image in images:
+        for channel_type in image.packed_channels:
+            plane = image.get_packed_plane(channel_type)
+            planes.setdefault(plane.shape, []).append((image, channel_type, plane))
+    if not planes:
+        return
+    if not generator or scale not in [2, 4]:
+        for image in images:
+            image.expand_packed_channels()
+        return
+
+    no_planes = sum(len(group) for group in planes.values())
+    no_packs = sum(math.ceil(len(group) / 3) for group in planes.values())
+    if master:
+        master.print_export_logs(f"Upscaling {no_planes} single channel planes")
+    write_log_to_file(
+        "INFO", f"Packing {no_planes} single channel planes into {no_packs} forward passes."
+    )
+    device = export_config["device"]
+    dtype = confref.upscale_precision_levels[device][export_config["upscale_precision"]][1]
+    autocast = (
+        torch.autocast(device_type=device, dtype=dtype)
+        if device == "cuda"
+        else contextlib.nullcontext()
+    )
+    try:
+        upscaled = []
+        with torch.inference_mode(), autocast:
+            for group in planes.values():
+                packed_groups = [group[i : i + 3] for i in range(0, len(group), 3)]
+                packs = np.stack(
+                    [pack_planes([plane for *_, plane in pack]) for pack in packed_groups]
+                )
+                outputs = upscale_packs(packs, generator, export_config, scale)
+                del packs
+                upscaled += [
+                    (image, channel_type, output[k : k + 1])
+                    for pack, output in zip(packed_groups, outputs)
+                    for k, (image, channel_type, _) in enumerate(pack)
+                ]
+    except Exception as e:
+        write_log_to_file(
+            "ERROR",
+            f"Could not upscale packed single channel planes, upscaling them one at a time: \n\t{e}\n",
+        )
+        for image in images:
+            image.expand_packed_channels()
+        return
+
+    with torch.inference_mode():
+        for image, channel_type, plane in upscaled:
+            image.set_packed_output(channel_type, plane)
+
+
+def compare_plane_packing(
+    generator: Generator,
+    planes: List[np.ndarray],
+    export_config: dict,
+    scale: float,
+) -> Tuple[float, float]:
+    """
+    Upscales single channel planes of shape (h, w, 1) packed three per forward pass
+    and by repeating each plane into 3 channels and collapsing the output with luma
+    weights, and reports the PSNR of the packed planes against the repeated planes
+    and the speed up of packing.
+    """
+    weights = torch.tensor([0.2989, 0.5870, 0.1140]).view(3, 1, 1)
+    with torch.inference_mode():
+        start_time = time.time()
+        repeated = [
+            (output.float() * weights).sum(dim=0, keepdim=True)
+            for output in upscale_packs(
+                np.stack([np.repeat(plane, 3, axis=2) for plane in planes]),
+                generator,
+                export_config,
+                scale,
+            )
+        ]
+        repeat_time = time.time() - start_time
+        start_time = time.time()
+        outputs = upscale_packs(
+            np.stack([pack_planes(planes[i : i + 3]) for i in range(0, len(planes), 3)]),
+            generator,
+            export_config,
+            scale,
+        )
+        packed = [output[k : k + 1].float() for output in outputs for k in range(3)]
+        pack_time = time.time() - start_time
+    mse = torch.mean(
+        (torch.stack(repeated).clamp(0, 1) - torch.stack(packed[: len(planes)]).clamp(0, 1)) ** 2
+    ).item()
+    psnr = 10 * math.log10(1 / mse) if mse else math.inf
+    write_log_to_file(
+        "INFO",
+        f"Packing {len(planes)} single channel planes was {round(repeat_time / pack_time, 2)}x "
+        f"faster than repeating them with a PSNR of {round(psnr, 2)} dB against the repeated planes.",
+    )
+    return psnr, repeat_time / pack_time
+
+
+def read_image_size(image_path: str) -> Union[Tuple[int, int], None]:
+    """
+    Reads the (height, width) of an image from its header without decoding it.
+    Returns None if the header can't be read (i.e. for exr images).
+    """
+    try:
+        with PILImage.open(image_path) as image:
+            return image.size[::-1]
+    except Exception:
+        return None
+
+
+def schedule_image_batches(
+    export_indices: List[int],
+    cache: Tuple[List[str], List[str]],
+    export_config: dict,
+    scale: float,
+) -> List[List[int]]:
+    """
+    Groups the images to export into batches of images of the same size (at the
+    export's scale and precision) so that they can be upscaled together, in the
+    order each size first appears. A batch holds as many images as the tile batch
+    size, or with "auto", as the free video memory (or the cpu memory budget)
+    allows. Images of unknown size or that are split into patches are exported
+    one at a time.
+    """
+    if scale not in [2, 4]:
+        return [[i] for i in export_indices]
+    strategy = PatchUpscalingStrategy()
+    max_pixels = strategy.max_split_size(export_config)
+    batches, open_batches, batch_sizes = [], {}, {}
+    for i in export_indices:
+        size = read_image_size(os.path.join(cache[1][i], cache[0][i]))
+        if size is None or (
+            ExportConfig.split_large_image and size[0] * size[1] * scale * scale > max_pixels
+        ):
+            batches.append([i])
+            continue
+        if size not in batch_sizes:
+            batch_sizes[size] = max(
+                1,
+                int(ExportConfig.tile_batch_size)
+                if ExportConfig.tile_batch_size != "auto"
+                else strategy.max_batch_size(*size, scale, export_config),
+            )
+        batch = open_batches.get(size)
+        if batch is None or len(batch) == batch_sizes[size]:
+            batch = open_batches[size] = []
+            batches.append(batch)
+        batch.append(i)
+    return batches
+
+
+def read_image(
+    i: int,
+    cache: Tuple[List[str], List[str]],
+    export_config: dict,
+    master: Union[ExportFrame, None],
+    verbose: bool,
+    decoded_image: Optional[np.ndarray] = None,
+) -> Tuple[ImageContainer, str, str, float]:
+    """
+    Reads an image of the export (unless it was already decoded) and preprocesses
+    it to be upscaled. Runs on the read pool of the export pipeline.
+    """
+    im_name, im_path = cache[0][i], cache[1][i]
+    fp, step = os.path.join(im_path, im_name), "reading image."
+    sub_time_start = time.time()
+    try:
+        if not master and verbose:
+            print(f"\nAttempting to process file:\n\t {fp}\n")
+
+        if master:
+            master.print_export_logs(f"Preprocessing: {im_name}")
+
+        step = "setting up image for processing"
+        image = ImageContainer(
+            img_index=i,
+            src_path=im_path,
+            trg_path=(
+                export_config["single_export_location"]
+                if not export_config["export_to_original"]
+                else im_path
+            ),
+
+            img_name=im_name,
+            decoded_image=decoded_image,
+            **export_config,
+        )
+
+        step = "attempting to scale linearly."
+        image.check_all_values_equivalent()
+        step = "attempting to split color and alpha channels for separate processing."
+        image.split_image()
+        step = "attempting to correct gamma."
+        image.handle_gamma_correction(export_config["gamma_adjustment"])
+        step = "converting the data type before upscaling."
+        image.convert_datatype(input=True)
+    except:
+        write_log_to_file(
+            "ERROR",
+            f"Ran into an issue while {step}: {im_name} ",
+        )
+        raise
+    return image, im_name, im_path, sub_time_start
+
+
+def postprocess_image(
+    image: ImageContainer,
+    im_name: str,
+    export_config: dict,
+    master: Union[ExportFrame, None],
+) -> None:
+    """
+    Converts an upscaled image to the export color depth and color mode, adds
+    noise and orders its channels for the library that writes it.
+    """
+    step = "attempting to reconvert the back to the chosen export color depth."
+    try:
+        # pixel values adjustments based on export color depth, export color space and gamma correction settings
+        image.convert_datatype(input=False)
+        step = "attempting to process export color mode."
+        # write color mode (RGB, RGBA, L, LA)
+        # exporting images as .dds forced RGBA
+        image.image = image.handle_write_channel_mode(image.image)
+
+        step = "applying the dds mip level workaround for the .dds image export format."
+        # dds mipmap fix
+        if export_config["export_format"] == "dds":
+            image.apply_dds_mipmap_fix()
+
+        # noise
+        if (
+            (not export_config["noise_level"] == 0.0)
+            and (
+                not image.linear_upscale_all_channels  # if the entire image is a single value, no point in noisifying
+            )
+            and (
+                not image.upscale_factor == 0.5
+            )  # does not support adding noise while downscaling
+        ):
+            if master:
+                master.print_export_logs(f"Processing noise for: {im_name}")
+            step = "attempting to process color mode for noisy image."
+            image.noisy_copy = image.handle_write_channel_mode(image.noisy_copy)
+            step = "attempting to add noise."
+            image.handle_noise()
+
+        step = "attempting reverse color channels."
+
+        # channel order for wand vs. open cv write functions
+        image.handle_channel_order()
+    except:
+        write_log_to_file(
+            "ERROR",
+            f"Ran into an issue while {step}: {im_name} ",
+        )
+        raise
+
+
+def write_upscaled_image(
+    image: ImageContainer,
+    im_name: str,
+    im_path: str,
+    sub_time_start: float,
+    export_config: dict,
+    master: Union[ExportFrame, None],
+    verbose: bool,
+) -> None:
+    """
+    Postprocesses an upscaled image and writes it. Runs on the write pool of the
+    export pipeline.
+    """
+    postprocess_image(image, im_name, export_config, master)
+    step = "attempting to save image."
+    try:
+        # write
+        if master:
+            master.print_export_logs(f"Saving: {im_name}")
+        image.write_image(master=master, verbose=verbose)
+    except:
+        write_log_to_file(
+            "ERROR",
+            f"Ran into an issue while {step}: {im_name} ",
+        )
+        raise
+
+
+def write_worker_image(
+    image: ImageContainer,
+    array: np.ndarray,
+    master: Union[ExportFrame, None],
+    verbose: bool,
+) -> None:
+    """
+    Writes an image upscaled and postprocessed by an export worker process, whose
+    pixels were handed back in shared memory.
+    """
+    try:
+        image.image = array
+        if master:
+            master.print_export_logs(f"Saving: {image.src_image_name}")
+        image.write_image(master=master, verbose=verbose)
+    except:
+        write_log_to_file(
+            "ERROR",
+            f"Ran into an issue while attempting to save image.: {image.src_image_name} ",
+        )
+        raise
+
+
 def export_images(
     master: Union[ExportFrame, None],
     export_config: Union[Dict[str, Union[str, int, bool]], None],
@@ -469,10 +1297,6 @@ def export_images(
                 gc.collect()
                 torch.cuda.empty_cache()
                 torch.cuda.reset_max_memory_allocated()
-            else:
-                ExportConfig.split_large_image = False
-                confref.split_color = False
-                confref.split_alpha = False
 
             # determine maximum vram available once before the loop to batch process images
             if export_config["device"] == "cuda":
@@ -492,137 +1316,196 @@ def export_images(
 
             start_time = time.time()
             count, progress = 0, 0
+            for route in PatchUpscalingStrategy.triage_counts:
+                PatchUpscalingStrategy.triage_counts[route] = 0
+            tile_cache.clear()
             if master:
                 prog_bar.set(value=progress)
 
-            # 3. setup generator and determine scale
+            # 3. setup generator and determine scale, worker processes set up their own
 
+            use_workers = (
+                export_config["device"] == "cpu" and int(export_config.get("workers", 1)) > 1
+            )
+            # eager Generators are loaded once and their weights shared with the workers.
+            # Compiled (and INT8) ones are compiled once here and loaded by each worker
+            # from the compiled file, so that the workers don't all compile it at once
+            share_weights = (
+                export_config["backend"] == "eager"
+                and export_config["upscale_precision"] != "int8"
+            )
             generator, scale = setup_generator(export_config, gen)
+            if use_workers and not (share_weights and share_generator_weights(generator)):
+                generator = None
+
+            # tile worker processes split the tiles of each image instead
+            if (
+                not use_workers
+                and export_config["device"] == "cpu"
+                and int(export_config.get("tile_workers", 1)) > 1
+                and generator is not None
+            ):
+                PatchUpscalingStrategy.tile_workers = TileWorkers(
+                    workers=export_config["tile_workers"],
+                    threads_per_worker=export_config.get("threads_per_worker", 0),
+                    export_config=export_config,
+                    cache=cache_copy,
+                    generator=(
+                        generator
+                        if share_weights and share_generator_weights(generator)
+                        else None
+                    ),
+                )
         except Exception as e:
             write_log_to_file(
                 "ERROR",
                 f"Ran into an issue while setting up the batch of images to process: \n {e}.",
             )
 
-        for i in export_indices:
-            try:
-                count += 1
-                im_name, im_path = cache_copy[0][i], cache_copy[1][i]
-                fp, step = os.path.join(im_path, im_name), "reading image."
-                sub_time_start = time.time()
-
-                if master:
-                    master.print_image_index(f"Processed/Total: {count-1}/{tot_images}")
-                if not master and verbose:
-                    print(f"\nAttempting to process file:\n\t {fp}\n")
-
-                if master:
-                    master.print_export_logs(f"Preprocessing: {im_name}")
-
-                step = "setting up image for processing"
-                img = ImageContainer(
-                    img_index=i,
-                    src_path=im_path,
-                    trg_path=(
-                        export_config["single_export_location"]
-                        if not export_config["export_to_original"]
-                        else im_path
-                    ),
+        stopped = False
 
-                    img_name=im_name,
-                    **export_config,
+        def handle_written_image(
+            im_name: str, im_path: str, sub_time_start: float, failed: bool
+        ) -> None:
+            global warning_mssg
+            nonlocal progress
+            if failed:
+                not_processed.append((im_name, im_path))
+                warning_mssg = True if master else False
+                return
+            if master:
+                progress += step_size
+                prog_bar.set(value=progress)
+                write_log_to_file(
+                    "INFO",
+                    f"Processing time for image {im_name}: {round(time.time()-sub_time_start, 2)} seconds.",
                 )
 
-                step = "attempting to scale linearly."
-                img.check_all_values_equivalent()
-                step = "attempting to split color and alpha channels for separate processing."
-                img.split_image()
-                step = "attempting to correct gamma."
-                img.handle_gamma_correction(export_config["gamma_adjustment"])
-                step = "converting the data type before upscaling."
-                img.convert_datatype(input=True)
-                step = "attempting to upscale the image with the chosen model"
-                scale_image(
-                    master=master,
-                    generator=generator,
-                    export_config=export_config,
-                    im_name=im_name,
-                )  # recombines color and alpha (if any) channel into a single array
-
-                step = (
-                    "attempting to reconvert the back to the chosen export color depth."
+        def handle_written_images(finished: List[Tuple[tuple, Future]]) -> None:
+            for (_, im_name, im_path, sub_time_start), future in finished:
+                handle_written_image(
+                    im_name, im_path, sub_time_start, future.exception() is not None
                 )
 
-                # pixel values adjustments based on export color depth, export color space and gamma correction settings
-                img.convert_datatype(input=False)
-                step = "attempting to process export color mode."
-                # write color mode (RGB, RGBA, L, LA)
-                # exporting images as .dds forced RGBA
-                img.image = img.handle_write_channel_mode(img.image)
-
-                step = "applying the dds mip level workaround for the .dds image export format."
-                # dds mipmap fix
-                if export_config["export_format"] == "dds":
-                    img.apply_dds_mipmap_fix()
-
-                # noise
-                if (
-                    (not export_config["noise_level"] == 0.0)
-                    and (
-                        not img.linear_upscale_all_channels  # if the entire image is a single value, no point in noisifying
-                    )
-                    and (
-                        not img.upscale_factor == 0.5
-                    )  # does not support adding noise while downscaling
+        if use_workers:
+            # 4. worker processes upscale whole images, which the main process decodes
+            # ahead of them and writes once they are handed back
+            export_workers = ExportWorkers(
+                workers=export_config["workers"],
+                threads_per_worker=export_config.get("threads_per_worker", 0),
+                export_config=export_config,
+                cache=cache_copy,
+                generator=generator,
+                write=lambda image, array: write_worker_image(image, array, master, verbose),
+            )
+            try:
+                for i, sub_time_start, error in export_workers.run(
+                    export_indices, task.stopped
                 ):
+                    count += 1
                     if master:
-                        master.print_export_logs(f"Processing noise for: {im_name}")
-                    step = "attempting to process color mode for noisy image."
-                    img.noisy_copy = img.handle_write_channel_mode(img.noisy_copy)
-                    step = "attempting to add noise."
-                    img.handle_noise()
-
-                step = "attempting reverse color channels."
-
-                # channel order for wand vs. open cv write functions
-                img.handle_channel_order()
-
-                step = "attempting to save image."
-                # write
-                if master:
-                    master.print_export_logs(f"Saving: {im_name}")
-                img.write_image(master=master, verbose=verbose)
-
-                if master:
-                    progress += step_size
-                    prog_bar.set(value=progress)
-                    write_log_to_file(
-                        "INFO",
-                        f"Processing time for image {im_name}: {round(time.time()-sub_time_start, 2)} seconds.",
+                        master.print_image_index(f"Processed/Total: {count}/{tot_images}")
+                    handle_written_image(
+                        cache_copy[0][i], cache_copy[1][i], sub_time_start, error is not None
                     )
-                    if task.stopped():
+            finally:
+                export_workers.close(terminate=task.stopped())
+        else:
+            # 4. the read pool reads and preprocesses the next images while the current
+            # batch is upscaled and the write pool postprocesses and writes upscaled images
+            batches = schedule_image_batches(export_indices, cache_copy, export_config, scale)
+            pipeline = ExportPipeline(
+                read=lambda i: read_image(i, cache_copy, export_config, master, verbose),
+                write=lambda item: write_upscaled_image(*item, export_config, master, verbose),
+                depth=export_config.get("pipeline_depth", ExportConfig.pipeline_depth),
+            )
+            try:
+                for batch, futures in zip(batches, pipeline.read_batches(batches)):
+                    # 4. a) collect the images of the batch read by the read pool
+                    images = []
+                    for i, future in zip(batch, futures):
+                        count += 1
+                        if master:
+                            master.print_image_index(f"Processed/Total: {count-1}/{tot_images}")
+                        try:
+                            images.append(future.result())
+                        except:
+                            not_processed.append((cache_copy[0][i], cache_copy[1][i]))
+                            warning_mssg = True if master else False
+
+                    # 4. b) upscale single channel planes three per forward pass and the
+                    # remaining channels of same-sized images together
+                    with pipeline.stage("infer"):
+                        upscale_packed_planes(
+                            master, generator, export_config, [image for image, *_ in images], scale
+                        )
+                        batch_upscaled = upscale_image_batch(
+                            master, generator, export_config, [image for image, *_ in images], scale
+                        )
+
+                    # 4. c) upscale the remaining images one at a time and queue each upscaled
+                    # image to be postprocessed and written
+                    for item in images:
+                        img, im_name, im_path, sub_time_start = item
+                        step = "attempting to upscale the image with the chosen model"
+                        try:
+                            if not any(img is image for image in batch_upscaled):
+                                with pipeline.stage("infer"):
+                                    scale_image(
+                                        master=master,
+                                        generator=generator,
+                                        export_config=export_config,
+                                        im_name=im_name,
+                                    )  # recombines color and alpha (if any) channel into a single array
+                        except:
+                            not_processed.append((im_name, im_path))
+                            write_log_to_file(
+                                "ERROR",
+                                f"Ran into an issue while {step}: {im_name} ",
+                            )
+                            warning_mssg = True if master else False
+                            continue
+                        finally:
+                            split, img, warn_mssg, confref.split_color, confref.split_alpha = (
+                                False,
+                                None,
+                                False,
+                                False,
+                                False,
+                            )
+                        handle_written_images(pipeline.submit_write(item))
+                        if task.stopped():
+                            stopped = True
+                            break
+                    images, batch_upscaled = None, None
+                    if stopped:
+                        pipeline.cancel()
                         break
-                split, img, warn_mssg, confref.split_color, confref.split_alpha = (
-                    False,
-                    None,
-                    False,
-                    False,
-                    False,
-                )
-
-            except:
-                not_processed.append((im_name, im_path))
-                write_log_to_file(
-                    "ERROR",
-                    f"Ran into an issue while {step}: {im_name} ",
-                )
-                warning_mssg = True if master else False
-                continue
+            finally:
+                # wait for the queued images to be written
+                handle_written_images(pipeline.close())
+                if PatchUpscalingStrategy.tile_workers is not None:
+                    PatchUpscalingStrategy.tile_workers.close()
+                    PatchUpscalingStrategy.tile_workers = None
         tot_time = round(time.time() - start_time, 2)
         write_log_to_file(
             "INFO",
             f"Total time to upscale {count} image(s): {tot_time} seconds for an average of {round(tot_time/count,2)} seconds per image.",
         )
+        if ExportConfig.tile_triage or ExportConfig.skip_transparent_tiles:
+            write_log_to_file(
+                "INFO",
+                "Tile triage routes: {0} constant, {1} low detail (Lanczos), {3} transparent (bilinear) and {2} generator tiles.".format(
+                    *PatchUpscalingStrategy.triage_counts.values()
+                ),
+            )
+        if tile_cache.hits + tile_cache.misses:
+            write_log_to_file(
+                "INFO",
+                f"Tile cache: {tile_cache.hits} of {tile_cache.hits + tile_cache.misses} tiles reused "
+                f"(hit rate {round(tile_cache.hit_rate * 100, 1)}%, {round(tile_cache.memory_used / 1024**2, 1)} MiB cached).",
+            )
+        tile_cache.clear()  # the cached tiles belong to this export's generator
         not_processed = handle_unprocessed_images(not_processed)
         if not not_processed == "all_processed":
 
@@ -0,0 +1,673 @@
+import math
+import multiprocessing
+import os
+import queue
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import torch
+
+from app_config.config import ConfigReference as confref
+from app_config.config import ExportConfig
+from utils.logger import write_log_to_file
+
+# (shared memory block name, shape, dtype) of an array handed to another process
+SharedArray = Tuple[str, Tuple[int, ...], str]
+
+
+def share_array(array: np.ndarray) -> Tuple[shared_memory.SharedMemory, SharedArray]:
+    """Copies an array into a new shared memory block, which the caller has to unlink."""
+    if not isinstance(array, np.ndarray):
+        raise ValueError(f"Can't share {type(array).__name__}, the image could not be decoded.")
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+    return block, (block.name, array.shape, str(array.dtype))
+
+
+def attach_array(descriptor: SharedArray) -> Tuple[shared_memory.SharedMemory, np.ndarray]:
+    """Attaches to an array shared by another process, which remains in charge of unlinking it."""
+    name, shape, dtype = descriptor
+    # the workers share the resource tracker of the main process, which unlinks the
+    # blocks left behind by workers that died once the main process exits
+    block = shared_memory.SharedMemory(name=name)
+    return block, np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+
+def release_block(block: Optional[shared_memory.SharedMemory]) -> None:
+    if block is None:
+        return
+    block.close()
+    try:
+        block.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def export_settings() -> Dict[str, Any]:
+    """The export settings of this process, which spawned worker processes don't inherit."""
+    return {
+        name: value
+        for name, value in vars(ExportConfig).items()
+        if not name.startswith("_") and not callable(value)
+    }
+
+
+def worker_cores(no_workers: int, threads: int) -> Dict[int, Optional[List[int]]]:
+    """The cores each worker is pinned to, None if the workers can't each get their own."""
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else []
+    return {
+        worker_id: (
+            cores[worker_id * threads : (worker_id + 1) * threads]
+            if len(cores) >= no_workers * threads
+            else None
+        )
+        for worker_id in range(no_workers)
+    }
+
+
+def setup_worker(
+    settings: Dict[str, Any],
+    cores: Optional[List[int]],
+    threads: int,
+    export_config: dict,
+    cache: Tuple[List[str], List[str]],
+    generator: Optional[torch.nn.Module],
+) -> Tuple[Optional[torch.nn.Module], float]:
+    """
+    Applies the export settings, loaded images, thread count and core pinning of a
+    worker process and returns its Generator and scale. Workers that aren't handed
+    a Generator with shared weights load their own, from the Generator the main
+    process compiled.
+    """
+    from caches.cache import image_paths_cache
+    from utils import export_utils
+
+    # spawned processes import the default export settings and an empty image cache,
+    # whose images name the INT8 Generator calibrated on them by default
+    for name, value in settings.items():
+        setattr(ExportConfig, name, value)
+    image_paths_cache[0][:], image_paths_cache[1][:] = cache
+    confref.split_color, confref.split_alpha = False, False
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(threads)
+    if ExportConfig.intra_op_threads == 0:
+        ExportConfig.intra_op_threads = threads
+
+    if generator is not None:
+        scale = confref.scale_map[export_config["scale"]]
+    else:
+        generator, scale = export_utils.setup_generator(export_config, None)
+    if generator is None and scale not in [0.5, 1]:
+        raise RuntimeError("the upscaling model could not be set up")
+    return generator, scale
+
+
+def worker_main(
+    worker_id: int,
+    settings: Dict[str, Any],
+    cores: Optional[List[int]],
+    threads: int,
+    export_config: dict,
+    cache: Tuple[List[str], List[str]],
+    generator: Optional[torch.nn.Module],
+    tasks: multiprocessing.Queue,
+    results: multiprocessing.Queue,
+) -> None:
+    """
+    Upscales the images handed to a worker process. Each task is the position of
+    an image in the export, its index in the cache and its decoded array in shared
+    memory. The worker preprocesses, upscales and postprocesses the image and hands
+    the result back in shared memory, as ("done", worker, position, (image,
+    SharedArray)), or reports ("failed", worker, position, error).
+    """
+    from utils import export_utils
+
+    try:
+        generator, scale = setup_worker(settings, cores, threads, export_config, cache, generator)
+    except Exception as e:
+        results.put(("init failed", worker_id, None, repr(e)))
+        return
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        position, i, descriptor = task
+        try:
+            block, array = attach_array(descriptor)
+            decoded_image = array.copy()
+            block.close()
+            image, im_name, _, _ = export_utils.read_image(
+                i, cache, export_config, None, False, decoded_image
+            )
+            try:
+                export_utils.img, export_utils.scale = image, scale
+                export_utils.upscale_packed_planes(None, generator, export_config, [image], scale)
+                export_utils.scale_image(
+                    master=None,
+                    generator=generator,
+                    export_config=export_config,
+                    im_name=im_name,
+                )
+            finally:
+                export_utils.img, confref.split_color, confref.split_alpha = None, False, False
+            export_utils.postprocess_image(image, im_name, export_config, None)
+
+            block, output = share_array(image.image)
+            block.close()
+            # only the upscaled image is needed to write it, in shared memory
+            for name, value in list(vars(image).items()):
+                if isinstance(value, (np.ndarray, torch.Tensor)):
+                    setattr(image, name, None)
+            results.put(("done", worker_id, position, (image, output)))
+        except Exception as e:
+            results.put(("failed", worker_id, position, repr(e)))
+
+
+class ExportWorkers:
+    """
+    Process pool execution mode of the export for CPU upscaling.
+
+    A single process doesn't scale past a few cores since the model's operators
+    only parallelise so far. Instead, each worker process upscales whole images
+    with its own threads pinned to its own cores. The main process decodes images
+    into shared memory ahead of the workers and writes the upscaled images they
+    hand back in shared memory, so neither crosses the process boundary pickled.
+    Eager Generators are loaded once and their weights shared with the workers.
+
+    Each worker holds at most ConfigReference.worker_queue_depth images and the
+    next image goes to the least busy worker, so workers that finish early take on
+    the remaining images. A worker that dies fails the image it was upscaling, its
+    other images go to the remaining workers and it is restarted, up to
+    ConfigReference.max_worker_restarts times per export.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        threads_per_worker: int,
+        export_config: dict,
+        cache: Tuple[List[str], List[str]],
+        write: Callable[[Any, np.ndarray], None],
+        generator: Optional[torch.nn.Module] = None,
+    ):
+        self.context = multiprocessing.get_context(confref.worker_start_method)
+        self.no_workers = max(1, int(workers))
+        cpu_count = os.cpu_count() or 1
+        self.threads = int(threads_per_worker) or max(1, cpu_count // self.no_workers)
+        self.export_config = export_config
+        self.cache = cache
+        self.write = write
+        # a Generator whose weights are in shared memory, mapped by every worker
+        self.generator = generator
+        self.settings = export_settings()
+        self.cores = worker_cores(self.no_workers, self.threads)
+        self.results = self.context.Queue()
+        self.processes: Dict[int, multiprocessing.Process] = {}
+        self.tasks: Dict[int, multiprocessing.Queue] = {}
+        self.assigned: Dict[int, Deque[int]] = {}
+        self.restarts = 0
+        self.read_pool = ThreadPoolExecutor(
+            max_workers=confref.pipeline_read_workers, thread_name_prefix="export-read"
+        )
+        self.write_pool = ThreadPoolExecutor(
+            max_workers=confref.pipeline_write_workers, thread_name_prefix="export-write"
+        )
+        # decoded images in shared memory by their position in the export
+        self.inputs: Dict[int, Tuple[shared_memory.SharedMemory, SharedArray]] = {}
+        self.reads: Deque[Tuple[int, Future]] = deque()
+
+    def start_worker(self, worker_id: int) -> None:
+        # started before the workers so that they share it instead of starting their own
+        resource_tracker.ensure_running()
+        self.tasks[worker_id] = self.context.Queue()
+        self.assigned[worker_id] = deque()
+        self.processes[worker_id] = self.context.Process(
+            target=worker_main,
+            args=(
+                worker_id,
+                self.settings,
+                self.cores[worker_id],
+                self.threads,
+                self.export_config,
+                self.cache,
+                self.generator,
+                self.tasks[worker_id],
+                self.results,
+            ),
+            name=f"export-worker-{worker_id}",
+            daemon=True,
+        )
+        self.processes[worker_id].start()
+
+    def retire_worker(self, worker_id: int) -> Deque[int]:
+        """Stops tracking a worker and returns the positions of the images it held."""
+        process = self.processes.pop(worker_id)
+        if process.is_alive():
+            process.terminate()
+        process.join()
+        self.tasks.pop(worker_id).close()
+        return self.assigned.pop(worker_id)
+
+    @staticmethod
+    def decode(src_path: str) -> Tuple[shared_memory.SharedMemory, SharedArray]:
+        from utils.image_container import ImageContainer
+
+        return share_array(ImageContainer.decode(src_path))
+
+    def write_result(self, image: Any, output: SharedArray) -> None:
+        block, array = attach_array(output)
+        try:
+            self.write(image, array)
+        finally:
+            image.image = None
+            release_block(block)
+
+    def release_input(self, position: int) -> None:
+        block, _ = self.inputs.pop(position, (None, None))
+        release_block(block)
+
+    def run(
+        self, indices: List[int], stopped: Callable[[], bool]
+    ) -> Iterator[Tuple[int, float, Optional[BaseException]]]:
+        """
+        Yields the cache index of each image of the export once it's written, along
+        with the time it started being read and the exception it ran into, if any.
+        Stops handing out images once stopped returns True.
+        """
+        for worker_id in range(self.no_workers):
+            self.start_worker(worker_id)
+        unread: Deque[int] = deque(range(len(indices)))
+        reads = self.reads
+        start_times: Dict[int, float] = {}
+        # decoded images of dead workers that are handed out again
+        retries: Deque[int] = deque()
+        writes: Deque[Tuple[int, Future]] = deque()
+        remaining = len(indices)
+        capacity = self.no_workers * confref.worker_queue_depth
+
+        def hand_out(position: int) -> bool:
+            free = [
+                worker_id
+                for worker_id, assigned in self.assigned.items()
+                if len(assigned) < confref.worker_queue_depth
+            ]
+            if not free:
+                return False
+            worker_id = min(free, key=lambda worker_id: len(self.assigned[worker_id]))
+            self.assigned[worker_id].append(position)
+            self.tasks[worker_id].put((position, indices[position], self.inputs[position][1]))
+            return True
+
+        while remaining:
+            if stopped():
+                break
+
+            # decode the next images while the workers are busy
+            while unread and len(reads) + len(self.inputs) < 2 * capacity:
+                position = unread.popleft()
+                start_times[position] = time.time()
+                src_path = os.path.join(
+                    self.cache[1][indices[position]], self.cache[0][indices[position]]
+                )
+                reads.append((position, self.read_pool.submit(self.decode, src_path)))
+            while retries and hand_out(retries[0]):
+                retries.popleft()
+            while not retries and reads and reads[0][1].done():
+                position, future = reads[0]
+                if future.exception() is not None:
+                    reads.popleft()
+                    remaining -= 1
+                    yield indices[position], start_times[position], future.exception()
+                    continue
+                self.inputs[position] = future.result()
+                if not hand_out(position):
+                    break
+                reads.popleft()
+
+            # hand finished images over to the write pool
+            while writes and writes[0][1].done():
+                position, future = writes.popleft()
+                remaining -= 1
+                yield indices[position], start_times[position], future.exception()
+
+            # collect what the workers report, then check that they are alive
+            messages = []
+            try:
+                messages.append(
+                    self.results.get(timeout=confref.worker_poll_interval)
+                )
+                while True:
+                    messages.append(self.results.get_nowait())
+            except queue.Empty:
+                pass
+            for status, worker_id, position, result in messages:
+                if status == "init failed":
+                    write_log_to_file(
+                        "ERROR", f"Export worker {worker_id} could not start: {result}"
+                    )
+                    retries.extend(self.retire_worker(worker_id))
+                    continue
+                if worker_id not in self.assigned or position not in self.assigned[worker_id]:
+                    # the image was already failed after its worker was found dead
+                    if status == "done":
+                        release_block(attach_array(result[1])[0])
+                    continue
+                self.assigned[worker_id].remove(position)
+                self.release_input(position)
+                if status == "done":
+                    writes.append(
+                        (position, self.write_pool.submit(self.write_result, *result))
+                    )
+                else:
+                    write_log_to_file(
+                        "ERROR",
+                        f"Export worker {worker_id} could not process {self.cache[0][indices[position]]}: {result}",
+                    )
+                    remaining -= 1
+                    yield indices[position], start_times[position], RuntimeError(result)
+
+            for worker_id, process in list(self.processes.items()):
+                if process.is_alive():
+                    continue
+                assigned = self.retire_worker(worker_id)
+                write_log_to_file(
+                    "ERROR",
+                    f"Export worker {worker_id} exited with code {process.exitcode}.",
+                )
+                if assigned:
+                    # the image the worker was upscaling may be what made it fail
+                    position = assigned.popleft()
+                    self.release_input(position)
+                    remaining -= 1
+                    yield indices[position], start_times[position], RuntimeError(
+                        f"export worker {worker_id} exited with code {process.exitcode}"
+                    )
+                    retries.extend(assigned)
+                if self.restarts < confref.max_worker_restarts and remaining:
+                    self.restarts += 1
+                    self.start_worker(worker_id)
+
+            if not self.processes and remaining:
+                # no worker is left to upscale the remaining images
+                error = RuntimeError("no export worker is left to process the image")
+                failed = list(retries) + [position for position, _ in reads] + list(unread)
+                self.release_reads()
+                for position in failed:
+                    self.release_input(position)
+                    yield indices[position], start_times.get(position, time.time()), error
+                retries, unread = deque(), deque()
+                remaining = len(writes)
+
+        # images that were upscaled before the export was stopped are still written
+        while writes:
+            position, future = writes.popleft()
+            yield indices[position], start_times[position], future.exception()
+
+    def release_reads(self) -> None:
+        """Releases the images decoded ahead of the workers that weren't handed out."""
+        while self.reads:
+            position, future = self.reads.popleft()
+            if future.cancel() or future.exception() is not None:
+                continue
+            if position in self.inputs:
+                self.release_input(position)
+            else:
+                release_block(future.result()[0])
+
+    def close(self, terminate: bool = False) -> None:
+        """
+        Stops the workers, waits for the queued writes and releases the shared
+        memory of the images that weren't handed back.
+        """
+        for worker_id in list(self.processes):
+            if not terminate:
+                self.tasks[worker_id].put(None)
+        deadline = time.monotonic() + confref.worker_join_timeout
+        for worker_id in list(self.processes):
+            if not terminate:
+                self.processes[worker_id].join(max(0.0, deadline - time.monotonic()))
+            self.retire_worker(worker_id)
+        self.release_reads()
+        self.read_pool.shutdown(wait=True)
+        self.write_pool.shutdown(wait=True)
+        for position in list(self.inputs):
+            self.release_input(position)
+        self.results.close()
+        write_log_to_file(
+            "INFO",
+            f"Exported with {self.no_workers} worker processes of {self.threads} threads each"
+            f" ({self.restarts} restarted).",
+        )
+
+
+def tile_worker_main(
+    worker_id: int,
+    settings: Dict[str, Any],
+    cores: Optional[List[int]],
+    threads: int,
+    export_config: dict,
+    cache: Tuple[List[str], List[str]],
+    generator: Optional[torch.nn.Module],
+    tasks: multiprocessing.Queue,
+    results: multiprocessing.Queue,
+) -> None:
+    """
+    Upscales the tiles handed to a tile worker process. Each task is the id of a
+    batch, a range of its tiles (n, h, w, c) in shared memory and the shared
+    output buffer (n, c, h, w) the upscaled tiles are written into. The worker
+    reports ("done", worker, batch, start, None) or ("failed", worker, batch,
+    start, error).
+    """
+    from utils.patch_upscale_strategy import PatchUpscalingStrategy
+
+    try:
+        generator, _ = setup_worker(settings, cores, threads, export_config, cache, generator)
+    except Exception as e:
+        results.put(("init failed", worker_id, None, None, repr(e)))
+        return
+    strategy = PatchUpscalingStrategy()
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        batch_id, start, end, tiles, output = task
+        try:
+            tiles_block, tiles = attach_array(tiles)
+            output_block, output = attach_array(output)
+            try:
+                with torch.inference_mode():
+                    upscaled = strategy.run_local_generator(tiles[start:end], generator, export_config)
+                output[start:end] = upscaled.float().numpy()
+            finally:
+                # the blocks can only be closed once no array views them
+                del tiles, output
+                tiles_block.close()
+                output_block.close()
+            results.put(("done", worker_id, batch_id, start, None))
+        except Exception as e:
+            results.put(("failed", worker_id, batch_id, start, repr(e)))
+
+
+class TileWorkers:
+    """
+    Spatial parallelism for upscaling single large images on the CPU.
+
+    Image-level workers don't help when an export is a single huge texture.
+    Instead, tile worker processes split the tile grid of each image: every batch
+    of tiles the patch upscaling strategy sends through the generator is placed in
+    shared memory, divided between the workers and upscaled into a shared output
+    buffer, from which the tiles are stitched as before. Each worker has its own
+    threads pinned to its own cores and eager Generators are loaded once and their
+    weights shared with the workers.
+
+    The tiles of a worker that fails, dies or doesn't finish its tiles within
+    ConfigReference.tile_batch_timeout seconds are upscaled by the export thread's
+    Generator, and a dead (or stuck, terminated) worker is restarted up to
+    ConfigReference.max_worker_restarts times per export.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        threads_per_worker: int,
+        export_config: dict,
+        cache: Tuple[List[str], List[str]],
+        generator: Optional[torch.nn.Module] = None,
+    ):
+        self.context = multiprocessing.get_context(confref.worker_start_method)
+        self.no_workers = max(1, int(workers))
+        cpu_count = os.cpu_count() or 1
+        self.threads = int(threads_per_worker) or max(1, cpu_count // self.no_workers)
+        self.export_config = export_config
+        self.cache = cache
+        self.scale = confref.scale_map[export_config["scale"]]
+        # a Generator whose weights are in shared memory, mapped by every worker
+        self.generator = generator
+        self.settings = export_settings()
+        self.cores = worker_cores(self.no_workers, self.threads)
+        self.results = self.context.Queue()
+        self.processes: Dict[int, multiprocessing.Process] = {}
+        self.tasks: Dict[int, multiprocessing.Queue] = {}
+        self.restarts = 0
+        # results are matched to the batch they were sent with, not just the worker
+        self.batch_id = 0
+        for worker_id in range(self.no_workers):
+            self.start_worker(worker_id)
+
+    def start_worker(self, worker_id: int) -> None:
+        # started before the workers so that they share it instead of starting their own
+        resource_tracker.ensure_running()
+        self.tasks[worker_id] = self.context.Queue()
+        self.processes[worker_id] = self.context.Process(
+            target=tile_worker_main,
+            args=(
+                worker_id,
+                self.settings,
+                self.cores[worker_id],
+                self.threads,
+                self.export_config,
+                self.cache,
+                self.generator,
+                self.tasks[worker_id],
+                self.results,
+            ),
+            name=f"tile-worker-{worker_id}",
+            daemon=True,
+        )
+        self.processes[worker_id].start()
+
+    def retire_worker(self, worker_id: int) -> None:
+        process = self.processes.pop(worker_id)
+        if process.is_alive():
+            process.terminate()
+        process.join()
+        self.tasks.pop(worker_id).close()
+
+    def upscale(
+        self, tiles: np.ndarray, run_locally: Callable[[np.ndarray], torch.Tensor]
+    ) -> torch.Tensor:
+        """
+        Upscales a batch of tiles of shape (n, h, w, c) with the workers and returns
+        them as a tensor of shape (n, c, h, w). run_locally upscales the tiles the
+        workers couldn't.
+        """
+        if not self.processes:
+            return run_locally(tiles)
+        n, h, w, c = tiles.shape
+        tiles_block, tiles_descriptor = share_array(np.ascontiguousarray(tiles))
+        shape = (n, c, int(h * self.scale), int(w * self.scale))
+        output_block = shared_memory.SharedMemory(
+            create=True, size=max(int(np.prod(shape)) * 4, 1)
+        )
+        output = np.ndarray(shape, dtype=np.float32, buffer=output_block.buf)
+        output_descriptor: SharedArray = (output_block.name, shape, "float32")
+        self.batch_id += 1
+        batch_id = self.batch_id
+        try:
+            # tiles share a size, so each worker gets an equal range of the batch
+            chunk = math.ceil(n / len(self.processes))
+            pending: Dict[int, Tuple[int, int]] = {}  # start: (worker, end)
+            for worker_id, start in zip(list(self.processes), range(0, n, chunk)):
+                end = min(start + chunk, n)
+                pending[start] = (worker_id, end)
+                self.tasks[worker_id].put((batch_id, start, end, tiles_descriptor, output_descriptor))
+            deadline = time.monotonic() + confref.tile_batch_timeout
+
+            def run_pending_locally(start: int) -> None:
+                _, end = pending.pop(start)
+                output[start:end] = run_locally(tiles[start:end]).float().numpy()
+
+            def replace_worker(worker_id: int, restart: bool) -> None:
+                self.retire_worker(worker_id)
+                for start in [s for s, (w, _) in pending.items() if w == worker_id]:
+                    run_pending_locally(start)
+                if restart and self.restarts < confref.max_worker_restarts:
+                    self.restarts += 1
+                    self.start_worker(worker_id)
+
+            while pending:
+                if time.monotonic() > deadline:
+                    for worker_id in sorted({w for w, _ in pending.values()}):
+                        write_log_to_file(
+                            "ERROR",
+                            f"Tile worker {worker_id} didn't upscale its tiles within {confref.tile_batch_timeout} seconds, upscaling them in the export thread.",
+                        )
+                        replace_worker(worker_id, restart=True)
+                    break
+                try:
+                    status, worker_id, result_batch_id, start, error = self.results.get(
+                        timeout=confref.worker_poll_interval
+                    )
+                except queue.Empty:
+                    for worker_id, process in list(self.processes.items()):
+                        if process.is_alive():
+                            continue
+                        write_log_to_file(
+                            "ERROR",
+                            f"Tile worker {worker_id} exited with code {process.exitcode}, upscaling its tiles in the export thread.",
+                        )
+                        replace_worker(worker_id, restart=True)
+                    continue
+                if status == "init failed":
+                    if worker_id in self.processes:
+                        write_log_to_file(
+                            "ERROR", f"Tile worker {worker_id} could not start: {error}"
+                        )
+                        replace_worker(worker_id, restart=False)
+                    continue
+                if result_batch_id != batch_id or pending.get(start, (None,))[0] != worker_id:
+                    continue  # tiles of an earlier batch, already upscaled in the export thread
+                if status == "done":
+                    pending.pop(start)
+                else:
+                    write_log_to_file(
+                        "ERROR",
+                        f"Tile worker {worker_id} could not upscale its tiles, upscaling them in the export thread: {error}",
+                    )
+                    run_pending_locally(start)
+            return torch.from_numpy(output.copy())
+        finally:
+            del output
+            release_block(tiles_block)
+            release_block(output_block)
+
+    def close(self) -> None:
+        for worker_id in list(self.processes):
+            self.tasks[worker_id].put(None)
+        deadline = time.monotonic() + confref.worker_join_timeout
+        for worker_id in list(self.processes):
+            self.processes[worker_id].join(max(0.0, deadline - time.monotonic()))
+            self.retire_worker(worker_id)
+        self.results.close()
+        write_log_to_file(
+            "INFO",
+            f"Upscaled tiles with {self.no_workers} tile worker processes of {self.threads} threads each"
+            f" ({self.restarts} restarted).",
+        )
@@ -1,6 +1,8 @@
+import re
 from app_config.config import *
 from utils import *
 from utils.logger import write_log_to_file
+from utils.image_statistics import ImageStatistics
 
 class ImageContainerInterface:
     def __init__():
@@ -64,12 +66,39 @@ class ImageContainer:
             "suffix": kwargs.get("suffix", ""),
         }
         self.alpha_0: bool = False
+        # gathered once from the source image and reused by every routing decision
+        self.statistics: Optional[ImageStatistics] = None
         self.setup_dtype_mapping()
+        # single channel planes (greyscale color channels and alpha channels) are kept
+        # as single channels and upscaled three per forward pass when packing is enabled
+        self.pack_single_channels: bool = kwargs.get("pack_single_channels", False)
+        self.packed_channels: List[str] = []
+        # color under fully transparent alpha is upscaled bilinearly instead of with the generator
+        self.skip_transparent_tiles: bool = kwargs.get("skip_transparent_tiles", False)
+        self.transparent_mask: Optional[np.ndarray] = None
+        # binary (cutout) alpha channels are upscaled with an edge-aware threshold instead of the generator
+        self.binary_alpha_upscale: bool = kwargs.get("binary_alpha_upscale", False)
+        # tangent-space normal maps: only X and Y are upscaled and Z is rebuilt from them
+        self.normal_map_mode: str = kwargs.get("normal_map_mode", "off")
+        self.renormalize_normals: bool = kwargs.get("renormalize_normals", False)
+        self.normal_map: bool = False
+        self.normal_planes: Dict[str, torch.Tensor] = {}
 
         self.alpha: Optional[Union[torch.Tensor, np.ndarray]] = None
         self.color_channels: Optional[Union[torch.Tensor, np.ndarray]] = None
-        self.read_and_preprocess_image()
+        # images decoded by another process are handed over instead of read again
+        self.read_and_preprocess_image(kwargs.get("decoded_image", None))
     
+    def __getstate__(self) -> dict:
+        # the dtype mapping holds lambdas, which can't be pickled, and is rebuilt when unpickled
+        state = self.__dict__.copy()
+        state.pop("output_dtype_mapping", None)
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.setup_dtype_mapping()
+
     def optimize_concat(self, channels):
     # Check if concatenation is necessary
         if len(channels) == 1:
@@ -80,13 +109,17 @@ class ImageContainer:
         # Concatenate if necessary
         return np.concatenate(channels, axis=-1)
 
-    def read_and_preprocess_image(self) -> None:
-        src_path = os.path.join(self.src_path, self.src_image_name)
-        if self.src_format in confref.opencv_formats:
-            self.image = cv2.imread(src_path, cv2.IMREAD_UNCHANGED)
-        else:
-            self.image = Image.open(src_path)
-            self.image = np.array(self.image)
+    @staticmethod
+    def decode(src_path: str) -> np.ndarray:
+        """Reads an image file into an array."""
+        if src_path[-3:] in confref.opencv_formats:
+            return cv2.imread(src_path, cv2.IMREAD_UNCHANGED)
+        return np.array(Image.open(src_path))
+
+    def read_and_preprocess_image(self, decoded_image: Optional[np.ndarray] = None) -> None:
+        if decoded_image is None:
+            decoded_image = self.decode(os.path.join(self.src_path, self.src_image_name))
+        self.image = decoded_image
         # extract datatype for future use
         self.src_dtype: str = str(self.image.dtype)
         self.mode: Optional[str] = self.get_mode_from_array()
@@ -136,23 +169,32 @@ class ImageContainer:
             if self.mode == "L":
                 self.noisy_copy = np.expand_dims(self.noisy_copy, 2)
 
+    def get_statistics(self) -> ImageStatistics:
+        """Statistics of the source image, gathered in a single pass on first use."""
+        if self.statistics is None:
+            self.statistics = ImageStatistics(self.image, "A" in self.mode)
+        return self.statistics
+
     def check_all_values_equivalent(self):
-        if self.image.max() == self.image.min():
+        statistics = self.get_statistics()
+        if statistics.constant:
             write_log_to_file(
                 "WARNING",
                 f"Using linear scaling to scale image {self.src_image_name}'s channels.",
             )
-            self.determine_if_alpha_is_0()
+            self.determine_if_alpha_is_0(statistics)
             self.image = self.upscale_linear(
                 self.image,
                 self.upscale_factor,
-                self.image.max(),
+                statistics.max,
                 self.upscale_precision,
             )
             self.linear_upscale_all_channels = True
             self.proceed_with_split = False
         else:
             self.linear_upscale_all_channels = False
+            if statistics.rgb_equivalent:
+                self.collapse_greyscale_rgb(statistics)
             if (
                 "A" in self.mode
             ):  # split channels to process by either the generator or through linear upscaling
@@ -167,6 +209,32 @@ class ImageContainer:
             self.preprocess_noisy_image()
         return self
 
+    def collapse_greyscale_rgb(self, statistics: ImageStatistics) -> Self:
+        """
+        Reduces greyscale images stored as RGB(A) to L(A) so that they take the
+        single channel path. They are expanded back to the export color mode only
+        when they are written.
+        """
+        write_log_to_file(
+            "INFO",
+            f"Processing image {self.src_image_name} as greyscale since its R, G and B channels are equal.",
+        )
+        if statistics.rgb_equal:
+            grey = self.image[:, :, 0]
+        else:
+            grey = self.image[:, :, :3].mean(axis=2)
+            if self.image.dtype in [np.uint8, np.uint16]:
+                grey = np.rint(grey)
+            grey = grey.astype(self.image.dtype)
+        if self.mode == "RGBA":
+            self.image = np.stack((grey, self.image[:, :, 3]), axis=2)
+            self.mode = "LA"
+        else:
+            self.image = np.ascontiguousarray(grey)
+            self.mode = "L"
+        self.length = len(self.mode)
+        return self
+
     def split_image(self) -> Self:
         """
         Separates alpha from color channels creating two new members to represent the original image object.
@@ -179,12 +247,17 @@ class ImageContainer:
             False,  # will handle separately
         )
         if self.proceed_with_split:
+            statistics = self.get_statistics()
             # extract alpha information
             self.alpha = (
                 self.image[:, :, self.length - 1 :]
                 if ("A" in self.mode and "A" in self.export_mode)
                 else None
             )
+            if self.skip_transparent_tiles and type(self.alpha) == np.ndarray:
+                self.transparent_mask = self.find_transparent_regions(
+                    self.alpha, statistics
+                )
             self.upscale_alpha_with_generator = (
                 True
                 if (
@@ -196,9 +269,9 @@ class ImageContainer:
             )
             if self.upscale_alpha_with_generator:
                 # ensure image channels and elements vary (masks in CG textures can exhibit such qualities)
-                alpha_max, alpha_min = self.alpha.max(), self.alpha.min()
+                alpha_max, alpha_min = statistics.alpha_max, statistics.alpha_min
                 # if the entire alpha channel is a single value, conduct a linear upscale
-                if alpha_max == alpha_min:
+                if statistics.alpha_constant:
                     write_log_to_file(
                         "WARNING",
                         f"Using linear scaling to scale image {self.src_image_name}'s alpha channel.",
@@ -211,6 +284,21 @@ class ImageContainer:
                     )
                     self.upscale_alpha_with_generator = False
 
+                elif (
+                    self.binary_alpha_upscale
+                    and self.upscale_factor in [2, 4]
+                    and statistics.alpha_binary
+                ):
+                    write_log_to_file(
+                        "INFO",
+                        f"Using edge-aware scaling to scale image {self.src_image_name}'s binary alpha channel.",
+                    )
+                    self.alpha = self.upscale_binary_alpha(
+                        self.alpha, self.upscale_factor, alpha_min, alpha_max
+                    )
+                    self.upscale_alpha_with_generator = False
+                elif self.pack_single_channels and self.upscale_factor in [2, 4]:
+                    self.packed_channels.append("alpha")
                 else:  # prepare alpha channel to be fed to the Generator
                     self.alpha = (
                         np.repeat(self.alpha, repeats=3, axis=2)
@@ -230,8 +318,8 @@ class ImageContainer:
                 )  # grayscale with 2 dimensions expanded to 3
 
             # ensure channels image channels and elements vary (masks in CG textures can exhibit such qualities)
-            color_max, color_min = self.color_channels.max(), self.color_channels.min()
-            if color_max == color_min:
+            color_max = statistics.color_max
+            if statistics.color_constant:
                 write_log_to_file(
                     "WARNING",
                     f"Using linear scaling to scale image {self.src_image_name}'s color channel(s).",
@@ -246,12 +334,33 @@ class ImageContainer:
             else:
                 # the the color channels are to be fed to the generator, ensure the grayscale image
                 # is expanded into 3 channels
-                if self.mode == "L":  # i.e. either grayscale or grayscale+alpha
+                if (
+                    self.mode in ["L", "LA"]
+                    and self.upscale_color_with_generator
+                    and self.pack_single_channels
+                    and self.upscale_factor in [2, 4]
+                ):
+                    self.packed_channels.append("color")
+                elif (
+                    self.mode in ["RGB", "RGBA"]
+                    and self.upscale_color_with_generator
+                    and self.upscale_factor in [2, 4]
+                    and self.is_normal_map()
+                ):
+                    write_log_to_file(
+                        "INFO",
+                        f"Upscaling the X and Y channels of normal map {self.src_image_name} and rebuilding Z.",
+                    )
+                    self.normal_map = True
+                    x, y, _ = self.normal_channel_indices()
+                    self.color_channels = self.color_channels[:, :, [x, y]]
+                    self.packed_channels += ["normal_x", "normal_y"]
+                elif self.mode == "L":  # i.e. either grayscale or grayscale+alpha
                     self.color_channels = np.repeat(
                         np.expand_dims(self.image, 2), repeats=3, axis=2
                     )
                 elif self.mode == "LA":  # i.e. either grayscale or grayscale+alpha
-                    self.color_channels = np.repeat(self.image, repeats=3, axis=2)
+                    self.color_channels = np.repeat(self.color_channels, repeats=3, axis=2)
         else:
             if not "L" in self.mode:
                 self.alpha = None
@@ -260,6 +369,164 @@ class ImageContainer:
         self.image = None
         return self
 
+    def upscale_binary_alpha(
+        self,
+        alpha: np.ndarray,
+        factor: int,
+        alpha_min: float,
+        alpha_max: float,
+    ) -> np.ndarray:
+        """
+        Upscales a binary alpha channel (h, w, 1) by interpolating it bilinearly,
+        blurring the result to smooth the staircase of the edges and thresholding
+        it back to its two levels. Like the generator's output, the upscaled alpha
+        is normalized between 0 and 1.
+        """
+        h, w = alpha.shape[:2]
+        levels = (alpha[:, :, 0].astype(np.float32) - alpha_min) / (alpha_max - alpha_min)
+        upscaled = cv2.resize(
+            levels, (int(w * factor), int(h * factor)), interpolation=cv2.INTER_LINEAR
+        )
+        upscaled = cv2.GaussianBlur(upscaled, (0, 0), sigmaX=factor / 2)
+        low, high = np.array([alpha_min, alpha_max], dtype=alpha.dtype)
+        if alpha.dtype in [np.uint8, np.uint16]:
+            low, high = self.normalize_uint(np.array([low, high]))
+        return np.expand_dims(np.where(upscaled >= 0.5, high, low), 2).astype(
+            self.upscale_precision[0]
+        )
+
+    def find_transparent_regions(
+        self, alpha: np.ndarray, statistics: ImageStatistics
+    ) -> Optional[np.ndarray]:
+        """
+        Returns a mask (h, w, 1) of the pixels whose alpha is 0 and that are further
+        than ConfigReference.transparent_dilation pixels from any visible pixel, so that
+        filtering the color near visible pixels still sees the generator's output.
+        Returns None if no such pixel exists or, unless tile triage is enabled, if
+        fewer than ConfigReference.transparent_tiles_threshold of the triage tiles
+        are fully transparent.
+        """
+        threshold = 0.0 if ExportConfig.tile_triage else confref.transparent_tiles_threshold
+        if statistics.alpha_coverage == 1.0 or 1 - statistics.alpha_coverage < threshold:
+            return None  # no (or too few) transparent pixels
+        margin = confref.transparent_dilation
+        visible = cv2.dilate(
+            (alpha[:, :, 0] != 0).astype(np.uint8),
+            np.ones((2 * margin + 1, 2 * margin + 1), dtype=np.uint8),
+        )
+        transparent = visible == 0
+        if not transparent.any():
+            return None
+        # fraction of the whole triage tiles (aligned to the top left) that are transparent
+        tile = min(confref.triage_tile_size, *transparent.shape)
+        rows, cols = transparent.shape[0] // tile, transparent.shape[1] // tile
+        tiles = transparent[: rows * tile, : cols * tile].reshape(rows, tile, cols, tile)
+        if tiles.all(axis=(1, 3)).mean() < threshold:
+            return None
+        return np.expand_dims(transparent, 2)
+
+    def is_normal_map(self) -> bool:
+        """
+        Whether the color channels hold a tangent-space normal map. With the "auto"
+        normal map mode, an image is a normal map if its name ends with one of
+        ConfigReference.normal_map_name_filters (i.e. brick_nrm.png) or if most of
+        its (sampled) pixels decode to unit vectors pointing away from the surface.
+        """
+        if self.normal_map_mode == "all":
+            return True
+        if self.normal_map_mode != "auto":
+            return False
+        name_parts = re.split(r"[_\-. ]", os.path.splitext(self.src_image_name)[0].lower())
+        if len(name_parts) > 1 and name_parts[-1] in confref.normal_map_name_filters:
+            return True
+        step = max(1, int(math.sqrt(self.color_channels.shape[0] * self.color_channels.shape[1] / 65536)))
+        sample = self.color_channels[::step, ::step]
+        if sample.dtype in [np.uint8, np.uint16]:
+            sample = self.normalize_uint(sample)
+        sample = sample.astype(np.float32)
+        x, y, z = self.normal_channel_indices()
+        normals = sample[:, :, [x, y, z]] * 2 - 1
+        length = np.linalg.norm(normals, axis=2)
+        unit = (np.abs(length - 1) < confref.normal_map_length_tolerance) & (normals[:, :, 2] > 0)
+        return unit.mean() > confref.normal_map_min_coverage
+
+    def normal_channel_indices(self) -> Tuple[int, int, int]:
+        """Indices of the X, Y and Z channels; opencv reads images as BGR."""
+        return (2, 1, 0) if self.src_format in confref.opencv_formats else (0, 1, 2)
+
+    def get_packed_plane(self, channel_type: str) -> np.ndarray:
+        """Returns the single channel plane (h, w, 1) held for packing."""
+        if channel_type == "color":
+            return self.color_channels
+        if channel_type == "alpha":
+            return self.alpha
+        return self.color_channels[:, :, ["normal_x", "normal_y"].index(channel_type)][:, :, None]
+
+    def is_packed(self, channel_type: str) -> bool:
+        """Whether the color or alpha channel is upscaled as packed planes."""
+        return any(
+            packed == channel_type or (channel_type == "color" and packed.startswith("normal"))
+            for packed in self.packed_channels
+        )
+
+    def expand_packed_channels(self) -> Self:
+        """
+        Expands the single channel planes held for packing into 3 channels so that
+        they can be upscaled on their own like any other channel. Normal maps get
+        their Z channel back.
+        """
+        if self.is_packed("color"):
+            if self.normal_map:
+                self.color_channels = self.rebuild_normal_z(
+                    torch.from_numpy(self.color_channels[:, :, :1]).permute(2, 0, 1),
+                    torch.from_numpy(self.color_channels[:, :, 1:]).permute(2, 0, 1),
+                ).permute(1, 2, 0).numpy()
+                self.normal_map = False
+            else:
+                self.color_channels = np.repeat(self.color_channels, repeats=3, axis=2)
+        if self.is_packed("alpha"):
+            self.alpha = np.repeat(self.alpha, repeats=3, axis=2)
+        self.packed_channels = []
+        return self
+
+    def set_packed_output(self, channel_type: str, plane: torch.Tensor) -> Self:
+        """
+        Sets a channel from its upscaled plane of shape (1, h, w). Greyscale color
+        channels stay single channel until they are written and normal maps are
+        rebuilt once both their X and Y are upscaled.
+        """
+        if channel_type == "color":
+            self.color_channels = plane
+        elif channel_type == "alpha":
+            self.alpha = plane
+        else:
+            self.normal_planes[channel_type] = plane
+            if len(self.normal_planes) == 2:
+                self.color_channels = self.rebuild_normal_z(
+                    self.normal_planes.pop("normal_x"), self.normal_planes.pop("normal_y")
+                )
+        return self
+
+    def rebuild_normal_z(self, x: torch.Tensor, y: torch.Tensor) -> torch.Tensor:
+        """
+        Rebuilds the Z channel of a normal map from its X and Y channels (1, h, w),
+        encoded between 0 and 1, as sqrt(1 - x^2 - y^2) and returns the channels
+        (3, h, w) in the image's channel order. With renormalize_normals, X and Y
+        are first scaled back onto the unit circle where they overshoot it.
+        """
+        dtype = x.dtype
+        normal_x, normal_y = x.float() * 2 - 1, y.float() * 2 - 1
+        if self.renormalize_normals:
+            length = torch.sqrt(normal_x**2 + normal_y**2).clamp(min=1.0)
+            normal_x, normal_y = normal_x / length, normal_y / length
+        normal_z = torch.sqrt((1 - normal_x**2 - normal_y**2).clamp(min=0.0))
+        channels = {}
+        for index, channel in zip(
+            self.normal_channel_indices(), [normal_x, normal_y, normal_z]
+        ):
+            channels[index] = ((channel + 1) / 2).clamp(0.0, 1.0)
+        return torch.cat([channels[i] for i in range(3)], dim=0).to(dtype)
+
     def convert_datatype(self, input: bool = True) -> Self:
         """
         Converts uint8/uint16/float32 to float16/float32 types to be process by the generator.
@@ -328,7 +595,7 @@ class ImageContainer:
                     else self.color_channels.unsqueeze(dim=2)
                 )
 
-            if self.upscale_alpha_with_generator:
+            if self.upscale_alpha_with_generator and not self.is_packed("alpha"):
                 if not type(self.alpha) == type(None):
                     alpha_dims = len(self.alpha.shape)
 
@@ -352,6 +619,13 @@ class ImageContainer:
             if self.upscale_color_with_generator:
                 if confref.split_color and t_color == torch.Tensor:
                     self.color_channels = self.color_channels.permute(2, 0, 1)
+                if self.mode in ["L", "LA"] and self.color_channels.shape[0] == 3:
+                    # greyscale images are kept single channel until they are written
+                    self.color_channels = (
+                        self.color_channels[0:1] * (0.2989)
+                        + self.color_channels[1:2] * (0.5870)
+                        + self.color_channels[2:3] * (0.1140)
+                    )
             else:
                 if t_color == np.ndarray:
                     temp, self.color_channels = (
@@ -491,6 +765,20 @@ class ImageContainer:
         Convert (scale) the upscaled image to the proper export datatype as
         indicated in the app_config.ConfigReference class.
         """
+        # out of core, the image is converted in bands of rows so that only the
+        # export datatype image and one band of intermediate arrays are held in memory
+        band_rows = max(1, confref.out_of_core_band_pixels // max(1, channels.shape[1]))
+        if ExportConfig.out_of_core and channels.ndim == 3 and channels.shape[0] > band_rows:
+            output = None
+            for start in range(0, channels.shape[0], band_rows):
+                band = self.convert_output_image_dtype(
+                    channels[start : start + band_rows], input_dtype, out_dtype
+                )
+                if output is None:
+                    output = np.empty((channels.shape[0], *band.shape[1:]), dtype=band.dtype)
+                output[start : start + len(band)] = band
+            return output
+
         # unlike for the PNG format, the IMWRITE function requires float arrays and exports half or float precision based on the cv2.IMWRITE flag speficier when saving the image
         trg_dtype = (
             self.trg_image_dtype if not self.export_format == "exr" else "float32"
@@ -636,11 +924,11 @@ class ImageContainer:
                     else channels[..., :]
                 )
             else:  # write in RGB
-                temp = np.repeat(channels[:, :, 0], 3)
+                temp = np.repeat(channels[:, :, :1], 3, 2)
                 channels = (
                     temp
                     if not "A" in self.export_mode
-                    else np.concat((temp, channels[1]), 2)
+                    else np.concatenate((temp, channels[:, :, 1:]), 2)
                 )
         elif no_channels == 3:  # RGB
             if "L" in self.export_mode:  # write in greyscale
@@ -772,13 +1060,14 @@ class ImageContainer:
         else:
             img.options["dds:mipmaps"] = "0"
 
-    def determine_if_alpha_is_0(self) -> None:
+    def determine_if_alpha_is_0(
+        self, statistics: Optional[ImageStatistics] = None
+    ) -> None:
         # TODO: automatic not working consistently
         if ("A" in self.mode) and (self.compression == "automatic"):
-            max_, min_ = (
-                self.image.transpose(2, 0, 1)[-1].max(),
-                self.image.transpose(2, 0, 1)[-1].min(),
-            )
+            # the image written out isn't the source image, so only its alpha is scanned
+            statistics = statistics or ImageStatistics(self.image[..., -1:], True)
+            max_, min_ = statistics.alpha_max, statistics.alpha_min
             self.alpha_0 = True if max_ == min_ == 255 else False
         elif not "A" in self.mode:
             self.alpha_0 = True
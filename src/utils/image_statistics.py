@@ -0,0 +1,101 @@
+from typing import Optional
+import numpy as np
+from app_config.config import ConfigReference as confref
+
+
+class ImageStatistics:
+    """
+    Statistics of an image (h, w) or (h, w, c) gathered in a single pass over
+    chunks of its rows: per-channel min/max, whether the image or its color and
+    alpha channels are constant, whether the color channels are greyscale stored
+    as RGB (R == G == B within ConfigReference.greyscale_rgb_tolerance), the
+    share of pixels with non-zero alpha and whether the alpha channel is binary.
+    The alpha channel, if any, is the last channel.
+    """
+
+    def __init__(self, image: np.ndarray, has_alpha: bool):
+        channels = image.reshape(image.shape[0], image.shape[1], -1)
+        height, width, no_channels = channels.shape
+        self.has_alpha: bool = has_alpha and no_channels > 0
+        self.no_color_channels: int = no_channels - 1 if self.has_alpha else no_channels
+        self.pixels: int = height * width
+
+        rows = max(1, confref.statistics_chunk_pixels // max(width, 1))
+        mins, maxs = [], []
+        rgb_equivalent = self.no_color_channels == 3
+        rgb_tolerance = confref.greyscale_rgb_tolerance * (
+            np.iinfo(channels.dtype).max if channels.dtype in [np.uint8, np.uint16] else 1.0
+        )
+        self.rgb_max_difference = 0
+        alpha_histogram = None
+        alpha_nonzero = 0
+        for start in range(0, height, rows):
+            chunk = channels[start : start + rows]
+            mins.append(chunk.min(axis=(0, 1)))
+            maxs.append(chunk.max(axis=(0, 1)))
+            if rgb_equivalent:
+                color = chunk[:, :, :3]
+                self.rgb_max_difference = max(
+                    self.rgb_max_difference,
+                    (color.max(axis=2) - color.min(axis=2)).max(initial=0),
+                )
+                rgb_equivalent = self.rgb_max_difference <= rgb_tolerance
+            if self.has_alpha:
+                alpha = chunk[:, :, -1]
+                alpha_nonzero += np.count_nonzero(alpha)
+                histogram = np.bincount(
+                    self.alpha_levels(alpha).ravel(), minlength=self.no_alpha_levels(alpha)
+                )
+                alpha_histogram = (
+                    histogram if alpha_histogram is None else alpha_histogram + histogram
+                )
+
+        self.channel_min: np.ndarray = np.min(mins, axis=0).astype(channels.dtype)
+        self.channel_max: np.ndarray = np.max(maxs, axis=0).astype(channels.dtype)
+        self.min = self.channel_min.min()
+        self.max = self.channel_max.max()
+        self.constant: bool = bool(self.min == self.max)
+        self.rgb_equivalent: bool = bool(rgb_equivalent)
+        self.rgb_equal: bool = self.rgb_equivalent and self.rgb_max_difference == 0
+
+        color_min = self.channel_min[: self.no_color_channels]
+        color_max = self.channel_max[: self.no_color_channels]
+        self.color_min = color_min.min() if self.no_color_channels else None
+        self.color_max = color_max.max() if self.no_color_channels else None
+        self.color_constant: bool = bool(self.color_min == self.color_max)
+
+        self.alpha_min = self.channel_min[-1] if self.has_alpha else None
+        self.alpha_max = self.channel_max[-1] if self.has_alpha else None
+        self.alpha_constant: bool = bool(self.has_alpha and self.alpha_min == self.alpha_max)
+        self.alpha_coverage: Optional[float] = (
+            alpha_nonzero / self.pixels if self.has_alpha and self.pixels else None
+        )
+        self.alpha_binary: bool = self.has_alpha and self.is_binary_alpha(
+            alpha_histogram, channels.dtype
+        )
+
+    @staticmethod
+    def no_alpha_levels(alpha: np.ndarray) -> int:
+        return {np.dtype("uint8"): 256, np.dtype("uint16"): 65536}.get(alpha.dtype, 1024)
+
+    @staticmethod
+    def alpha_levels(alpha: np.ndarray) -> np.ndarray:
+        """Integer alphas are their own levels, float alphas are quantized to 1024 levels."""
+        if alpha.dtype in [np.uint8, np.uint16]:
+            return alpha
+        return np.rint(np.clip(alpha, 0.0, 1.0) * 1023).astype(np.int64)
+
+    def is_binary_alpha(self, histogram: np.ndarray, dtype: np.dtype) -> bool:
+        """
+        Whether the alpha channel only holds two levels (i.e. 0 and 255 for cutouts),
+        allowing for ConfigReference.binary_alpha_tolerance of its pixels to fall
+        in between (i.e. antialiased edges).
+        """
+        if self.alpha_constant:
+            return False
+        values = np.arange(len(histogram), dtype=np.float64)
+        if dtype not in [np.uint8, np.uint16]:
+            values /= len(histogram) - 1
+        levels = (values - float(self.alpha_min)) / (float(self.alpha_max) - float(self.alpha_min))
+        in_between = histogram[(levels > 0.02) & (levels < 0.98)].sum()
+        return in_between <= confref.binary_alpha_tolerance * self.pixels
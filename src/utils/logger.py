@@ -1,3 +1,4 @@
+import threading
 from datetime import date, datetime
 from pathlib import Path
 from utils import *
@@ -44,8 +45,10 @@ class Logger:
 
 # Usage example:
 logger = Logger()
+# the export pipeline logs from several threads that share the log file
+log_lock = threading.Lock()
 
 
 def write_log_to_file(log_type: str, message: str):
-    with logger:
+    with log_lock, logger:
         logger.log(log_type, message)
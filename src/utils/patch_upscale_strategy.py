@@ -1,12 +1,26 @@
 from abc import ABC, abstractmethod
-from typing import Tuple
+from typing import TYPE_CHECKING, Dict, Hashable, Iterator, List, Optional, Tuple, Union
+import itertools
 import math
+import os
+import tempfile
+import cv2
 import numpy as np
 import torch
 from app_config.config import ConfigReference as confref
 from utils import ExportConfig, Image
+from utils.logger import write_log_to_file
+from caches.tile_cache import tile_cache
 from model.model import Generator
-from model.utils import stitch_together, pad_reflect, split_image_into_overlapping_patches
+from model.utils import (
+    OverlappingPatchBands,
+    TileStitcher,
+    pad_reflect,
+    split_image_into_overlapping_patches,
+)
+
+if TYPE_CHECKING:
+    from utils.export_workers import TileWorkers
 
 # from utils.export_utils import Generator, confref, handle_image_split
 
@@ -75,6 +89,16 @@ class PatchUpscalingStrategy(UpscalingStrategy):
         torch.Tensor
             The upscaled full image as a torch tensor.
     """
+    # number of tiles that took each route of the tile triage during an export
+    triage_counts: Dict[str, int] = {
+        "constant": 0,
+        "low detail": 0,
+        "generator": 0,
+        "transparent": 0,
+    }
+    # tile worker processes that split the tiles of each batch during a cpu export
+    tile_workers: Optional["TileWorkers"] = None
+
     def handle_padding_size(self, size: int) -> int:
         """
         Determines the padding size for image splitting
@@ -87,10 +111,34 @@ class PatchUpscalingStrategy(UpscalingStrategy):
         pad_size = int(pad_size) if pad_size % 2 == 0 else int(pad_size + 1)
         return pad_size
 
-    def handle_image_split(self, channel_type: str = "color", scale: float = 0.5, img: np.ndarray | None = None) -> Tuple[np.ndarray, int]:
+    def max_split_size(self, export_config: dict) -> int:
+        """
+        Returns the largest number of output pixels upscaled at once. On the GPU it is
+        set by the split size. On the CPU it is derived from the memory budget
+        (ExportConfig.max_memory_gb) and the measured memory the generator needs per
+        upscaled pixel at the chosen precision. The budget is split between the tile
+        workers, which each upscale their own patches at once.
+        """
+        if export_config and export_config["device"] == "cpu":
+            bytes_per_pixel = confref.ram_per_output_pixel.get(
+                export_config["upscale_precision"], confref.ram_per_output_pixel["high"]
+            )
+            budget = float(ExportConfig.max_memory_gb) * 1024**3 / self.no_tile_workers()
+            return int(budget / bytes_per_pixel)
+        return confref.split_sizes[ExportConfig.patch_size][1]
+
+    @staticmethod
+    def no_tile_workers() -> int:
+        return (
+            PatchUpscalingStrategy.tile_workers.no_workers
+            if PatchUpscalingStrategy.tile_workers is not None
+            else 1
+        )
+
+    def handle_image_split(self, channel_type: str = "color", scale: float = 0.5, img: np.ndarray | None = None, export_config: dict | None = None) -> Tuple[np.ndarray, int]:
         """
         Determines if the image is to be split and processed in patches based on:
-            1. the maximum available vram
+            1. the maximum available vram (or the memory budget on the cpu)
             2. the split_large_image flag
             3. the padding size
         Returns an array of shape (num of patches, c, h,w)
@@ -107,7 +155,7 @@ class PatchUpscalingStrategy(UpscalingStrategy):
         # required for other images is:
         # w x h x scale x (vram for 512x512 image) x (pixel count of 512x512 image)
 
-        max_size_to_split = confref.split_sizes[ExportConfig.patch_size][1] #4096*4096 # assuming 10xx + cards have 4.0 GB of available VRAM, a 2048 x 2048 image should fit; further 2x multiples of these dimensions don't
+        max_size_to_split = self.max_split_size(export_config) #4096*4096 # assuming 10xx + cards have 4.0 GB of available VRAM, a 2048 x 2048 image should fit; further 2x multiples of these dimensions don't
         split = True if size[0]*size[1]*scale*scale > max_size_to_split else False
 
         if split:
@@ -118,27 +166,357 @@ class PatchUpscalingStrategy(UpscalingStrategy):
             if ExportConfig.split_large_image:
                 pad_size: int = self.handle_padding_size(size)
 
-                lr_image: np.ndarray = pad_reflect(
-                    img.color_channels if channel_type == "color" else img.alpha, pad_size
-                )
-                min_ = min(lr_image.shape[:2])
+                # the shorter side of the image once it is reflect padded
+                min_ = min(size[:2]) + 2 * pad_size
                 no_patches = 0
                 while True:  
                     no_patches += 1
                     patch_size = (min_ / no_patches) + pad_size * 2
-                    if (patch_size*scale)**2 <= max_size_to_split:
+                    # stop at 1 pixel patches if the memory budget is too small for any patch
+                    if (patch_size*scale)**2 <= max_size_to_split or no_patches >= min_:
                         patch_size = math.ceil(min_ / no_patches)
                         break
                 patch_size += (1 if not patch_size % 2 == 0 else 0)
 
-                patches, p_shape = split_image_into_overlapping_patches(
-                    lr_image, patch_size=patch_size, padding_size=pad_size
+                patches, p_shape = self.split_patches(
+                    img.color_channels if channel_type == "color" else img.alpha, patch_size, pad_size
                 )
                
                 return patches, p_shape, pad_size, size
         else:
             return (None,) * 4
         
+    def handle_triage_split(self, channel_type: str, scale: float, img: Image, export_config: dict) -> Tuple[np.ndarray, int]:
+        """
+        Splits an image of any size into tiles of ConfigReference.triage_tile_size
+        (or smaller if the device memory doesn't fit them) so that each tile can
+        be triaged. Returns the same values as handle_image_split.
+        """
+        image = img.color_channels if channel_type == "color" else img.alpha
+        size = image.shape
+        max_size_to_split = self.max_split_size(export_config)
+        patch_size = min(confref.triage_tile_size, *size[:2])
+        pad_size = max(1, min(confref.triage_pad_size, patch_size // 2))
+        while patch_size > 2 * pad_size and ((patch_size + 2 * pad_size) * scale) ** 2 > max_size_to_split:
+            patch_size = patch_size // 2
+        patch_size += 1 if not patch_size % 2 == 0 else 0
+        pad_size = max(1, min(pad_size, patch_size // 2))
+        if channel_type == "color":
+            confref.split_color = True
+        else:
+            confref.split_alpha = True
+        patches, p_shape = self.split_patches(image, patch_size, pad_size)
+        return patches, p_shape, pad_size, size
+
+    def split_patches(
+            self,
+            image: np.ndarray,
+            patch_size: int,
+            pad_size: int) -> Tuple[Union[np.ndarray, OverlappingPatchBands], Tuple[int]]:
+        """
+        Reflect pads an image by pad_size and splits it into overlapping patches.
+        Returns the patches and the shape of the padded image. In out-of-core mode
+        (ExportConfig.out_of_core), the patches are split lazily in bands of patch
+        rows of up to ConfigReference.out_of_core_band_pixels input pixels instead.
+        """
+        if ExportConfig.out_of_core:
+            bands = OverlappingPatchBands(
+                image, patch_size, pad_size, pad_size, confref.out_of_core_band_pixels
+            )
+            return bands, bands.padded_shape
+        return split_image_into_overlapping_patches(
+            pad_reflect(image, pad_size), patch_size=patch_size, padding_size=pad_size
+        )
+
+    def classify_patches(self, patches: np.ndarray, threshold: float) -> np.ndarray:
+        """
+        Returns the route of each patch of shape (num of patches, h, w, c):
+            0: constant, filled with its value,
+            1: low detail (the variance of every channel is below threshold), Lanczos upscaled,
+            2: upscaled with the generator.
+        """
+        flat = patches.reshape(len(patches), -1, patches.shape[-1])
+        constant = (flat.max(axis=1) == flat.min(axis=1)).all(axis=1)
+        low_detail = flat.var(axis=1, dtype=np.float32).max(axis=1) < threshold
+        return np.where(constant, 0, np.where(low_detail, 1, 2))
+
+    def split_transparent_mask(self, transparent_mask: np.ndarray, patches: np.ndarray, pad_size: int) -> np.ndarray:
+        """
+        Splits the transparent mask (h, w, 1) of an image like its color channels were
+        split in handle_triage_split and returns whether each patch is fully transparent.
+        """
+        mask_patches, _ = split_image_into_overlapping_patches(
+            pad_reflect(transparent_mask.astype(np.float32), pad_size),
+            patch_size=patches.shape[1] - 2 * pad_size,
+            padding_size=pad_size,
+        )
+        return mask_patches.reshape(len(mask_patches), -1).all(axis=1)
+
+    def iter_transparent_bands(
+            self,
+            transparent_mask: np.ndarray,
+            patches: OverlappingPatchBands,
+            pad_size: int) -> Iterator[np.ndarray]:
+        """
+        Splits the transparent mask (h, w, 1) of an image like its color channels were
+        split into patches bands and yields whether each patch of each band is fully
+        transparent.
+        """
+        mask_bands = OverlappingPatchBands(
+            transparent_mask,
+            patches.patch_size,
+            pad_size,
+            pad_size,
+            confref.out_of_core_band_pixels,
+        )
+        for mask_patches in mask_bands:
+            yield mask_patches.reshape(len(mask_patches), -1).all(axis=1)
+
+    def out_of_core_buffer(self, shape: Tuple[int], img: Image) -> torch.Tensor:
+        """
+        Returns a zeroed float32 image of shape (h, w, c) that is memory-mapped to a
+        temporary file in the export directory of the image, so that the stitched
+        image is paged out to disk rather than held in memory. The file is removed
+        once the image is released.
+        """
+        directory = getattr(img, "trg_path", None)
+        with tempfile.TemporaryFile(
+            prefix=".upscaling_",
+            dir=directory if directory and os.path.isdir(directory) else None,
+        ) as file:
+            buffer = np.memmap(file, dtype=np.float32, mode="w+", shape=tuple(int(s) for s in shape))
+        return torch.from_numpy(buffer)
+
+    def upscale_cheap_patch(self, patch: np.ndarray, route: int, scale: float, dtype: torch.dtype) -> torch.Tensor:
+        """
+        Upscales a constant (route 0), low detail (route 1) or fully transparent (route 3)
+        patch of shape (h, w, c) to (c, h, w).
+        """
+        h, w, c = patch.shape
+        if route == 0:
+            return torch.from_numpy(patch[0, 0].astype(np.float32)).to(dtype).view(c, 1, 1).repeat(1, int(h * scale), int(w * scale))
+        upscaled = cv2.resize(
+            patch.astype(np.float32),
+            (int(w * scale), int(h * scale)),
+            interpolation=cv2.INTER_LANCZOS4 if route == 1 else cv2.INTER_LINEAR,
+        ).reshape(int(h * scale), int(w * scale), c)
+        return torch.from_numpy(upscaled).permute(2, 0, 1).to(dtype)
+
+    def iter_triaged_patches(
+            self,
+            patches: np.ndarray,
+            generator: Generator,
+            export_config: dict,
+            scale: float,
+            transparent: np.ndarray | None = None) -> Iterator[torch.Tensor]:
+        """
+        Triages patches of shape (num of patches, h, w, c) and yields the upscaled
+        patches in their original order as tensors of shape (n, c, h, w). With tile
+        triage, constant patches are filled and low detail patches are Lanczos
+        upscaled. Patches that are fully transparent (transparent, one flag per patch)
+        are upscaled bilinearly. Only the remaining patches go through the generator,
+        in batches (see iter_routed_patches).
+        """
+        routes = (
+            self.classify_patches(patches, float(ExportConfig.triage_variance_threshold))
+            if ExportConfig.tile_triage
+            else np.full(len(patches), 2)
+        )
+        if transparent is not None:
+            routes = np.where(transparent & (routes != 0), 3, routes)
+        for route, name in enumerate(["constant", "low detail", "generator", "transparent"]):
+            PatchUpscalingStrategy.triage_counts[name] += int((routes == route).sum())
+        write_log_to_file(
+            "INFO",
+            f"Tile triage: {(routes == 0).sum()} constant, {(routes == 1).sum()} low detail, "
+            f"{(routes == 3).sum()} transparent and {(routes == 2).sum()} generator tiles out of {len(patches)}.",
+        )
+        batch_size = self.handle_tile_batch_size(patches, scale, export_config)
+        yield from self.iter_routed_patches(patches, routes, generator, export_config, scale, batch_size)
+
+    def iter_routed_patches(
+            self,
+            patches: np.ndarray,
+            routes: np.ndarray,
+            generator: Generator,
+            export_config: dict,
+            scale: float,
+            batch_size: int,
+            use_tile_cache: bool = True) -> Iterator[torch.Tensor]:
+        """
+        Upscales patches of shape (num of patches, h, w, c) along their routes (see
+        classify_patches, 3: bilinear) and yields the upscaled patches in their
+        original order as tensors of shape (n, c, h, w). Patches routed to the
+        generator are gathered into batches of batch_size for upscale_batch.
+        With the tile cache, they are looked up in it first and the patches that
+        miss are deduplicated. Generator batches are then padded to batch_size and
+        cached tiles are keyed by it, so that reused tiles are identical to the
+        tiles the generator outputs.
+        """
+        device = export_config["device"]
+        dtype = confref.upscale_precision_levels[device][export_config["upscale_precision"]][1]
+        memory_cap_gb = float(ExportConfig.tile_cache_memory_gb) if use_tile_cache else 0.0
+        context = (id(generator), device, export_config["upscale_precision"], batch_size)
+        upscaled: Dict[int, torch.Tensor] = {}
+        # key of each patch waiting for the generator: indices of the patches with that key
+        pending: Dict[Hashable, List[int]] = {}
+        next_index, misses = 0, 0
+        for i, route in enumerate(routes):
+            if route != 2:
+                upscaled[i] = self.upscale_cheap_patch(patches[i], route, scale, dtype)
+            elif not memory_cap_gb:
+                pending[i] = [i]
+            else:
+                key = tile_cache.key(patches[i], context)
+                cached = tile_cache.get(key) if key not in pending else None
+                if key in pending:
+                    pending[key].append(i)
+                elif cached is not None:
+                    upscaled[i] = cached
+                else:
+                    pending[key] = [i]
+                    misses += 1
+            # the patches after the pending ones wait for them, up to confref.max_waiting_tiles
+            if pending and (
+                len(pending) == batch_size
+                or i == len(routes) - 1
+                or len(upscaled) >= confref.max_waiting_tiles
+            ):
+                keys = list(pending)
+                outputs = self.upscale_batch(
+                    patches[[pending[key][0] for key in keys]],
+                    generator,
+                    export_config,
+                    # only cached tiles need outputs that don't depend on the batch size
+                    batch_size if memory_cap_gb else None,
+                )
+                for key, output in zip(keys, outputs):
+                    if memory_cap_gb:
+                        tile_cache.put(key, output, memory_cap_gb)
+                    for j in pending[key]:
+                        upscaled[j] = output
+                pending = {}
+            # yield the patches that are ready in order
+            ready = []
+            while next_index in upscaled:
+                ready.append(upscaled.pop(next_index))
+                next_index += 1
+            if ready:
+                yield torch.stack(ready)
+        if memory_cap_gb:
+            tile_cache.count(int((routes == 2).sum()) - misses, misses)
+
+    def handle_tile_batch_size(self, patches: np.ndarray, scale: float, export_config: dict) -> int:
+        """
+        Determines the number of patches sent through the generator at once.
+        A fixed tile batch size is used as is, while "auto" fits as many
+        patches as the free video memory (or the memory budget on the cpu)
+        allows based on the memory required per upscaled pixel.
+        """
+        no_patches = len(patches)
+        # each tile worker upscales a batch of its own, within its share of the budget
+        no_workers = self.no_tile_workers()
+        if ExportConfig.tile_batch_size != "auto":
+            return max(1, min(int(ExportConfig.tile_batch_size) * no_workers, no_patches))
+        batch_size = self.max_batch_size(patches.shape[1], patches.shape[2], scale, export_config)
+        return max(1, min(batch_size * no_workers, no_patches))
+
+    def max_batch_size(self, height: int, width: int, scale: float, export_config: dict) -> int:
+        """
+        Returns the number of height x width images (or patches) that the free video
+        memory (or the memory budget on the cpu) fits at once, up to
+        ConfigReference.max_tile_batch_size.
+        """
+        output_pixels = height * width * scale * scale
+        if export_config["device"] != "cuda":
+            batch_size = math.floor(self.max_split_size(export_config) / output_pixels)
+        else:
+            free_memory, _ = torch.cuda.mem_get_info(0)
+            patch_memory = output_pixels * confref.vram_per_output_pixel
+            batch_size = math.floor(free_memory * confref.limit_vram_value / patch_memory)
+        return min(batch_size, confref.max_tile_batch_size)
+
+    def iter_upscaled_patches(
+            self,
+            patches: np.ndarray,
+            generator: Generator,
+            export_config: dict,
+            scale: float,
+            use_tile_cache: bool = True) -> Iterator[torch.Tensor]:
+        """
+        Upscales patches of shape (num of patches, h, w, c) in batches of
+        equally-shaped patches and yields the upscaled patches in their original
+        order as tensors of shape (n, c, h, w). Each batch is moved back to the
+        host once rather than once per patch. Batches are made contiguous.
+        use_tile_cache is False for batches of whole images, which the tile cache
+        doesn't apply to.
+        """
+        batch_size = self.handle_tile_batch_size(patches, scale, export_config)
+        write_log_to_file(
+            "INFO",
+            f"Upscaling {len(patches)} patches in batches of {batch_size}.",
+        )
+        yield from self.iter_routed_patches(
+            patches, np.full(len(patches), 2), generator, export_config, scale, batch_size, use_tile_cache
+        )
+
+    def upscale_batch(
+            self,
+            patches: np.ndarray,
+            generator: Generator,
+            export_config: dict,
+            batch_size: Optional[int] = None) -> torch.Tensor:
+        """
+        Upscales a batch of patches of shape (n, h, w, c) and returns it as a tensor
+        of shape (n, c, h, w). Batches of fewer than batch_size patches are padded
+        with copies of their last patch, since the kernels a backend runs (and so
+        the float rounding of the output) can depend on the batch size.
+        """
+        no_patches = len(patches)
+        if batch_size and no_patches < batch_size:
+            patches = np.concatenate(
+                [patches, np.repeat(patches[-1:], batch_size - no_patches, axis=0)]
+            )
+        return self.run_generator(patches, generator, export_config)[:no_patches]
+
+    def run_generator(self, patches: np.ndarray, generator: Generator, export_config: dict) -> torch.Tensor:
+        """
+        Runs the generator on a batch of patches of shape (n, h, w, c), split between
+        the tile workers if there are any.
+        """
+        if PatchUpscalingStrategy.tile_workers is not None and len(patches) > 1:
+            return PatchUpscalingStrategy.tile_workers.upscale(
+                patches, lambda tiles: self.run_local_generator(tiles, generator, export_config)
+            )
+        return self.run_local_generator(patches, generator, export_config)
+
+    def run_local_generator(self, patches: np.ndarray, generator: Generator, export_config: dict) -> torch.Tensor:
+        """Runs the generator of this process on a batch of patches of shape (n, h, w, c)."""
+        device = export_config["device"]
+        dtype = confref.upscale_precision_levels[device][export_config["upscale_precision"]][1]
+        batch = (
+            torch.from_numpy(patches)
+            .permute(0, 3, 1, 2)
+            .to(device)
+            .to(dtype=dtype)
+            .contiguous()
+        )
+        return generator(batch).cpu()
+
+    def upscale_patches(
+            self,
+            patches: np.ndarray,
+            generator: Generator,
+            export_config: dict,
+            scale: float) -> torch.Tensor:
+        """
+        Upscales patches of shape (num of patches, h, w, c) and returns
+        them as a single tensor of shape (num of patches, c, h, w).
+        """
+        return torch.cat(
+            list(self.iter_upscaled_patches(patches, generator, export_config, scale)), dim=0
+        )
+
     def upscale(
             self, 
             img: Image, 
@@ -147,57 +525,47 @@ class PatchUpscalingStrategy(UpscalingStrategy):
             export_config: dict, 
             scale: float) -> torch.Tensor:
         
-        full_image, p_shape, pad_size, lr_im_shape = self.handle_image_split(channel_type, scale, img)
-        new_patches = None
-        i = 0
-
-        if type(full_image) == np.ndarray:
-
-            for patch in full_image:
-                i += 1
-                if i == 1:
-                    new_patches = generator(
-                        confref.inference_transform(image=patch)["image"]
-                        .unsqueeze(0)
-                        .to(export_config["device"])
-                        .to(
-                            dtype=confref.upscale_precision_levels[export_config["device"]][
-                                export_config["upscale_precision"]
-                            ][1]
-                        )
-                    ).cpu()
-                else:
-                    new_patches = torch.cat(
-                        (
-                            new_patches,
-                            generator(
-                                confref.inference_transform(image=patch)["image"]
-                                .unsqueeze(0)
-                                .to(export_config["device"])
-                                .to(
-                                    dtype=confref.upscale_precision_levels[
-                                        export_config["device"]
-                                    ][export_config["upscale_precision"]][1]
-                                )
-                            ).cpu(),
-                        ),
-                        dim=0,
-                    )
-            new_patches: torch.Tensor = new_patches.permute((0, 2, 3, 1))
-            padded_size_scaled: Tuple[int] = tuple(np.multiply(p_shape[:2], scale)) + (3,)
-            scaled_image_shape: Tuple[int] = tuple(np.multiply(lr_im_shape[:2], scale)) + (
-                3,
-            )
+        # the color under fully transparent regions of the alpha channel is invisible
+        transparent_mask = getattr(img, "transparent_mask", None) if channel_type == "color" else None
+        triage = ExportConfig.tile_triage or transparent_mask is not None
+        full_image, p_shape, pad_size, lr_im_shape = (
+            self.handle_triage_split(channel_type, scale, img, export_config)
+            if triage
+            else self.handle_image_split(channel_type, scale, img, export_config)
+        )
 
-            full_image: torch.Tensor = stitch_together(
-                patches=new_patches,
-                padded_image_shape=padded_size_scaled,
-                target_shape=scaled_image_shape,
-                padding_size=pad_size * scale,
-            )
-      
+        if full_image is not None:
 
-            del new_patches
+            out_of_core = isinstance(full_image, OverlappingPatchBands)
+            target_shape = tuple(np.multiply(lr_im_shape[:2], scale))
+            stitcher = TileStitcher(
+                padded_image_shape=tuple(np.multiply(p_shape[:2], scale)),
+                target_shape=target_shape,
+                patch_size=int((full_image.shape[1] - 2 * pad_size) * scale),
+                padding_size=int(pad_size * scale),
+                # the borders of triaged tiles are always blended
+                blend=ExportConfig.blend_patch_overlap or triage,
+                image=self.out_of_core_buffer((*target_shape, 3), img) if out_of_core else None,
+            )
+            if transparent_mask is None:
+                transparent_bands = itertools.repeat(None)
+            elif out_of_core:
+                transparent_bands = self.iter_transparent_bands(transparent_mask, full_image, pad_size)
+            else:
+                transparent_bands = [self.split_transparent_mask(transparent_mask, full_image, pad_size)]
+            # out of core, only one band of patches is split and upscaled at a time
+            for patches, transparent in zip(full_image if out_of_core else [full_image], transparent_bands):
+                upscaled_patches = (
+                    self.iter_triaged_patches(
+                        patches, generator, export_config, scale, transparent=transparent
+                    )
+                    if triage
+                    else self.iter_upscaled_patches(patches, generator, export_config, scale)
+                )
+                # each batch is written into the stitched image as soon as it is upscaled
+                for new_patches in upscaled_patches:
+                    stitcher.add(new_patches)
+            full_image: torch.Tensor = stitcher.image
             return full_image
         else:
             return img.color_channels if channel_type == "color" else img.alpha
@@ -63,6 +63,28 @@ class ExportConfigSchema(BaseModel):
     export_color_depth: str
     split_large_image: bool
     patch_size: int
+    tile_batch_size: str
+    blend_patch_overlap: bool
+    pack_single_channels: bool
+    tile_triage: bool
+    triage_variance_threshold: float
+    skip_transparent_tiles: bool
+    binary_alpha_upscale: bool
+    normal_map_mode: str
+    renormalize_normals: bool
+    model_cache_memory_gb: float
+    tile_cache_memory_gb: float
+    pipeline_depth: int
+    workers: int
+    threads_per_worker: int
+    tile_workers: int
+    out_of_core: bool
+    max_memory_gb: float
+    pruning_mode: str
+    backend: str
+    intra_op_threads: int
+    inter_op_threads: int
+    calibration_dir: str
 
 class GeneratorArgumentSchema(BaseModel):
     scale: int